@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Price update of several configs (one data folder each) in one run.
+# Usage: python batch_update.py config1.json config2.json ... [--workers 4]
+#
+# Printings are fetched from Scryfall once for all configs, by this process
+# only, so its request pacing is the one rate limit of the whole batch.
+# The configs are then updated in parallel worker processes from the
+# shared fetch, like update.py does for one config.
+
+import contextlib
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+import utils_df as ud
+import utils_input as ui
+import utils_watchlist as uw
+import exchange_rates_module as xr
+
+from update import build_card_table, run_update
+
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# Fetched printings and the rate they were priced with, set in every worker
+_shared = {"updates": None, "eur_to_usd": None}
+
+
+def card_ids(config_file):
+    # Printings one config's update refreshes (card table, collections, watchlist)
+    inputs = ui.get_parameters(config_file)
+    data_dir = BASE_DIR / inputs["data_folder"]
+    csv_config = inputs["csv_config"]
+    vault_columns = inputs["data_column_types"]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        vault = ud.load_collection_to_df(data_dir / inputs["vault_file"], vault_columns, csv_config)
+        archive = ud.load_collection_to_df(data_dir / inputs["archive_file"], vault_columns, csv_config)
+        watchlist = uw.load_watchlist(data_dir / inputs.get("watchlist_file", "watchlist.csv"), csv_config=csv_config)
+        cards = build_card_table(vault, archive, data_dir / inputs.get("cards_file", "cards.csv"),
+                                 inputs.get("card_column_types", vault_columns), csv_config, watchlist)
+
+    return cards["id"].dropna().unique()
+
+
+def init_worker(updates, eur_to_usd):
+    _shared["updates"] = updates
+    _shared["eur_to_usd"] = eur_to_usd
+
+
+def apply_shared_updates(cards, rates=None):
+    # refresh_cards of run_update: prices come from the shared fetch, not from Scryfall
+    if rates is not None:
+        rates.record(_shared["eur_to_usd"])
+    if _shared["updates"] is not None:
+        ud.apply_card_updates(cards, _shared["updates"])
+    return cards
+
+
+def update_config(config_file):
+    # Runs one config's update. Returns its summary and its console output
+    start = time.perf_counter()
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            summary = run_update(ui.get_parameters(config_file), BASE_DIR, refresh_cards=apply_shared_updates)
+        summary["status"] = "ok"
+    except Exception as error:
+        summary = {"status": f"{type(error).__name__}: {error}"}
+
+    summary = {"config": config_file, **summary, "seconds": round(time.perf_counter() - start, 1)}
+    return summary, output.getvalue()
+
+
+def main():
+    args = sys.argv[1:]
+    workers = None
+    if "--workers" in args:
+        position = args.index("--workers")
+        workers = int(args[position + 1])
+        args = args[:position] + args[position + 2:]
+
+    if not args:
+        print("Usage: python batch_update.py config1.json config2.json ... [--workers 4]")
+        return 1
+
+    # Two configs on the same data folder would overwrite each other's saves
+    config_files, folders = [], {}
+    for config_file in args:
+        folder = (BASE_DIR / ui.get_parameters(config_file)["data_folder"]).resolve()
+        if folder in folders:
+            print(f"'{config_file}' uses the data folder of '{folders[folder]}'. Skipping...")
+            continue
+        folders[folder] = config_file
+        config_files.append(config_file)
+
+    workers = workers or min(len(config_files), os.cpu_count() or 1)
+
+    # Exchange rates of the batch, from the first config
+    inputs = ui.get_parameters(config_files[0])
+    xr.configure(BASE_DIR / inputs.get("exchange_rates_file", "exchange_rates.json"))
+    eur_to_usd, _ = xr.get_rate_provider().rates()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        id_lists = list(pool.map(card_ids, config_files))
+
+    # Each printing is fetched once, however many configs hold it
+    unique_ids = pd.unique(pd.Series([id for ids in id_lists for id in ids], dtype=object))
+    total = sum(len(ids) for ids in id_lists)
+    print(f"Fetching {len(unique_ids)} printings for {len(config_files)} configs "
+          f"({total - len(unique_ids)} shared lookups saved)...")
+    updates = ud.fetch_card_updates(unique_ids, eur_to_usd)
+
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(updates, eur_to_usd)) as pool:
+        futures = [pool.submit(update_config, config_file) for config_file in config_files]
+        for future in as_completed(futures):
+            summary, output = future.result()
+            print(f"\n========== {summary['config']} ==========")
+            print(output.rstrip())
+            summaries.append(summary)
+
+    # One row per config, in the order they were given
+    summaries = pd.DataFrame(summaries).set_index("config").loc[config_files].reset_index()
+    sys.stdout.write(ud.render_table(summaries, title="Batch update"))
+
+    return 0 if (summaries["status"] == "ok").all() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+# Micro benchmarks for the data layer, run on synthetic collections.
+# Usage: python benchmarks.py [benchmark name ...]  (no names runs all)
+
+import sys
+import time
+import uuid
+
+import pandas as pd
+import numpy as np
+
+import utils_ids as uid
+import utils_df as ud
+import utils_search as usearch
+import utils_integrity as uintegrity
+import utils_aggregates as uagg
+import utils_activity as ua
+import utils_pnl as upnl
+
+
+# ========== SYNTHETIC DATA ==========
+
+def make_synthetic_collection(n_rows, n_printings=None, seed=0):
+    # A vault-like dataframe with 'n_rows' physical cards over 'n_printings' printings
+    rng = np.random.default_rng(seed)
+    if n_printings is None:
+        n_printings = max(1, n_rows // 4)
+
+    printing_ids = np.array([str(uuid.UUID(int=int(x))) for x in rng.integers(0, 2**63, n_printings)], dtype=object)
+    printing_of_row = rng.integers(0, n_printings, n_rows)
+
+    df = pd.DataFrame({
+        "location": rng.choice(["binder a", "binder b", "box 1", "box 2", "deck"], n_rows),
+        "id": printing_ids[printing_of_row],
+        "pid": uid.decode_prefixed(np.arange(1, n_rows + 1), "p"),
+        "finish": rng.choice(["non-foil", "foil", "etched"], n_rows, p=[0.8, 0.18, 0.02]),
+        "language": rng.choice(["en", "de", "ja"], n_rows, p=[0.8, 0.1, 0.1]),
+        "condition": rng.choice(["NM", "EX", "GD"], n_rows),
+        "comment": "",
+        "name": np.char.add("Card ", (printing_of_row % 50000).astype(str)).astype(object),
+        "set_name": np.char.add("Set ", (printing_of_row % 300).astype(str)).astype(object),
+        "price trend usd": np.round(rng.lognormal(0, 1.5, n_rows), 2),
+        "price trend eur": np.round(rng.lognormal(0, 1.5, n_rows), 2),
+        "in date": pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 2000, n_rows), unit="D"),
+    })
+    return df
+
+
+def make_synthetic_activity(df, n_events, archived_share=0.2, seed=0):
+    """
+    Splits a synthetic collection into vault and archive and builds an
+    activity log that agrees with both. 'in date'/'out date' are set to the
+    dates of the cards' events. Returns (vault, archive, activity).
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = len(df)
+    n_out = max(1, int(n_events * archived_share))
+    n_in = n_events - n_out
+
+    event_days = pd.Timestamp("2020-01-01") + pd.to_timedelta(np.sort(rng.integers(0, 2000, n_events)), unit="D")
+    in_event = rng.integers(0, n_in, n_rows)
+    df = df.copy()
+    df["in date"] = event_days[in_event]
+
+    archived = rng.random(n_rows) < archived_share
+    out_event = np.where(archived, n_in + rng.integers(0, n_out, n_rows), -1)
+    out_event = np.maximum(out_event, in_event + 1)
+
+    in_lists = df.groupby(in_event)["pid"].agg(" ".join)
+    out_lists = df[archived].groupby(out_event[archived])["pid"].agg(" ".join)
+
+    activity = pd.DataFrame({
+        "id": uid.decode_prefixed(np.arange(1, n_events + 1), "e"),
+        "date": event_days,
+        "in": in_lists.reindex(range(n_events)).fillna("-").to_numpy(dtype=object),
+        "out": out_lists.reindex(range(n_events)).fillna("-").to_numpy(dtype=object),
+        "comment": "",
+    })
+
+    archive = df[archived].copy()
+    archive["out date"] = event_days[out_event[archived]]
+    vault = df[~archived].reset_index(drop=True)
+    return vault, archive.reset_index(drop=True), activity
+
+
+# ========== HELPERS ==========
+
+def timed(func, *args, repeat=3, **kwargs):
+    # Best of 'repeat' runs, in seconds
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(name, value, unit="s"):
+    if unit == "s":
+        print(f"  {name:<45} {value * 1000:>10.2f} ms")
+    else:
+        print(f"  {name:<45} {value / 2**20:>10.2f} MiB")
+
+
+# ========== BENCHMARKS ==========
+
+def bench_ids(n_rows=1_000_000):
+    print(f"Identifier interning ({n_rows} rows):")
+    df = make_synthetic_collection(n_rows)
+    ids = df["id"].astype(object)
+    pids = df["pid"].astype(object)
+
+    # Memory: strings vs binary vs surrogate keys
+    interner = uid.UuidInterner()
+    codes = interner.intern(ids)
+    pid_codes = uid.encode_prefixed(pids, "p")
+
+    report("id column as str objects", ids.memory_usage(deep=True), unit="b")
+    report("id column as 16-byte binary", uid.uuids_to_bytes(ids.iloc[:1000]).itemsize * n_rows, unit="b")
+    report("id column as int32 codes", codes.nbytes, unit="b")
+    report("pid column as str objects", pids.memory_usage(deep=True), unit="b")
+    report("pid column as int64 codes", pid_codes.nbytes, unit="b")
+
+    # Interning cost itself
+    report("intern ids", timed(uid.UuidInterner().intern, ids, repeat=1))
+    report("encode pids", timed(uid.encode_prefixed, pids, "p", repeat=1))
+
+    # isin on 1000 selected cards
+    selected = pids.sample(1000, random_state=0)
+    selected_codes = uid.encode_prefixed(selected, "p")
+    report("pid isin (str)", timed(pids.isin, selected.tolist()))
+    report("pid isin (int)", timed(np.isin, pid_codes, selected_codes))
+
+    # Join per-printing prices onto the physical rows
+    printings = pd.DataFrame({"id": pd.unique(ids)})
+    printings["price"] = np.arange(len(printings), dtype=float)
+    by_id = printings.set_index("id")["price"]
+    by_code = np.empty(len(interner))
+    by_code[interner.lookup(printings["id"])] = printings["price"].to_numpy()
+
+    report("id join (str index)", timed(lambda: ids.map(by_id)))
+    report("id join (int take)", timed(lambda: by_code[codes]))
+
+    # Frames keep string ids, so a per-call integer path pays the encoding too
+    few = selected.iloc[:5]
+    report("transfer mask, str isin", timed(pids.isin, few.tolist()))
+    report("transfer mask, encode + int isin",
+           timed(lambda: np.isin(uid.encode_prefixed(pids, "p"), uid.encode_prefixed(few, "p"))))
+
+    def interned_join():
+        keys = uid.UuidInterner(printings["id"])
+        return by_code[keys.lookup(ids)]
+
+    report("refresh join, str get_indexer", timed(lambda: pd.Index(printings["id"]).get_indexer(ids)))
+    report("refresh join, intern + int take", timed(interned_join))
+
+
+def bench_transfers(n_rows=200_000, n_events=50, cards_per_event=5):
+    print(f"Card transfers ({n_events} events of {cards_per_event} cards, {n_rows} row vault):")
+    vault = make_synthetic_collection(n_rows)
+    archive = make_synthetic_collection(n_rows, seed=1)
+    archive["pid"] = uid.decode_prefixed(np.arange(n_rows + 1, 2 * n_rows + 1), "p")
+
+    rng = np.random.default_rng(0)
+    events = rng.choice(vault["pid"].to_numpy(), (n_events, cards_per_event), replace=False)
+
+    def with_frames():
+        source, dest = vault, archive
+        for pids in events:
+            source, dest = ud.transfer_cards(source, dest, list(pids))
+        return source, dest
+
+    def with_stores():
+        source, dest = ud.CardStore(vault), ud.CardStore(archive)
+        for pids in events:
+            ud.transfer_cards(source, dest, list(pids))
+        return source.frame(), dest.frame()
+
+    report("DataFrame transfers", timed(with_frames, repeat=1))
+    report("CardStore transfers (incl. compaction)", timed(with_stores, repeat=1))
+
+
+def bench_search(n_rows=200_000, n_queries=20):
+    print(f"Name search ({n_queries} queries over {n_rows} rows):")
+    df = make_synthetic_collection(n_rows)
+    queries = [f"card {i}" for i in range(100, 100 + n_queries)]
+
+    def scans():
+        for query in queries:
+            ud.str_search_col(df, query)
+
+    index = usearch.TrigramIndex()
+    report("build trigram index", timed(index.add, df, repeat=1))
+
+    def probes():
+        for query in queries:
+            ud.str_search_col(df, query, index=index)
+
+    report("str.contains scans", timed(scans, repeat=1))
+    report("trigram index probes", timed(probes, repeat=1))
+
+
+def peek_df_reference(df, columns=None, char_limit=20):
+    # The previous peek_df: copy everything, then map a lambda over every cell
+    cols = [col for col in columns if col in df.columns] if columns else df.columns
+    view = df.copy()[cols]
+    for col in view.columns:
+        if pd.api.types.is_datetime64_any_dtype(view[col]):
+            view[col] = view[col].dt.strftime('%Y-%m-%d')
+    return view.map(lambda x: (str(x)[:char_limit] + '..') if isinstance(x, str) and len(str(x)) > char_limit else x)
+
+
+def bench_peek(n_rows=1_000_000):
+    print(f"peek_df ({n_rows} rows):")
+    df = make_synthetic_collection(n_rows)
+    df["comment"] = np.where(np.arange(n_rows) % 7 == 0, "a rather long comment about this card", "")
+    cols = ["pid", "name", "set_name", "finish", "comment", "in date", "price trend eur"]
+
+    same = peek_df_reference(df, cols).astype(str).equals(ud.peek_df(df, cols).astype(str))
+    print(f"  identical output: {same}")
+
+    report("previous peek_df, all rows", timed(peek_df_reference, df, cols, repeat=1))
+    report("peek_df, all rows", timed(ud.peek_df, df, cols, repeat=1))
+    report("peek_df, 20 rows", timed(ud.peek_df, df, cols, rows=20))
+
+
+def bench_display(n_rows=100_000):
+    print(f"display_dynamic_df ({n_rows} rows):")
+    df = ud.peek_df(make_synthetic_collection(n_rows), ["pid", "name", "set_name", "finish", "price trend eur"])
+    df.insert(0, "index", range(1, len(df) + 1))
+
+    # The first page of a long table, as seen in the search prompts
+    page = df.iloc[:ud.DISPLAY_PAGE_SIZE]
+    report("render one page", timed(ud.render_table, page))
+    report("render all rows", timed(ud.render_table, df, repeat=1))
+
+
+def bench_integrity(n_rows=1_000_000, n_events=100_000):
+    print(f"check_integrity ({n_rows} cards, {n_events} events):")
+    vault, archive, activity = make_synthetic_activity(make_synthetic_collection(n_rows), n_events)
+
+    report("consistent collections", timed(uintegrity.check_integrity, vault, archive, activity, repeat=1))
+    print(f"  violations: {len(uintegrity.check_integrity(vault, archive, activity))}")
+
+    # Drift: a hand edited date and a card missing from its event
+    vault.loc[0, "in date"] = pd.Timestamp("1999-01-01")
+    activity.loc[0, "in"] = activity.loc[0, "in"].split(" ", 1)[-1]
+    report("with drift", timed(uintegrity.check_integrity, vault, archive, activity, repeat=1))
+    print(f"  violations: {len(uintegrity.check_integrity(vault, archive, activity))}")
+
+
+def bench_aggregates(n_rows=1_000_000):
+    print(f"collection aggregates ({n_rows} rows):")
+    df = make_synthetic_collection(n_rows)
+
+    def scan_summary(df):
+        return df.groupby("set_name")[["price trend usd", "price trend eur"]].sum()
+
+    aggregates = uagg.CollectionAggregates(df)
+    report("full scan, value by set", timed(scan_summary, df))
+    report("aggregates, value by set", timed(aggregates.summary, "set_name"))
+
+    # A transfer of 100 cards out of the collection
+    store = ud.CardStore(df, aggregates=aggregates)
+    pids = df["pid"].sample(100, random_state=0).tolist()
+    report("take 100 cards with aggregates", timed(store.take, pids, repeat=1))
+
+
+def bench_pnl(n_rows=1_000_000, n_events=100_000):
+    print(f"profit and loss ({n_rows} cards):")
+    vault, archive, activity = make_synthetic_activity(make_synthetic_collection(n_rows), n_events)
+
+    rng = np.random.default_rng(0)
+    for df in [vault, archive]:
+        df["in price eur"] = np.round(df["price trend eur"] * rng.uniform(0.5, 1.2, len(df)), 2)
+        df["in trend usd"] = df["price trend usd"] * 0.9
+        df["in trend eur"] = df["price trend eur"] * 0.9
+    archive["out price eur"] = np.round(archive["price trend eur"] * rng.uniform(0.8, 1.5, len(archive)), 2)
+    links = ua.build_links(activity)
+
+    report("per card", timed(upnl.collection_pnl, vault, archive))
+    report("per card, with events", timed(upnl.collection_pnl, vault, archive, links=links))
+    pnl = upnl.collection_pnl(vault, archive, links=links)
+    report("grouped by status, location", timed(upnl.group_pnl, pnl, ["status", "location"]))
+
+
+BENCHMARKS = {
+    "ids": bench_ids,
+    "transfers": bench_transfers,
+    "search": bench_search,
+    "peek": bench_peek,
+    "display": bench_display,
+    "integrity": bench_integrity,
+    "aggregates": bench_aggregates,
+    "pnl": bench_pnl,
+}
+
+
+def main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark '{name}'. Options: {', '.join(BENCHMARKS)}")
+            continue
+        BENCHMARKS[name]()
+        print("")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# Thin client of service.py. Only uses the standard library, so it answers
+# in milliseconds instead of paying for pandas and the CSV loads.
+# Usage: python client.py config.json status
+#        python client.py config.json search <term> [--col name] [--fuzzy] [--archive] [--limit 50]
+#        python client.py config.json register <name> [--set <set code>] [--location <location>] ...
+#        python client.py config.json register --id <scryfall id> [--location <location>] ...
+#        python client.py config.json event <events.jsonl>
+#        python client.py config.json refresh|save|stop
+
+import json
+import sys
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+DEFAULT_PORT = 8765
+
+# Longest text shown per cell
+CHAR_LIMIT = 30
+
+
+def request(port, path, payload=None, timeout=None):
+    # GET without payload, POST with it. Returns (status, response JSON)
+    url = f"http://127.0.0.1:{port}{path}"
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read() or b"{}")
+
+
+def print_rows(rows):
+    # Plain text table of JSON rows
+    if not rows:
+        print("No rows.")
+        return
+
+    columns = list(rows[0])
+    cells = [[("" if row.get(col) is None else str(row[col]))[:CHAR_LIMIT] for col in columns] for row in rows]
+    cells = [[cell[:10] if col.endswith("date") else cell for col, cell in zip(columns, line)] for line in cells]
+    widths = [max(len(col), *(len(line[i]) for line in cells)) for i, col in enumerate(columns)]
+
+    print("  ".join(col.ljust(width) for col, width in zip(columns, widths)))
+    for line in cells:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+
+def options(args, flags=()):
+    # Splits '--key value' options and '--flag' switches from positional words
+    words, values = [], {}
+    i = 0
+    while i < len(args):
+        if args[i].startswith("--"):
+            key = args[i][2:]
+            if key in flags:
+                values[key] = True
+                i += 1
+                continue
+            values[key] = args[i + 1] if i + 1 < len(args) else ""
+            i += 2
+        else:
+            words.append(args[i])
+            i += 1
+    return words, values
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: python client.py config.json status|search|register|event|refresh|save|stop ...")
+        return 1
+
+    with open(sys.argv[1], 'r') as config_file:
+        inputs = json.load(config_file)
+    port = int(inputs.get("service_port", DEFAULT_PORT))
+    command, args = sys.argv[2], sys.argv[3:]
+
+    try:
+        if command == "status":
+            status, reply = request(port, "/status")
+
+        elif command == "search":
+            words, values = options(args, flags=("fuzzy", "archive"))
+            query = urllib.parse.urlencode({
+                "q": " ".join(words),
+                "col": values.get("col", "name"),
+                "fuzzy": int(bool(values.get("fuzzy"))),
+                "collection": "archive" if values.get("archive") else "vault",
+                "limit": values.get("limit", 50),
+            })
+            status, reply = request(port, f"/search?{query}")
+            if status == 200:
+                print(f"{reply['count']} hits in {reply['stacks']} stacks.")
+                print_rows(reply["rows"])
+                return 0
+
+        elif command == "register":
+            words, values = options(args)
+            card = {"name": " ".join(words), **values} if words else values
+            status, reply = request(port, "/register", {"cards": [card]})
+            if status == 200:
+                print_rows(reply["rows"])
+                return 0
+
+        elif command == "event":
+            with open(args[0], encoding="utf-8") as in_file:
+                events = [json.loads(line) for line in in_file if line.strip() and not line.startswith("#")]
+            status, reply = request(port, "/event", {"events": events})
+            if status == 200:
+                print(f"Accepted events: {', '.join(reply['accepted']) or '-'}")
+                print_rows(reply["problems"])
+                return 0
+
+        elif command in ["refresh", "save", "stop"]:
+            status, reply = request(port, f"/{command}", {})
+
+        else:
+            print(f"Unknown command '{command}'.")
+            return 1
+
+    except urllib.error.URLError as error:
+        print(f"No service on port {port} ({error.reason}). Start it with 'python service.py {sys.argv[1]}'.")
+        return 1
+
+    if status != 200:
+        print(f"Error ({status}): {reply.get('error')}")
+        if reply.get("candidates"):
+            print_rows(reply["candidates"])
+        return 1
+
+    for key, value in reply.items():
+        if isinstance(value, list):
+            print(f"{key}:")
+            print_rows(value)
+        else:
+            print(f"{key}: {value}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
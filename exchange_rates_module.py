@@ -1,65 +1,120 @@
 import time
 import json
+import threading
+from pathlib import Path
+
 import requests
 
-def main():
-    get_eur_usd_rate()
+import utils_storage as us
 
 
+# Seconds between two fetches (250 calls a month)
+MINIMUM_TIME_BETWEEN_CALLS = 10368
 
-def get_eur_usd_rate():
-    
-    file_path = 'exchange_rates.json'
+# Default rate file, next to the code rather than in the working directory
+DEFAULT_RATES_FILE = Path(__file__).resolve().parent / "exchange_rates.json"
+
+
+def main():
+    eur_to_usd, usd_to_eur = get_eur_usd_rate()
+    print("{:.4f} EUR/USD, {:.4f} USD/EUR".format(eur_to_usd, usd_to_eur))
 
-    # Get access_token
-    with open(file_path, 'r') as config_file:
-        config = json.load(config_file)
-    access_token = config['EXCHANGERATES_API_TOKEN']
 
-    
-    minimum_time_between_calls = 10368 # seconds (250 calls a month)
+class RateProvider:
+    """
+    EUR/USD rates of the process. The rate file (API token, last rates and
+    their timestamp) is read once; rates are kept in memory and fetched
+    again only when they are older than 'ttl' seconds, by one thread at a
+    time. rates() always returns (eur_to_usd, usd_to_eur).
+    """
 
+    def __init__(self, file_path=DEFAULT_RATES_FILE, ttl=MINIMUM_TIME_BETWEEN_CALLS):
+        self.file_path = Path(file_path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
 
-    # Old Exchange rates
-    usd_to_eur = config["usd_to_eur"]
-    eur_to_usd = config["eur_to_usd"]
+        with open(self.file_path, 'r') as config_file:
+            self._config = json.load(config_file)
 
+        self.eur_to_usd = float(self._config["eur_to_usd"])
 
-    current_timestamp = time.time()
-    if "timestamp" in config and current_timestamp - config["timestamp"] < minimum_time_between_calls:
-    #if False:
-       
-        # Return old exchange rates if they are recent enough.
-        return eur_to_usd, usd_to_eur
+        # Time of the last fetch attempt. A failed one isn't retried before the TTL
+        self._checked = self._config.get("timestamp", 0)
 
-    else:
+    def rates(self):
+        # (eur_to_usd, usd_to_eur), fetched first if they are out of date
+        if time.time() - self._checked >= self.ttl:
+            with self._lock:
+                # Another thread may have refreshed while this one waited
+                if time.time() - self._checked >= self.ttl:
+                    self._refresh()
+                    self._checked = time.time()
+
+        eur_to_usd = self.eur_to_usd
+        return eur_to_usd, 1 / eur_to_usd
+
+    def _refresh(self):
+        access_token = self._config['EXCHANGERATES_API_TOKEN']
         url = f"https://api.exchangerate.host/latest?symbols=USD&access_key={access_token}"
-        response = requests.get(url)
-        
+
+        try:
+            response = requests.get(url, timeout=10)
+        except requests.RequestException as error:
+            print(f"Error fetching new exchange rates ({error}). Using old ones ")
+            return
+
         # Check if the response is OK (status code 200)
-        if response.status_code == 200:
-            data = response.json()
-
-            # Get the USD to EUR rate
-            eur_to_usd = data['rates']['USD']
-            config["eur_to_usd"] = eur_to_usd
-            # Inverse for EUR to USD
-            usd_to_eur = 1 / eur_to_usd
-            config["usd_to_eur"] = usd_to_eur
-
-            # Store timestamp
-            config["timestamp"] = data['timestamp']
-
-            # Write the JSON data to the config file
-            with open(file_path, 'w') as filename:
-                json.dump(config, filename, indent=4)
-
-            print("{:.2f} EUR/USD fetched".format(eur_to_usd))
-            return usd_to_eur, eur_to_usd
-        else:
+        if response.status_code != 200:
             print(f"Error ({response.status_code}) fetching new exchange rates. Using old ones ")
+            return
+
+        data = response.json()
+        eur_to_usd = data['rates']['USD']
+
+        self._config["eur_to_usd"] = eur_to_usd
+        self._config["usd_to_eur"] = 1 / eur_to_usd
+        self._config["timestamp"] = data['timestamp']
+
+        # Written before the rates are published, so the file never lags behind
+        us.atomic_write(self.file_path, json.dumps(self._config, indent=4).encode("utf-8"))
+
+        self.eur_to_usd = eur_to_usd
+        print("{:.2f} EUR/USD fetched".format(eur_to_usd))
+
+
+# ========== PROCESS PROVIDER ==========
+
+_provider = None
+_provider_lock = threading.Lock()
+_provider_path = DEFAULT_RATES_FILE
+
+
+def configure(file_path):
+    """
+    Sets the rate file of the process, usually from the project config
+    ("exchange_rates_file", relative to the project folder). Must be called
+    before the first rate is needed; a provider in use is replaced.
+    """
+    global _provider, _provider_path
+    with _provider_lock:
+        _provider_path = Path(file_path)
+        _provider = None
+
+
+def get_rate_provider():
+    # The provider of the process, created on first use
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = RateProvider(_provider_path)
+    return _provider
+
+
+def get_eur_usd_rate():
+    # (eur_to_usd, usd_to_eur) from the process provider
+    return get_rate_provider().rates()
 
-            return eur_to_usd, usd_to_eur
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+
+# Batch event entry: reads events from a JSONL file instead of prompting.
+# Usage: python ingest_events.py config.json events.jsonl
+#
+# One event per line (see events_template.jsonl):
+#   {"date": "2024-03-01", "in": [...], "out": [...], "comment": "..."}
+# A card reference is a pid ("p00012"), a Scryfall id, or an object with
+# "pid", "id" or "name" + "set", optionally narrowed by "finish",
+# "language" and "condition", and repeated with "count".
+#  - 'in' references pick vault cards that aren't in any 'in' event yet
+#  - 'out' references pick vault cards, which move to the archive
+# Events with any unresolved reference are skipped and listed.
+
+import json
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+import utils_df as ud
+import utils_ids as uid
+import utils_input as ui
+import utils_activity as ua
+import utils_storage as us
+import utils_aggregates as uagg
+import utils_rates as ur
+import exchange_rates_module as xr
+
+from make_event import activity_cleanup
+
+
+# Optional attributes that narrow an id or name+set reference
+REFERENCE_ATTRIBUTES = ["finish", "language", "condition"]
+
+# Columns of the unresolved rows report
+PROBLEM_COLUMNS = ["line", "direction", "reference", "reason"]
+
+
+# ========== PARSING ==========
+
+def parse_reference(item):
+    """
+    Normalizes one card reference to a dict with 'kind' ('pid', 'id' or
+    'name') and its key fields. Returns None if the reference is malformed.
+    """
+    if isinstance(item, str):
+        item = {"pid": item} if uid.pid_to_int(item) != uid.MISSING_CODE else {"id": item}
+    if not isinstance(item, dict):
+        return None
+
+    ref = {attr: str(item[attr]).strip().lower() for attr in REFERENCE_ATTRIBUTES if item.get(attr)}
+    ref["count"] = item.get("count", 1)
+
+    if item.get("pid"):
+        if uid.pid_to_int(item["pid"]) == uid.MISSING_CODE:
+            return None
+        ref.update(kind="pid", pid=item["pid"])
+    elif item.get("id"):
+        try:
+            ref.update(kind="id", id=str(uuid.UUID(str(item["id"]))))
+        except ValueError:
+            return None
+    elif item.get("name") and item.get("set"):
+        ref.update(kind="name", name=str(item["name"]).strip().lower(), set_name=str(item["set"]).strip().lower())
+    else:
+        return None
+
+    return ref
+
+
+def read_event_file(file_path):
+    # Parses the JSONL file, see parse_event_lines
+    with open(file_path, encoding="utf-8") as in_file:
+        return parse_event_lines(in_file)
+
+
+def parse_event_lines(lines):
+    """
+    Parses JSONL lines. Returns (events, refs, problems): one events row
+    per line, one refs row per referenced card, and the malformed rows.
+    """
+    events, refs, problems = [], [], []
+
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError as error:
+            problems.append({"line": line_no, "direction": None, "reference": line[:40], "reason": f"invalid JSON ({error.msg})"})
+            continue
+        if not isinstance(entry, dict):
+            problems.append({"line": line_no, "direction": None, "reference": line[:40], "reason": "not a JSON object"})
+            continue
+
+        events.append({"line": line_no, "date": entry.get("date"), "comment": entry.get("comment") or ""})
+
+        for direction in ua.DIRECTIONS:
+            items = entry.get(direction) or []
+            if not isinstance(items, list):
+                items = [items]
+
+            for item in items:
+                ref = parse_reference(item)
+                text = json.dumps(item, ensure_ascii=False) if not isinstance(item, str) else item
+                if ref is None:
+                    problems.append({"line": line_no, "direction": direction, "reference": text, "reason": "malformed reference"})
+                    continue
+
+                count = ref.pop("count")
+                if not isinstance(count, int) or count < 1:
+                    problems.append({"line": line_no, "direction": direction, "reference": text, "reason": "invalid count"})
+                    continue
+
+                refs.extend([{"line": line_no, "direction": direction, "reference": text, **ref}] * count)
+
+    events = pd.DataFrame(events, columns=["line", "date", "comment"])
+    events["date"] = pd.to_datetime(events["date"], errors="coerce", format="%Y-%m-%d").dt.normalize()
+
+    refs = pd.DataFrame(refs, columns=["line", "direction", "reference", "kind", "pid", "id", "name", "set_name"] + REFERENCE_ATTRIBUTES)
+    return events, refs, problems
+
+
+# ========== RESOLVING ==========
+
+def match_references(refs, candidates, keys):
+    """
+    Pairs every reference with a distinct candidate row that has the same
+    'keys'. The k-th reference of a key (in 'refs' order) gets the k-th
+    candidate (in 'candidates' order). Returns the matched pids, aligned
+    with 'refs', None where no candidate was left.
+    """
+    left = refs[keys].copy()
+    left["slot"] = left.groupby(keys, sort=False).cumcount()
+
+    right = candidates[keys + ["pid"]].copy()
+    right["slot"] = right.groupby(keys, sort=False).cumcount()
+
+    # A left merge keeps the order of 'refs'
+    merged = left.merge(right, on=keys + ["slot"], how="left")
+    return pd.Series(merged["pid"].to_numpy(dtype=object), index=refs.index)
+
+
+def resolve_references(refs, vault, assigned_codes):
+    """
+    Finds the vault pid of every reference, all references of a kind at
+    once. 'assigned_codes' are the pid codes already listed in 'in' events.
+    Returns the pids aligned with 'refs' (None if unresolved) and the
+    reason of every failure.
+    """
+    pids = pd.Series(None, index=refs.index, dtype=object)
+    reasons = pd.Series(None, index=refs.index, dtype=object)
+
+    # Candidate cards, earliest acquisition first
+    cards = pd.DataFrame({
+        "pid": vault["pid"].to_numpy(dtype=object),
+        "id": vault["id"].astype(object).str.lower().to_numpy() if "id" in vault.columns else None,
+        "name": vault["name"].astype(object).str.strip().str.lower().to_numpy() if "name" in vault.columns else None,
+        "set_name": vault["set_name"].astype(object).str.strip().str.lower().to_numpy() if "set_name" in vault.columns else None,
+        "in date": vault["in date"].to_numpy() if "in date" in vault.columns else pd.NaT,
+    })
+    for attr in REFERENCE_ATTRIBUTES:
+        cards[attr] = vault[attr].astype(object).str.strip().str.lower().to_numpy() if attr in vault.columns else None
+    cards["assigned"] = np.isin(uid.encode_prefixed(cards["pid"], "p"), assigned_codes)
+    cards = cards[cards["pid"].notna()].sort_values(["in date", "pid"], na_position="last", kind="stable")
+
+    for direction in ua.DIRECTIONS:
+        in_direction = refs["direction"] == direction
+        pool = cards[~cards["assigned"]] if direction == "in" else cards
+
+        # ========== BY PID ==========
+        by_pid = refs[in_direction & (refs["kind"] == "pid")]
+        listed_twice = by_pid["pid"].duplicated(keep="first")
+        known = by_pid["pid"].isin(pool["pid"])
+
+        pids[by_pid.index[known & ~listed_twice]] = by_pid.loc[known & ~listed_twice, "pid"]
+        reasons[by_pid.index[listed_twice]] = "pid listed twice"
+        if direction == "in":
+            in_vault = by_pid["pid"].isin(cards["pid"])
+            reasons[by_pid.index[~known & in_vault & ~listed_twice]] = "pid already has an in event"
+            reasons[by_pid.index[~in_vault & ~listed_twice]] = "pid not in vault"
+        else:
+            reasons[by_pid.index[~known & ~listed_twice]] = "pid not in vault"
+
+        pool = pool[~pool["pid"].isin(by_pid["pid"])]
+
+        # ========== BY ID OR NAME + SET ==========
+        # Most specific references first, so they don't lose their cards to vaguer ones
+        for kind, base_keys in [("id", ["id"]), ("name", ["name", "set_name"])]:
+            of_kind = refs[in_direction & (refs["kind"] == kind)]
+            if of_kind.empty:
+                continue
+
+            given = of_kind[REFERENCE_ATTRIBUTES].notna()
+            patterns = given.apply(tuple, axis=1)
+            for pattern in sorted(patterns.unique(), key=sum, reverse=True):
+                group = of_kind[patterns == pattern]
+                keys = base_keys + [attr for attr, present in zip(REFERENCE_ATTRIBUTES, pattern) if present]
+
+                matched = match_references(group, pool, keys)
+                found = matched.notna()
+                pids[matched.index[found]] = matched[found]
+                reasons[matched.index[~found]] = "no unassigned card in vault" if direction == "in" else "no matching card in vault"
+
+                pool = pool[~pool["pid"].isin(matched[found])]
+
+    return pids, reasons
+
+
+# ========== APPLYING ==========
+
+def build_activity_rows(refs, events, event_ids):
+    # One activity row per event, pids joined per direction
+    lists = refs.groupby(["line", "direction"])["pid"].agg(" ".join).unstack()
+
+    rows = pd.DataFrame({
+        "id": event_ids,
+        "date": events["date"].to_numpy(),
+        "comment": events["comment"].to_numpy(dtype=object),
+    })
+    for direction in ua.DIRECTIONS:
+        pid_lists = lists[direction] if direction in lists.columns else pd.Series(dtype=object)
+        rows[direction] = pid_lists.reindex(events["line"]).fillna(ua.EMPTY_PLACEHOLDER).to_numpy(dtype=object)
+
+    return rows[["id", "date", "in", "out", "comment"]]
+
+
+def ingest_events(source, vault, archive, activity, allocator, aggregates=None):
+    """
+    Reads, resolves and applies the events of 'source', a JSONL file path
+    or a list of JSONL lines. Accepted events
+    are applied in one pass: 'in date'/'out date' are set, outbound cards
+    move to the archive and the events are appended to the activity log.
+    'aggregates' (of the vault) follow the outbound cards.
+    Returns (vault, archive, activity, accepted events, problems DataFrame).
+    """
+    events, refs, problems = read_event_file(source) if isinstance(source, (str, Path)) else parse_event_lines(source)
+
+    bad_dates = events["date"].isna()
+    problems += [{"line": line, "direction": None, "reference": None, "reason": "missing or invalid date"}
+                 for line in events.loc[bad_dates, "line"]]
+
+    # Lines that are already rejected don't take part in resolving
+    refs = refs[~refs["line"].isin([problem["line"] for problem in problems])]
+
+    # Earlier events get the earlier acquired cards
+    refs["date"] = refs["line"].map(events.set_index("line")["date"])
+    refs = refs.sort_values(["date", "line"], kind="stable")
+
+    links = ua.build_links(activity)
+    assigned_codes = links.pids[links.directions == ua.DIRECTION_CODES["in"]]
+    refs["pid"], reasons = resolve_references(refs, vault, assigned_codes)
+
+    unresolved = refs[reasons.notna()]
+    problems += [{"line": line, "direction": direction, "reference": reference, "reason": reason}
+                 for line, direction, reference, reason in zip(unresolved["line"], unresolved["direction"],
+                                                               unresolved["reference"], reasons[reasons.notna()])]
+
+    # Events are all or nothing
+    problems = pd.DataFrame(problems, columns=PROBLEM_COLUMNS)
+    empty = ~events["line"].isin(refs["line"]) & ~events["line"].isin(problems["line"])
+    if empty.any():
+        problems = pd.concat([problems, pd.DataFrame({"line": events.loc[empty, "line"],
+                                                      "reason": "event lists no cards"})], ignore_index=True)
+    problems = problems.sort_values("line", kind="stable").reset_index(drop=True)
+
+    accepted = events[~events["line"].isin(problems["line"])].sort_values(["date", "line"], kind="stable")
+    refs = refs[refs["line"].isin(accepted["line"])]
+    if accepted.empty:
+        return vault, archive, activity, accepted, problems
+
+    event_ids = allocator.reserve("e", len(accepted))
+    new_rows = build_activity_rows(refs, accepted, event_ids)
+
+    # ========== TRANSFER CARDS ==========
+    inbound = refs[refs["direction"] == "in"]
+    outbound = refs[refs["direction"] == "out"]
+
+    if not inbound.empty:
+        in_dates = pd.Series(inbound["date"].to_numpy(), index=inbound["pid"].to_numpy())
+        rows = vault["pid"].isin(in_dates.index)
+        vault.loc[rows, "in date"] = vault.loc[rows, "pid"].map(in_dates).to_numpy()
+
+    if not outbound.empty:
+        # Vault has no 'out date' column of its own
+        outdate_flag = "out date" in archive.columns and "out date" not in vault.columns
+        if outdate_flag:
+            vault["out date"] = pd.Series(dtype=archive["out date"].dtype)
+
+        out_dates = pd.Series(outbound["date"].to_numpy(), index=outbound["pid"].to_numpy())
+        rows = vault["pid"].isin(out_dates.index)
+        if "out date" in vault.columns:
+            vault.loc[rows, "out date"] = vault.loc[rows, "pid"].map(out_dates).to_numpy()
+
+        vault, archive = ud.transfer_cards(vault, archive, out_dates.index.tolist(), source_aggregates=aggregates)
+
+        if outdate_flag:
+            vault = vault.drop(columns="out date")
+
+    # ========== ADD EVENTS TO ACTIVITY ==========
+    new_rows = new_rows.astype({col: activity[col].dtype for col in new_rows.columns if col in activity.columns})
+    activity = pd.concat([activity, new_rows], ignore_index=True) if len(activity) else new_rows
+
+    return vault, archive, activity, accepted, problems
+
+
+def main():
+
+    # GET CONFIG PARAMETERS
+    config_file = sys.argv[1]
+    inputs = ui.get_parameters(config_file)
+
+    if len(sys.argv) < 3:
+        print("Usage: python ingest_events.py config.json events.jsonl")
+        return 1
+    events_path = Path(sys.argv[2])
+
+    BASE_DIR = Path(__file__).resolve().parent
+    DATA_DIR = BASE_DIR / inputs["data_folder"]
+
+    # Exchange rates of the process, from the file named in the config
+    xr.configure(BASE_DIR / inputs.get("exchange_rates_file", "exchange_rates.json"))
+
+    # LOAD CARD DATABASES
+    vault_columns = inputs["data_column_types"]
+    csv_config = inputs["csv_config"]
+    vault_path = DATA_DIR / inputs["vault_file"]
+    archive_path = DATA_DIR / inputs["archive_file"]
+    vault = ud.load_collection_to_df(vault_path, vault_columns, csv_config)
+    archive = ud.load_collection_to_df(archive_path, vault_columns, csv_config)
+
+    activity_columns = inputs["activity_column_types"]
+    activity_path = DATA_DIR / inputs["activity_file"]
+    if os.path.exists(activity_path):
+        activity = ud.load_collection_to_df(activity_path, activity_columns, csv_config)
+    else:
+        activity = pd.DataFrame(columns=activity_columns.keys()).astype(activity_columns)
+
+    allocator = ui.IdAllocator()
+    allocator.scan(activity["id"], "e")
+    for df in [vault, archive, us.catalog_pid_frame(vault_path)]:
+        allocator.scan(df["pid"], "p")
+
+    aggregates_path = DATA_DIR / inputs.get("aggregates_file", "aggregates.csv")
+    aggregates, _ = uagg.load_aggregates(aggregates_path, vault, csv_config)
+
+    # Cards added to the vault by hand get their pids first
+    # They are priced with the rate of their in date
+    rates_path = DATA_DIR / inputs.get("exchange_rate_table_file", "exchange_rate_table.csv")
+    rates = ur.load_rate_table(rates_path, csv_config)
+    print("CARD REGISTER:")
+    if ud.register_new_cards(vault, allocator=allocator, aggregates=aggregates, rates=rates):
+        ur.save_rate_table(rates, rates_path, csv_config)
+
+    # ========== INGEST ==========
+    start = time.perf_counter()
+    vault, archive, activity, accepted, problems = ingest_events(events_path, vault, archive, activity, allocator, aggregates)
+    elapsed = time.perf_counter() - start
+
+    n_events = len(accepted) + problems["line"].nunique()
+    print(f"Ingested {len(accepted)} of {n_events} events in {elapsed:.2f} s "
+          f"({len(accepted) / max(elapsed, 1e-9):.0f} events/s).")
+
+    if not problems.empty:
+        ud.display_dynamic_df(problems, title="Unresolved Rows",
+                              description="Events with unresolved rows were skipped.")
+
+    if accepted.empty:
+        print("Nothing to save.")
+        return 0
+
+    # ========== SAVE ==========
+    activity = activity_cleanup(activity)
+
+    if ud.save_collection(vault, vault_path, csv_config, vault_columns):
+        print(f"Vault saved to '{vault_path}'.")
+        uagg.save_aggregates(aggregates, aggregates_path, csv_config)
+    if ud.save_collection(archive, archive_path, csv_config, vault_columns):
+        print(f"Archive saved to '{archive_path}'.")
+    if ud.save_collection(activity, activity_path, csv_config):
+        print(f"Activity saved to '{activity_path}'.")
+
+        # Keep the event-card link table in sync with the saved log
+        links_path = DATA_DIR / inputs.get("activity_links_file", "activity_links.npz")
+        ua.load_links(links_path, activity_path, activity)
+
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,12 @@ import numpy as np
 
 import utils_df as ud
 import utils_input as ui
+import utils_storage as us
+import utils_activity as ua
+import utils_search as usearch
+import utils_aggregates as uagg
+import utils_rates as ur
+import exchange_rates_module as xr
 
 from make_event import make_card_sequence
 from make_event import activity_cleanup
@@ -21,8 +27,14 @@ def main():
     config_file = sys.argv[1]
     inputs = ui.get_parameters(config_file)
 
+    # Optional vault partitions (locations) to work on. Default is all
+    vault_partitions = sys.argv[2:] or None
+
     BASE_DIR = Path(__file__).resolve().parent
     DATA_DIR = BASE_DIR / inputs["data_folder"]
+
+    # Exchange rates of the process, from the file named in the config
+    xr.configure(BASE_DIR / inputs.get("exchange_rates_file", "exchange_rates.json"))
     
 
     # LOAD CARD DATABASES
@@ -31,7 +43,7 @@ def main():
     vault_columns = inputs["data_column_types"]
     csv_config = inputs["csv_config"]
     vault_path = DATA_DIR / vault_file
-    vault = ud.load_collection_to_df(vault_path, vault_columns, csv_config)
+    vault = ud.load_collection_to_df(vault_path, vault_columns, csv_config, vault_partitions)
 
     # Archived cards
     archive_file = inputs["archive_file"]
@@ -49,8 +61,12 @@ def main():
 
     
 
-    # Get id Series
-    event_ids = activity["id"]
+    # One id allocator for new pids and event ids, each source scanned once
+    # Partitions that weren't loaded still reserve their pids
+    allocator = ui.IdAllocator()
+    allocator.scan(activity["id"], "e")
+    for df in [vault, archive, us.catalog_pid_frame(vault_path)]:
+        allocator.scan(df["pid"], "p")
 
     
     # Add column for storing card exit dates to vault if such is in archive.
@@ -61,9 +77,24 @@ def main():
         outdate_flag = True
 
 
+    # Vault aggregates, kept in sync with registrations and transfers
+    # Only a complete vault can be checked against (and saved to) the file
+    aggregates_path = DATA_DIR / inputs.get("aggregates_file", "aggregates.csv")
+    if vault_partitions is None:
+        aggregates, _ = uagg.load_aggregates(aggregates_path, vault, csv_config)
+    else:
+        aggregates = uagg.CollectionAggregates(vault)
+
+    # Daily exchange rates. New cards are priced with the rate of their in date
+    rates_path = DATA_DIR / inputs.get("exchange_rate_table_file", "exchange_rate_table.csv")
+    rates = ur.load_rate_table(rates_path, csv_config)
+
     # First register all new cards
     print("CARD REGISTER:")
-    new_pids = ud.register_new_cards(vault, [archive])
+    new_pids = ud.register_new_cards(vault, allocator=allocator, aggregates=aggregates, rates=rates)
+
+    # 'new_pids' shrinks as cards are assigned to events, this keeps what was registered
+    registered_pids = list(new_pids)
 
     unassigned_inbound_df = None
 
@@ -77,10 +108,16 @@ def main():
         if "out date" not in unassigned_inbound_df.columns:
             unassigned_inbound_df["out date"] = pd.Series(dtype=vault_columns["out date"])
 
+    # Stores make each event's transfer cost proportional to its cards
+    # The vault store keeps a name search index in sync with its transfers
+    vault_store = ud.CardStore(vault, search_index=usearch.TrigramIndex(), aggregates=aggregates)
+    archive_store = ud.CardStore(archive)
+
     while True:
 
         # Create new event
-        new_id = ui.generate_next_pid(event_ids,"e")
+        # The id is only allocated if the event is accepted
+        new_id = allocator.peek("e")
 
         event_entry = { "id": new_id }
 
@@ -177,7 +214,7 @@ def main():
         # ========== OUTBOUND ==========
 
         search_prompt = "OUTBOUND: Provide a search term."
-        outbound_list, outbound_string, outbound_df = make_card_sequence([vault], vault_columns, search_prompt=search_prompt)
+        outbound_list, outbound_string, outbound_df = make_card_sequence([vault_store], vault_columns, search_prompt=search_prompt)
         event_entry["out"] = outbound_string
 
 
@@ -236,16 +273,16 @@ def main():
             # ========== TRANSFER CARDS ==========
             
             # Add exit date to outbound cards
-            if outdate_col in archive.columns:
+            if outdate_col in archive_store.columns:
                 # Update only the 'out date' column for rows matching your PIDs
-                vault.loc[vault['pid'].isin(outbound_list), 'out date'] = event_date
+                vault_store.set_values(outbound_list, 'out date', event_date)
             
             # Move outbound cards to "archive"
-            vault, archive = ud.transfer_cards(vault, archive, outbound_list)
+            ud.transfer_cards(vault_store, archive_store, outbound_list)
 
             # Also set the "in date" of the new cards
             if accepted_pids:
-                vault.loc[vault['pid'].isin(accepted_pids), 'in date'] = event_date
+                vault_store.set_values(accepted_pids, 'in date', event_date)
 
             
             # ========== ADD EVENT TO ACTIVITY ==========
@@ -253,12 +290,12 @@ def main():
             # Add the new event to "activity"
             new_event_df = pd.DataFrame([event_entry]).astype(activity_columns)
 
-            # Ensure the ID column remains an string to match your 'event_ids' set logic
+            # Ensure the ID column remains an string
             new_event_df['id'] = new_event_df['id'].astype(str)
 
             activity = pd.concat([activity, new_event_df], ignore_index=True)
             
-            event_ids = activity["id"] # Refresh the tracker
+            allocator.next("e") # Claim the event id
 
             # ============ UPDATE UNASSIGNED NEW PIDS ============
 
@@ -286,6 +323,10 @@ def main():
         if usr_input == "n" or usr_input == "no": break
 
     
+    # Apply all transfers of the session at once
+    vault = vault_store.frame()
+    archive = archive_store.frame()
+
     # Remove the outdate column from vault
     if outdate_flag:
         vault.drop(columns=outdate_col, inplace=True)
@@ -298,13 +339,21 @@ def main():
         # Remove ghost events, and sort by date
         activity = activity_cleanup(activity)
 
-        vault.to_csv(vault_path, index=False, **csv_config)
-        archive.to_csv(archive_path, index=False, **csv_config)
-        activity.to_csv(activity_path, index=False, **csv_config)
-        
-        print(f"Vault saved to '{vault_path}'.")
-        print(f"Archive saved to '{archive_path}'.")
-        print(f"Activity saved to '{activity_path}'.")
+        # Unchanged collections are skipped
+        if ud.save_collection(vault, vault_path, csv_config, vault_columns, vault_partitions):
+            print(f"Vault saved to '{vault_path}'.")
+            if vault_partitions is None:
+                uagg.save_aggregates(aggregates, aggregates_path, csv_config)
+        if ud.save_collection(archive, archive_path, csv_config, vault_columns):
+            print(f"Archive saved to '{archive_path}'.")
+        if ud.save_collection(activity, activity_path, csv_config):
+            print(f"Activity saved to '{activity_path}'.")
+
+            # Keep the event-card link table in sync with the saved log
+            links_path = DATA_DIR / inputs.get("activity_links_file", "activity_links.npz")
+            ua.load_links(links_path, activity_path, activity)
+        if registered_pids:
+            ur.save_rate_table(rates, rates_path, csv_config)
 
     return 0
 
@@ -5,6 +5,9 @@ import pandas as pd
 
 import utils_df as ud
 import utils_input as ui
+import utils_activity as ua
+import utils_search as usearch
+import utils_stacks as ust
  
 import sys
 import re
@@ -16,6 +19,9 @@ def main():
     config_file = sys.argv[1]
     inputs = ui.get_parameters(config_file)
 
+    # Optional vault partitions (locations) to search. Default is all
+    vault_partitions = sys.argv[2:] or None
+
     BASE_DIR = Path(__file__).resolve().parent
     DATA_DIR = BASE_DIR / inputs["data_folder"]
     
@@ -26,7 +32,7 @@ def main():
     vault_columns = inputs["data_column_types"]
     csv_config = inputs["csv_config"]
     vault_path = DATA_DIR / vault_file
-    vault = ud.load_collection_to_df(vault_path, vault_columns, csv_config)
+    vault = ud.load_collection_to_df(vault_path, vault_columns, csv_config, vault_partitions)
 
     # Archived cards
     archive_file = inputs["archive_file"]
@@ -43,15 +49,29 @@ def main():
         activity = pd.DataFrame(columns=activity_columns.keys()).astype(activity_columns)
 
     
-    # Get all preexisting event ids
-    event_ids = activity["id"]
+    # Scan all preexisting event ids once
+    allocator = ui.IdAllocator()
+    allocator.scan(activity["id"], "e")
+
+    # pid -> events index, kept in sync with every change to activity
+    activity_index = ua.ActivityIndex(activity)
+
+
+    # Name search index over vault and archive, built once per session
+    search_index = usearch.TrigramIndex()
+    search_index.add(vault)
+    search_index.add(archive)
 
+    # pid -> row lookups of the hits, also kept for the session
+    vault_positions = usearch.row_positions(vault)
+    archive_positions = usearch.row_positions(archive)
 
     # BEGIN EVENT REGISTRATION
     while True:
 
         # Create new event
-        new_id = ui.generate_next_pid(event_ids,"e")
+        # The id is only allocated if the event is accepted
+        new_id = allocator.peek("e")
 
         print(f"Beginning event {new_id}...")
         event_entry = { "id": new_id }
@@ -61,7 +81,8 @@ def main():
 
         # Get card sequence
         search_prompt = "INBOUND: Provide a search term."
-        inbound_pid_list, inbound_string, inbound_df = make_card_sequence([vault, archive], vault_columns, search_prompt=search_prompt)
+        inbound_pid_list, inbound_string, inbound_df = make_card_sequence([vault, archive], vault_columns, search_prompt=search_prompt, index=search_index,
+                                                                                positions=[vault_positions, archive_positions])
         event_entry["in"] = inbound_string
 
         # Get event date from inbound card data
@@ -80,14 +101,15 @@ def main():
 
         # Get a dataframe containing the prior inbound activity of these cards
         # Returns None if there is not prior activity
-        inbound_activity = get_prior_activity(activity, "in", inbound_pid_list, inbound_name_list)
+        inbound_activity = get_prior_activity(activity, "in", inbound_pid_list, inbound_name_list, activity_index)
  
 
         # ========== OUTBOUND ==========
         
 
         search_prompt = "OUTBOUND: Provide a search term."
-        outbound_pid_list, outbound_string, outbound_df = make_card_sequence([archive], vault_columns, search_prompt=search_prompt)
+        outbound_pid_list, outbound_string, outbound_df = make_card_sequence([archive], vault_columns, search_prompt=search_prompt, index=search_index,
+                                                                                   positions=[archive_positions])
         event_entry["out"] = outbound_string
 
         # Get event date from outbound card data
@@ -103,7 +125,7 @@ def main():
                                 for pid in outbound_pid_list if pid in outbound_df['pid'].values]
 
         # Get a dataframe containing the prior inbound activity of these cards
-        outbound_activity = get_prior_activity(activity, "out", outbound_pid_list, outbound_name_list)
+        outbound_activity = get_prior_activity(activity, "out", outbound_pid_list, outbound_name_list, activity_index)
 
 
         # DO NOT REGISTER IF BOTH INBOUND AND OUTBOUND ARE EMPTY
@@ -199,12 +221,10 @@ def main():
                 # === Deleting Cards from prior events ===
 
                 # Delete event cards from prior inbound events
-                for pid in inbound_pid_list:
-                    remove_pid_from_events(activity, "in", pid)
+                remove_pids_from_events(activity, "in", inbound_pid_list, activity_index)
 
                 # Delete event cards from prior outbound events
-                for pid in outbound_pid_list:
-                    remove_pid_from_events(activity, "out", pid)
+                remove_pids_from_events(activity, "out", outbound_pid_list, activity_index)
 
                 # ========================================
 
@@ -216,10 +236,10 @@ def main():
                 new_event_df['id'] = new_event_df['id'].astype(str)
                 
                 activity = pd.concat([activity, new_event_df], ignore_index=True)
+                activity_index.add_event(activity.index[-1], event_entry)
 
-                # UPDATE THE SERIES HERE
-                # We re-assign event_ids to the updated 'id' column of your activity DF
-                event_ids = activity["id"]
+                # Claim the event id
+                allocator.next("e")
 
         print("=====")
 
@@ -236,16 +256,22 @@ def main():
         # Remove ghost events, and sort by date
         activity = activity_cleanup(activity)
 
-        activity.to_csv(activity_path, index=False, **csv_config)
-        print(f"Activity saved to '{activity_path}'.")
+        if ud.save_collection(activity, activity_path, csv_config):
+            print(f"Activity saved to '{activity_path}'.")
+
+            # Keep the event-card link table in sync with the saved log
+            links_path = DATA_DIR / inputs.get("activity_links_file", "activity_links.npz")
+            ua.load_links(links_path, activity_path, activity)
 
 
 
 # Generates pid list and string from user queries
-def make_card_sequence(dfs, df_col_types, cols=None, search_prompt=None):
-    # 'dfs' needs to be a list of DataFrames
+def make_card_sequence(dfs, df_col_types, cols=None, search_prompt=None, index=None, positions=None):
+    # 'dfs' needs to be a list of DataFrames (or CardStores)
     # Each dataframe in 'dfs' must contain columns that are specified in 'config.json'
     # 'df_col_types' is a dictionary containing column names as keys, and the corresponding dtypes as values
+    # 'index' is an optional usearch.TrigramIndex covering the DataFrames in 'dfs'
+    # 'positions' are optional usearch.row_positions of the DataFrames in 'dfs', in the same order
     default_cols = [
         "name", 
         "set_name", 
@@ -257,6 +283,10 @@ def make_card_sequence(dfs, df_col_types, cols=None, search_prompt=None):
         "out date"
         ]
     if cols is None: cols = default_cols
+
+    # Lookups of the DataFrames, built once for all the queries
+    if positions is None:
+        positions = [None if isinstance(df, ud.CardStore) else usearch.row_positions(df) for df in dfs]
     
     pid_list = []
     pid_string = ""
@@ -275,17 +305,28 @@ def make_card_sequence(dfs, df_col_types, cols=None, search_prompt=None):
         if query == "--q": break
 
         # Get query results for outbound card
-        hits_list = []
+        # Literal matches first. If there are none, close matches (typos)
+        for fuzzy in [False, True]:
+            hits_list = []
+
+            for df, df_positions in zip(dfs, positions):
+                # CardStores search their live rows without compacting
+                if isinstance(df, ud.CardStore):
+                    hits = df.search(query, fuzzy=fuzzy)
+                else:
+                    hits = ud.str_search_col(df, query, index=index, fuzzy=fuzzy, positions=df_positions)
+                if hits.empty: continue
+                hits_list.append(hits)
 
-        for df in dfs:
-            hits = ud.str_search_col(df, query)
-            if hits.empty: continue
-            hits_list.append(hits)
+            if hits_list: break
 
         if len(hits_list) == 0:
             print(f"No hits.")
             continue
 
+        if fuzzy:
+            print(f"No exact hits for '{query}'. Showing close matches.")
+
         all_hits = pd.concat(hits_list, ignore_index=True, sort=False)
 
         # If a display column is missing from hits, add it
@@ -293,16 +334,20 @@ def make_card_sequence(dfs, df_col_types, cols=None, search_prompt=None):
             if col not in all_hits.columns:
                 all_hits[col] = pd.Series(dtype=df_col_types[col])
 
+        # Identical copies are listed once, as a stack with its quantity
+        # Pids are only picked out of a stack when it's selected
+        stacks = ust.collapse(all_hits, columns=cols)
+
         # Assign indexs to rows via the "index" column
-        all_hits["index"] = range(1, len(all_hits) + 1)
+        stacks["index"] = range(1, len(stacks) + 1)
         
-        actual_cols = ["index"]
+        actual_cols = ["index", "quantity"]
         actual_cols.extend(cols)
 
-        view_hits = ud.peek_df(all_hits, columns=actual_cols)
+        view_hits = ud.peek_df(stacks, columns=actual_cols)
 
         if len(view_hits) == 1:
-            index=0
+            selection = 0
         else:
             title = f"Hits for '{query}':"
             ud.display_dynamic_df(view_hits, title=title)
@@ -314,23 +359,32 @@ def make_card_sequence(dfs, df_col_types, cols=None, search_prompt=None):
                 print("Faulty input.")
                 continue
 
-            # Convert usr_input into dataframe row index
-            index = usr_input - 1
+            # Convert usr_input into a row position of the stacks
+            # ('index' is the search index)
+            selection = usr_input - 1
 
         # Make sure the index is within bounds of dataframe
-        if 0 <= index < len(all_hits):
-
-            # Get pid from index given by user
-            target_pid = all_hits.iloc[index]['pid']
+        if 0 <= selection < len(stacks):
 
-            # Prevent duplicates
-            if target_pid not in pid_list: 
-                pid_list.append(target_pid)
+            # Copies of the stack that haven't been selected yet
+            available = ust.take_pids(stacks.iloc[selection], len(all_hits), taken=pid_list)
 
-                selected_row = all_hits.iloc[[index]].copy()
-                selected_rows.append(selected_row)
-            else:
+            if not available:
                 print("Card has already been selected.")
+                continue
+
+            count = 1
+            if len(available) > 1:
+                count = ui.get_typed_input(f"How many of the {len(available)} copies?", target_type="int", default=1)
+                if count is None or count < 1:
+                    print("Faulty input.")
+                    continue
+
+            target_pids = available[:count]
+            pid_list.extend(target_pids)
+
+            selected_row = all_hits[all_hits["pid"].isin(target_pids)].copy()
+            selected_rows.append(selected_row)
 
         else:
             print("Failed to select card.")
@@ -343,16 +397,21 @@ def make_card_sequence(dfs, df_col_types, cols=None, search_prompt=None):
 
 
 
-def get_prior_activity(event_df, col, pid_list, name_list):
+def get_prior_activity(event_df, col, pid_list, name_list, index=None):
+
+    # Exact pid lookups through the pid -> events index
+    # Without a prebuilt index, one is built for this call
+    if index is None:
+        index = ua.ActivityIndex(event_df)
 
     # 1. Search and tag each result with the PID that found it
     prior_activity_list = []
     for i, pid in enumerate(pid_list):
-        search_result = ud.str_search_col(event_df, pid, col)
+        labels = index.events(pid, col)
         
-        if search_result is not None and not search_result.empty:
+        if labels:
             # Create a copy so we don't modify the original 'event_df' df
-            search_result = search_result.copy()
+            search_result = event_df.loc[labels].copy()
             
             # Add the 'subject_pid' column
             search_result['subject_name'] = name_list[i]
@@ -367,25 +426,50 @@ def get_prior_activity(event_df, col, pid_list, name_list):
     else:
         return None
 
-def remove_pid_from_events(event_df, col, target_pid):
-    pattern = rf'\b{target_pid}\b'
-    
-    # Remove the PID
-    event_df[col] = event_df[col].str.replace(pattern, '', regex=True)
-    
-    # The "Magic" line: cleans all double spaces, leading, and trailing spaces at once
-    # and handles your "-" placeholder logic.
-    event_df[col] = event_df[col].apply(lambda x: ' '.join(x.split()) if isinstance(x, str) and x.strip() else "-")
+def remove_pid_from_events(event_df, col, target_pid, index=None):
+    remove_pids_from_events(event_df, col, [target_pid], index)
+
+
+# Removes a set of pids from the 'col' ("in"/"out") lists of all events
+# Only the rows listing one of the pids are rewritten, found through 'index'
+def remove_pids_from_events(event_df, col, pids, index=None):
+
+    pids = set(pids)
+    if not pids or col not in event_df.columns:
+        return
+
+    if index is None:
+        index = ua.ActivityIndex(event_df)
+
+    # Rows that list at least one of the pids
+    labels = sorted({label for pid in pids for label in index.events(pid, col)})
+
+    if labels:
+        # Rebuild those strings without the pids, "-" when nothing is left
+        cells = event_df.loc[labels, col]
+        event_df.loc[labels, col] = [
+            " ".join(p for p in ua.split_pids(cell) if p not in pids) or ua.EMPTY_PLACEHOLDER
+            for cell in cells
+            ]
+
+    for pid in pids:
+        index.remove_pid(pid, col)
 
 
 # Function that removes "ghost" events (events with both empty inbound and empty outbound).
-# It also arranges the events in chronological order
+# It also normalizes the in/out lists and arranges the events in chronological order
 def activity_cleanup(df, verbose=False):
 
     if "in" not in df.columns or "out" not in df.columns:
         print(f"Activity doesn't contain 'in' and 'out' columns. Skipping...")
         return df
 
+    # 0. NORMALIZE THE PID LISTS
+    # Single spaces, "-" for empty or missing cells. remove_pids_from_events only rewrites the rows it touches
+    for col in ["in", "out"]:
+        normalized = df[col].str.split().str.join(" ")
+        df[col] = normalized.where(normalized.str.len() > 0, ua.EMPTY_PLACEHOLDER)
+
     # 1. REMOVE EMPTY EVENTS
     # We look for rows where both 'in' and 'out' are the placeholder '-'
     empty_mask = (df['in'] == "-") & (df['out'] == "-")
@@ -1,6 +1,7 @@
 import requests
 import time
 import json
+from urllib.parse import urlencode
 
 import pandas as pd
 
@@ -11,10 +12,6 @@ import exchange_rates_module as rates
 from display_module import display_card_image
 
 
-usd_to_eur = 0.0
-rate_fetch_flag = False
-
-
 def get_card_batch(scryfall_payload, reference_time=None):
     url = "https://api.scryfall.com/cards/collection"
     delay_between_requests = 0.1 # Scryfall requests 100 ms (0.1 s) between requests
@@ -91,6 +88,38 @@ def query_name(input_string, attempts=3, params={}):
     return {}
 
 
+# Non-interactive lookup of one printing, for callers without a console (service.py)
+# Returns (card_json, candidates). card_json is {} unless exactly one printing matches;
+# candidates are the printings that matched, at most one page of them
+def find_printing(name=None, set_code=None, card_id=None):
+
+    # A Scryfall id is a single printing
+    if card_id:
+        card_json = card_req(f"https://api.scryfall.com/cards/{card_id}", verbose=False)
+        return card_json, []
+
+    set_filter = f" set:{set_code}" if set_code else ""
+
+    # Exact name first, then any name containing the words
+    for query in [f'!"{name}"{set_filter}', f"{name}{set_filter}"]:
+        url = "https://api.scryfall.com/cards/search?" + urlencode({"q": query, "unique": "prints"})
+        cards_data = card_req(url, verbose=False)
+        if cards_data.get("total_cards"):
+            break
+    else:
+        return {}, []
+
+    if cards_data["total_cards"] == 1:
+        return cards_data["data"][0], []
+
+    candidates = [{"id": card.get("id"),
+                   "name": card.get("name"),
+                   "set": card.get("set"),
+                   "set_name": card.get("set_name"),
+                   "collector_number": card.get("collector_number")} for card in cards_data["data"]]
+    return {}, candidates
+
+
 def uuid_fetch(uuid):
     url = f"https://api.scryfall.com/cards/{uuid}"
     return card_req(url)
@@ -360,15 +389,9 @@ def card_req(url, data=None, verbose=True):
 
 # Get right price data with price key
 def get_price(json, version, currency="eur"):
-    global usd_to_eur
-    global eur_to_usd
-    global rate_fetch_flag
-
 
-    # Fetch exchange rate
-    if not rate_fetch_flag:
-        eur_to_usd, usd_to_eur,  = rates.get_eur_usd_rate()
-        rate_fetch_flag = True
+    # Exchange rates, cached by the process provider
+    eur_to_usd, usd_to_eur = rates.get_rate_provider().rates()
 
     # Compute price from version and currency (eur/usd)
     if version == "etched":
@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+
+# Service mode: loads the collections and their indexes once and serves
+# searches and changes over a localhost HTTP API.
+# Usage: python service.py config.json
+# client.py talks to it without importing pandas.
+#
+#   GET  /status                              counts and save state
+#   GET  /search?q=...&col=name&fuzzy=1&collection=vault&limit=50
+#   POST /register  {"cards": [{"name": "...", "set": "...", "location": "...", ...}]}
+#                   or {"cards": [{"id": "<scryfall id>", ...}]}, never prompts
+#   POST /event     {"events": [{"date": ..., "in": [...], "out": [...], "comment": ...}]}
+#   POST /refresh   refreshes prices, like update.py
+#   POST /save      saves now instead of at the next period
+#   POST /stop      saves and stops the service
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+import pandas as pd
+
+import utils_df as ud
+import utils_input as ui
+import utils_cards as uc
+import utils_activity as ua
+import utils_search as usearch
+import utils_aggregates as uagg
+import utils_history as uh
+import utils_rates as ur
+import utils_watchlist as uw
+import utils_stacks as ust
+import exchange_rates_module as xr
+import scryfall_module as scryfall
+
+from ingest_events import ingest_events
+from make_event import activity_cleanup
+from update import add_timeline_entry
+
+
+DEFAULT_PORT = 8765
+
+# Seconds between saves of changed collections
+SAVE_SECONDS = 300
+
+SEARCH_LIMIT = 50
+
+# Columns of the rows returned to clients
+RESULT_COLUMNS = ["pid", "location", "name", "set_name", "finish", "language", "condition",
+                  "comment", "price trend eur", "in date", "out date"]
+
+# Columns of search hits, one row per stack of identical copies
+STACK_RESULT_COLUMNS = ["quantity", "location", "name", "set_name", "finish", "language", "condition",
+                        "price trend eur", "value eur", "pids"]
+
+JOURNAL_FILE = "service_journal.jsonl"
+
+
+def to_records(df, columns=None):
+    # JSON-ready rows: dates as ISO strings, missing values as None
+    columns = [col for col in (columns or df.columns) if col in df.columns]
+    return json.loads(df[columns].to_json(orient="records", date_format="iso"))
+
+
+class AmbiguousCard(ValueError):
+    # A registered name matches several printings. 'candidates' lists them
+    def __init__(self, message, candidates):
+        super().__init__(message)
+        self.candidates = candidates
+
+
+def find_card(card):
+    # Scryfall json of one /register card, without prompting
+    card_json, candidates = scryfall.find_printing(card.get("name"), card.get("set"), card.get("id"))
+    if card_json:
+        return card_json
+
+    label = card.get("id") or card.get("name")
+    if candidates:
+        raise AmbiguousCard(f"'{label}' matches {len(candidates)} printings, give its 'set' or 'id'", candidates)
+    raise ValueError(f"no card found for '{label}'")
+
+
+class CollectionService:
+    """
+    The vault, archive, activity and card table of one config, loaded once,
+    with the search index, aggregates and id allocator built over them.
+    Requests run one at a time under a lock, so changes are serialized.
+    Every change is appended to a journal (and fsynced) before it's
+    answered; saves write each file atomically and then empty the journal,
+    and a journal left by a crash is replayed at start.
+    """
+
+    def __init__(self, inputs, base_dir):
+        self.inputs = inputs
+        self.data_dir = base_dir / inputs["data_folder"]
+        self.csv_config = inputs["csv_config"]
+        self.vault_columns = inputs["data_column_types"]
+        self.activity_columns = inputs["activity_column_types"]
+        self.timeline_columns = inputs["timeline_column_types"]
+        self.cards_columns = inputs.get("card_column_types", self.vault_columns)
+
+        self.lock = threading.RLock()
+        self.refresh_lock = threading.Lock()
+        self.dirty = False
+        self.last_save = time.time()
+
+        # ========== PATHS ==========
+        data_dir = self.data_dir
+        self.vault_path = data_dir / inputs["vault_file"]
+        self.archive_path = data_dir / inputs["archive_file"]
+        self.activity_path = data_dir / inputs["activity_file"]
+        self.links_path = data_dir / inputs.get("activity_links_file", "activity_links.npz")
+        self.cards_path = data_dir / inputs.get("cards_file", "cards.csv")
+        self.timeline_path = data_dir / inputs["timeline_file"]
+        self.aggregates_path = data_dir / inputs.get("aggregates_file", "aggregates.csv")
+        self.rates_path = data_dir / inputs.get("exchange_rate_table_file", "exchange_rate_table.csv")
+        self.watchlist_state_path = data_dir / inputs.get("watchlist_state_file", "watchlist_state.csv")
+        self.alerts_path = data_dir / inputs.get("alerts_file", "alerts.csv")
+        self.journal_path = data_dir / inputs.get("service_journal_file", JOURNAL_FILE)
+
+        # ========== LOAD ==========
+        self.vault = ud.load_collection_to_df(self.vault_path, self.vault_columns, self.csv_config)
+        self.archive = ud.load_collection_to_df(self.archive_path, self.vault_columns, self.csv_config)
+
+        if os.path.exists(self.activity_path):
+            self.activity = ud.load_collection_to_df(self.activity_path, self.activity_columns, self.csv_config)
+        else:
+            self.activity = pd.DataFrame(columns=self.activity_columns.keys()).astype(self.activity_columns)
+
+        if os.path.exists(self.timeline_path):
+            self.timeline = ud.load_collection_to_df(self.timeline_path, self.timeline_columns, self.csv_config)
+        else:
+            self.timeline = pd.DataFrame(columns=self.timeline_columns.keys()).astype(self.timeline_columns)
+
+        self.cards = uc.merge_card_tables(uc.split_collection(self.vault)[0], uc.split_collection(self.archive)[0])
+        if os.path.exists(self.cards_path):
+            stored_cards = ud.load_collection_to_df(self.cards_path, self.cards_columns, self.csv_config)
+            self.cards = uc.merge_card_tables(stored_cards, self.cards)
+
+        self.history = uh.PriceHistory(data_dir / inputs.get("price_history_folder", "price_history"))
+        self.rates = ur.load_rate_table(self.rates_path, self.csv_config)
+        self.watchlist = uw.load_watchlist(data_dir / inputs.get("watchlist_file", "watchlist.csv"),
+                                           self.watchlist_state_path, self.csv_config)
+
+        # Changes that were answered but not saved before the last stop
+        replayed = self.replay_journal()
+        if replayed:
+            print(f"Replayed {replayed} journal entries from '{self.journal_path}'.")
+
+        # ========== INDEXES ==========
+        self.aggregates, _ = uagg.load_aggregates(self.aggregates_path, self.vault, self.csv_config)
+        self.search_index = usearch.TrigramIndex()
+        self.search_index.add(self.vault)
+        self.archive_index = usearch.TrigramIndex()
+        self.archive_index.add(self.archive)
+
+        # pid -> row lookups, rebuilt when a collection is replaced
+        self._positions = {}
+
+        self.allocator = ui.IdAllocator()
+        self.allocator.scan(self.activity["id"], "e")
+        for df in [self.vault, self.archive]:
+            self.allocator.scan(df["pid"], "p")
+
+    # ========== JOURNAL ==========
+
+    def journal(self, record):
+        # Appends one change to the journal, durable before the client hears back
+        with open(self.journal_path, "a", encoding="utf-8") as out_file:
+            out_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out_file.flush()
+            os.fsync(out_file.fileno())
+
+    def replay_journal(self):
+        """
+        Reapplies the journal. Entries carry their results (registered rows,
+        resolved event rows), so replaying one that a partial save already
+        wrote changes nothing.
+        """
+        if not os.path.exists(self.journal_path):
+            return 0
+
+        replayed = 0
+        with open(self.journal_path, encoding="utf-8") as in_file:
+            for line in in_file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line was never answered
+                    continue
+
+                rows = pd.DataFrame(record.get("rows", []))
+                if record.get("op") == "register":
+                    self.apply_registered(rows)
+                elif record.get("op") == "events":
+                    self.apply_event_rows(rows)
+                replayed += 1
+
+        self.dirty = replayed > 0
+        return replayed
+
+    def apply_registered(self, rows):
+        # Adds registered rows whose pids aren't in the vault or archive yet
+        known = self.vault["pid"].isin(rows["pid"]).any() or self.archive["pid"].isin(rows["pid"]).any()
+        if known:
+            rows = rows[~rows["pid"].isin(self.vault["pid"]) & ~rows["pid"].isin(self.archive["pid"])]
+        if rows.empty:
+            return
+        rows = rows.astype({col: dtype for col, dtype in self.vault_columns.items() if col in rows.columns})
+        self.vault = pd.concat([self.vault, rows], ignore_index=True, sort=False)
+
+    def apply_event_rows(self, rows):
+        # Applies resolved activity rows. Parts that were already applied are skipped
+        for event in rows.to_dict("records"):
+            date = pd.Timestamp(event["date"]).tz_localize(None).normalize()
+            in_pids, out_pids = ua.split_pids(event["in"]), ua.split_pids(event["out"])
+
+            if not self.activity["id"].isin([event["id"]]).any():
+                new_row = pd.DataFrame([event])
+                new_row["date"] = date
+                new_row = new_row.astype({col: dtype for col, dtype in self.activity_columns.items() if col in new_row.columns})
+                self.activity = pd.concat([self.activity, new_row], ignore_index=True)
+
+            if in_pids:
+                self.vault.loc[self.vault["pid"].isin(in_pids), "in date"] = date
+
+            # Cards whose move reached the archive file but not the vault file only leave the vault
+            archived = set(self.archive.loc[self.archive["pid"].isin(out_pids), "pid"])
+            self.vault = self.vault[~self.vault["pid"].isin(list(archived))]
+
+            self.vault, self.archive = ud.transfer_cards(self.vault, self.archive, [pid for pid in out_pids if pid not in archived])
+            if "out date" in self.archive.columns:
+                self.archive.loc[self.archive["pid"].isin(out_pids), "out date"] = date
+
+    # ========== QUERIES ==========
+
+    def status(self):
+        with self.lock:
+            totals = self.aggregates.totals()
+            return {
+                "vault": len(self.vault),
+                "archive": len(self.archive),
+                "events": len(self.activity),
+                "printings": len(self.cards),
+                "value usd": round(totals["usd"], 2),
+                "value eur": round(totals["eur"], 2),
+                "unsaved changes": self.dirty,
+                "last save": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.last_save)),
+            }
+
+    def positions(self, df):
+        # usearch.row_positions of a collection frame, kept while the frame is current
+        cached = self._positions.get(id(df))
+        if cached is None or cached[0] is not df:
+            self._positions = {key: value for key, value in self._positions.items()
+                               if value[0] is self.vault or value[0] is self.archive}
+            cached = self._positions[id(df)] = (df, usearch.row_positions(df))
+        return cached[1]
+
+    def search(self, term, col="name", fuzzy=False, collection="vault", limit=SEARCH_LIMIT):
+        with self.lock:
+            df = self.vault if collection == "vault" else self.archive
+            index = self.search_index if collection == "vault" else self.archive_index
+            if index.indexes(col):
+                hits = usearch.rank_rows(df, index.search(term, col, fuzzy=fuzzy), positions=self.positions(df))
+            else:
+                hits = ud.str_search_col(df, term, col, fuzzy=fuzzy)
+
+            # Identical copies are one row, with their quantity and pids
+            stacks = ust.collapse(hits)
+            return {"count": len(hits), "stacks": len(stacks), "rows": to_records(stacks.head(limit), STACK_RESULT_COLUMNS)}
+
+    # ========== CHANGES ==========
+
+    def register(self, cards):
+        """
+        Adds cards by Scryfall id ("id"), or by name ("name") with an optional
+        set code ("set"), with optional vault columns (location, finish, ...).
+        Nothing is asked on the console: a name with several printings is an
+        AmbiguousCard error listing them. All or nothing.
+        """
+        if not cards or not all(isinstance(card, dict) and (card.get("name") or card.get("id")) for card in cards):
+            raise ValueError("'cards' must be a list of objects with a 'name' or an 'id'")
+
+        with self.lock:
+            rows = pd.DataFrame(cards)
+            rows = rows[[col for col in rows.columns if col in self.vault.columns and col != "pid"]]
+            rows = rows.reindex(columns=self.vault.columns).astype(self.vault.dtypes.to_dict())
+            # Rates as of now. RateTable.merge replaces its arrays, so this view stays valid
+            rates = ur.RateTable(self.rates.days, self.rates.rates)
+
+        # The Scryfall lookups run on the new rows alone, without the lock.
+        # Their pids are placeholders until the rows join the vault
+        found = [find_card(card) for card in cards]
+        rows["name"] = rows["name"].fillna(pd.Series([card_json["name"] for card_json in found], index=rows.index))
+        ud.register_new_cards(rows, allocator=ui.IdAllocator(), rates=rates, lookup=lambda row: dict(found[row.name]))
+        if not rows["pid"].notna().all():
+            raise ValueError("registration failed, nothing was added")
+
+        with self.lock:
+            new_pids = self.allocator.reserve("p", len(rows))
+            rows["pid"] = pd.Series(new_pids, index=rows.index, dtype=self.vault["pid"].dtype)
+            self.rates.record(xr.get_rate_provider().rates()[0])
+
+            start = len(self.vault)
+            self.vault = pd.concat([self.vault, rows], ignore_index=True, sort=False)
+            registered = self.vault.iloc[start:]
+            self.aggregates.add(registered)
+            self.search_index.add(registered)
+            self.journal({"op": "register", "rows": to_records(registered)})
+            self.dirty = True
+            return {"registered": new_pids, "rows": to_records(registered, RESULT_COLUMNS)}
+
+    def add_events(self, events):
+        # Events in the ingest_events.py format. Events with unresolved cards are skipped
+        if not events or not all(isinstance(event, dict) for event in events):
+            raise ValueError("'events' must be a list of objects")
+
+        with self.lock:
+            lines = [json.dumps(event, ensure_ascii=False, default=str) for event in events]
+            start = len(self.activity)
+            self.vault, self.archive, self.activity, accepted, problems = ingest_events(
+                lines, self.vault, self.archive, self.activity, self.allocator, self.aggregates)
+
+            new_rows = self.activity.iloc[start:]
+            if not new_rows.empty:
+                moved = [pid for pids in new_rows["out"] for pid in ua.split_pids(pids)]
+                self.search_index.remove(moved)
+                self.archive_index.add(self.archive[self.archive["pid"].isin(moved)])
+                self.journal({"op": "events", "rows": to_records(new_rows)})
+                self.dirty = True
+
+            return {"accepted": new_rows["id"].tolist(), "problems": to_records(problems)}
+
+    def refresh(self):
+        """
+        Refreshes prices like update.py. Prices are fetched on a copy of the
+        card table without holding the lock, so searches keep working.
+        """
+        with self.refresh_lock:
+            with self.lock:
+                # Printings registered since the last refresh join the card table
+                cards = uc.merge_card_tables(self.cards, uc.split_collection(self.vault)[0])
+                if self.watchlist is not None:
+                    watched = pd.DataFrame({"id": self.watchlist.watched_ids()}, columns=uc.CARD_COLUMNS)
+                    cards = uc.merge_card_tables(cards, watched)
+
+            ud.update_card_table(cards)
+
+            with self.lock:
+                self.rates.record(xr.get_rate_provider().rates()[0])
+                recorded = self.history.append(cards)
+                self.cards = uc.merge_card_tables(cards, self.cards)
+                ud.update_collection(self.vault, self.cards, self.aggregates, self.watchlist)
+                ud.update_collection(self.archive, self.cards)
+                self.timeline = add_timeline_entry(self.timeline, self.aggregates.totals(), self.timeline_columns)
+                self.dirty = True
+                alerts = self.watchlist.take_alerts() if self.watchlist is not None else pd.DataFrame()
+                uw.log_alerts(alerts, self.alerts_path, self.csv_config)
+                return {"printings": len(cards), "price records": recorded, "alerts": to_records(alerts)}
+
+    def save(self, force=False):
+        # Writes the changed files, then empties the journal
+        with self.lock:
+            if not self.dirty and not force:
+                return {"saved": False}
+
+            csv_config = self.csv_config
+            self.activity = activity_cleanup(self.activity)
+
+            ud.save_collection(self.vault, self.vault_path, csv_config, self.vault_columns)
+            ud.save_collection(self.archive, self.archive_path, csv_config, self.vault_columns)
+            if ud.save_collection(self.activity, self.activity_path, csv_config):
+                ua.load_links(self.links_path, self.activity_path, self.activity)
+            ud.save_collection(self.cards, self.cards_path, csv_config, self.cards_columns)
+            ud.save_collection(self.timeline, self.timeline_path, csv_config)
+            uagg.save_aggregates(self.aggregates, self.aggregates_path, csv_config)
+            ur.save_rate_table(self.rates, self.rates_path, csv_config)
+            if self.watchlist is not None:
+                uw.save_state(self.watchlist, self.watchlist_state_path, csv_config)
+
+            # Everything in the journal is on disk now
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+
+            self.dirty = False
+            self.last_save = time.time()
+            return {"saved": True}
+
+
+def make_handler(service, server_state):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def reply(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def run(self, action):
+            try:
+                self.reply(200, action())
+            except AmbiguousCard as error:
+                self.reply(400, {"error": str(error), "candidates": error.candidates})
+            except (ValueError, KeyError) as error:
+                self.reply(400, {"error": str(error)})
+            except Exception as error:
+                self.reply(500, {"error": f"{type(error).__name__}: {error}"})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+            if url.path == "/status":
+                self.run(service.status)
+            elif url.path == "/search":
+                self.run(lambda: service.search(query["q"], col=query.get("col", "name"),
+                                                fuzzy=query.get("fuzzy") in ["1", "true"],
+                                                collection=query.get("collection", "vault"),
+                                                limit=int(query.get("limit", SEARCH_LIMIT))))
+            else:
+                self.reply(404, {"error": f"unknown path '{url.path}'"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError as error:
+                self.reply(400, {"error": f"invalid JSON ({error.msg})"})
+                return
+
+            if url.path == "/register":
+                self.run(lambda: service.register(body.get("cards")))
+            elif url.path == "/event":
+                self.run(lambda: service.add_events(body.get("events")))
+            elif url.path == "/refresh":
+                self.run(service.refresh)
+            elif url.path == "/save":
+                self.run(lambda: service.save(force=True))
+            elif url.path == "/stop":
+                self.run(service.save)
+                server_state["stop"].set()
+            else:
+                self.reply(404, {"error": f"unknown path '{url.path}'"})
+
+        def log_message(self, format, *args):
+            # Requests aren't logged to the console
+            pass
+
+    return Handler
+
+
+def main():
+    # GET CONFIG PARAMETERS
+    config_file = sys.argv[1]
+    inputs = ui.get_parameters(config_file)
+
+    BASE_DIR = Path(__file__).resolve().parent
+
+    # Exchange rates of the process, from the file named in the config
+    xr.configure(BASE_DIR / inputs.get("exchange_rates_file", "exchange_rates.json"))
+
+    start = time.perf_counter()
+    service = CollectionService(inputs, BASE_DIR)
+    print(f"Loaded {len(service.vault)} vault and {len(service.archive)} archive cards "
+          f"in {time.perf_counter() - start:.1f} s.")
+
+    port = int(inputs.get("service_port", DEFAULT_PORT))
+    save_seconds = inputs.get("service_save_seconds", SAVE_SECONDS)
+    server_state = {"stop": threading.Event()}
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(service, server_state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving on http://127.0.0.1:{port} (Ctrl+C to stop).")
+
+    # Periodic saves. Stops are saved by the request that asked for them
+    try:
+        while not server_state["stop"].wait(save_seconds):
+            if service.save()["saved"]:
+                print(f"Saved at {time.strftime('%H:%M:%S')}.")
+    except KeyboardInterrupt:
+        print("\nStopping the service...")
+        service.save()
+
+    server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    main()
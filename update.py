@@ -6,60 +6,27 @@ from numpy import nan
 
 import utils_df as ud
 import utils_input as ui
+import utils_cards as uc
+import utils_aggregates as uagg
+import utils_history as uh
+import utils_rates as ur
+import utils_watchlist as uw
+import exchange_rates_module as xr
  
 import sys
 
 import os
 
 
-def main():
-
-    # GET CONFIG PARAMETERS    
-    config_file = sys.argv[1]
-    inputs = ui.get_parameters(config_file)
-
-    BASE_DIR = Path(__file__).resolve().parent
-    DATA_DIR = BASE_DIR / inputs["data_folder"]
-    
-
-    # LOAD CARD DATABASES
-    # Current collection
-    vault_file = inputs["vault_file"]
-    vault_columns = inputs["data_column_types"]
-    csv_config = inputs["csv_config"]
-    vault_path = DATA_DIR / vault_file
-    vault = ud.load_collection_to_df(vault_path, vault_columns, csv_config)
-
-    # Archived cards
-    archive_file = inputs["archive_file"]
-    archive_path = DATA_DIR / archive_file
-    archive = ud.load_collection_to_df(archive_path, vault_columns, csv_config)
-
-    # History of total collection size and value
-    timeline_file = inputs["timeline_file"]
-    timeline_columns = inputs["timeline_column_types"]
-    timeline_path = DATA_DIR / timeline_file
-
-    if os.path.exists(timeline_path):
-        timeline = ud.load_collection_to_df(timeline_path, timeline_columns, csv_config)
-    else:
-        timeline = pd.DataFrame(columns=timeline_columns.keys()).astype(timeline_columns)
-    
-    
-    #ud.register_new_cards(vault, [archive])
-
-    # Updating lists
-    print(f"Updating '{vault_file}'...")
-    ud.update_collection(vault)
-
-    print(f"Updating '{archive_file}'...")
-    ud.update_collection(archive)
+# Adds today's totals ({"count", "usd", "eur"}) to the timeline, or overwrites
+# today's row if there is one. Returns the timeline
+def add_timeline_entry(timeline, totals, timeline_columns):
 
     today = pd.Timestamp.now().normalize()
 
-    number_of_cards = len(vault.drop_duplicates(subset=['pid']))
-    total_value_usd = round(vault['price trend usd'].sum(), 2)
-    total_value_eur = round(vault['price trend eur'].sum(), 2)
+    number_of_cards = totals["count"]
+    total_value_usd = round(totals["usd"], 2)
+    total_value_eur = round(totals["eur"], 2)
 
     new_entry = {
         "date": pd.Timestamp.now().normalize(), # Today's date (no time)
@@ -114,19 +81,161 @@ def main():
                 change_eur = round(100 * (current_eur / last_eur - 1), 2)
                 timeline.loc[timeline.index[-1], "price change % eur"] = change_eur
 
+    return timeline
+
+
+def build_card_table(vault, archive, cards_path, cards_columns, csv_config, watchlist=None):
+    # Card table of the collections: stored printings, then the ones only
+    # found in the vault or archive, then the printings on the watchlist
+    vault_cards, _ = uc.split_collection(vault)
+    archive_cards, _ = uc.split_collection(archive)
+    cards = uc.merge_card_tables(vault_cards, archive_cards)
+
+    if os.path.exists(cards_path):
+        stored_cards = ud.load_collection_to_df(cards_path, cards_columns, csv_config)
+        cards = uc.merge_card_tables(stored_cards, cards)
+
+    if watchlist is not None:
+        watched = pd.DataFrame({"id": watchlist.watched_ids()}, columns=uc.CARD_COLUMNS)
+        cards = uc.merge_card_tables(cards, watched)
+
+    return cards
 
+
+def run_update(inputs, base_dir, vault_partitions=None, refresh_cards=None):
+    """
+    Refreshes the prices of one config's collections and saves them.
+    'refresh_cards(cards, rates)' fills the card table; the default fetches
+    from Scryfall. Returns a summary of the run.
+    """
+    DATA_DIR = base_dir / inputs["data_folder"]
+    refresh_cards = refresh_cards or ud.update_card_table
+
+
+    # LOAD CARD DATABASES
+    # Current collection
+    vault_file = inputs["vault_file"]
+    vault_columns = inputs["data_column_types"]
+    csv_config = inputs["csv_config"]
+    vault_path = DATA_DIR / vault_file
+    vault = ud.load_collection_to_df(vault_path, vault_columns, csv_config, vault_partitions)
+
+    # Archived cards
+    archive_file = inputs["archive_file"]
+    archive_path = DATA_DIR / archive_file
+    archive = ud.load_collection_to_df(archive_path, vault_columns, csv_config)
+
+    # History of total collection size and value
+    timeline_file = inputs["timeline_file"]
+    timeline_columns = inputs["timeline_column_types"]
+    timeline_path = DATA_DIR / timeline_file
+
+    if os.path.exists(timeline_path):
+        timeline = ud.load_collection_to_df(timeline_path, timeline_columns, csv_config)
+    else:
+        timeline = pd.DataFrame(columns=timeline_columns.keys()).astype(timeline_columns)
+    
+    
+    # Vault aggregates, kept next to the timeline
+    # Only a complete vault can be checked against (and saved to) the file
+    aggregates_path = DATA_DIR / inputs.get("aggregates_file", "aggregates.csv")
+    if vault_partitions is None:
+        aggregates, rebuilt = uagg.load_aggregates(aggregates_path, vault, csv_config)
+        if rebuilt:
+            print(f"Rebuilt aggregates of '{vault_file}'.")
+    else:
+        aggregates = uagg.CollectionAggregates(vault)
+
+    #ud.register_new_cards(vault, [archive])
+
+    # Price alerts. Printings on the watchlist are refreshed with the collection
+    watchlist_path = DATA_DIR / inputs.get("watchlist_file", "watchlist.csv")
+    watchlist_state_path = DATA_DIR / inputs.get("watchlist_state_file", "watchlist_state.csv")
+    alerts_path = DATA_DIR / inputs.get("alerts_file", "alerts.csv")
+    watchlist = uw.load_watchlist(watchlist_path, watchlist_state_path, csv_config)
+
+    # Card table: metadata and prices, one row per printing
+    cards_file = inputs.get("cards_file", "cards.csv")
+    cards_columns = inputs.get("card_column_types", vault_columns)
+    cards_path = DATA_DIR / cards_file
+    cards = build_card_table(vault, archive, cards_path, cards_columns, csv_config, watchlist)
+
+    # Daily exchange rates. Today's rate is added by the refresh
+    rates_path = DATA_DIR / inputs.get("exchange_rate_table_file", "exchange_rate_table.csv")
+    rates = ur.load_rate_table(rates_path, csv_config)
+
+    # Updating the card table touches every printing once
+    print(f"Updating '{cards_file}' ({len(cards)} printings)...")
+    refresh_cards(cards, rates)
+
+    # Per-printing price history, one record per changed price
+    history = uh.PriceHistory(DATA_DIR / inputs.get("price_history_folder", "price_history"))
+    recorded = history.append(cards)
+    print(f"Recorded {recorded} price changes ({len(history)} records of {len(history.interner)} printings).")
+
+    # Updating lists
+    print(f"Updating '{vault_file}' and '{archive_file}'...")
+    ud.update_collection(vault, cards, aggregates, watchlist)
+    ud.update_collection(archive, cards)
+
+    # Totals come from the aggregates, not from a scan of the vault
+    # Totals of some partitions aren't the collection's, so they stay out of the timeline
+    totals = aggregates.totals()
+    if vault_partitions is None:
+        timeline = add_timeline_entry(timeline, totals, timeline_columns)
+
+    logged = 0
     save = True
     if save:
-        vault.to_csv(vault_path, index=False, **csv_config)
-        archive.to_csv(archive_path, index=False, **csv_config)
-        timeline.to_csv(timeline_path, index=False, **csv_config)
-        print(f"Vault saved to '{vault_path}'.")
-        print(f"Archive saved to '{archive_path}'.")
-        print(f"Timeline saved to '{timeline_path}'.")
+        # Unchanged collections are skipped
+        if ud.save_collection(vault, vault_path, csv_config, vault_columns, vault_partitions):
+            print(f"Vault saved to '{vault_path}'.")
+        if ud.save_collection(archive, archive_path, csv_config, vault_columns):
+            print(f"Archive saved to '{archive_path}'.")
+        if ud.save_collection(cards, cards_path, csv_config, cards_columns):
+            print(f"Cards saved to '{cards_path}'.")
+        if vault_partitions is None and ud.save_collection(timeline, timeline_path, csv_config):
+            print(f"Timeline saved to '{timeline_path}'.")
+        ur.save_rate_table(rates, rates_path, csv_config)
+        if watchlist is not None:
+            logged = uw.log_alerts(watchlist.take_alerts(), alerts_path, csv_config)
+            uw.save_state(watchlist, watchlist_state_path, csv_config)
+            print(f"{logged} new price alerts logged to '{alerts_path}'.")
+        print(f"Exchange rates saved to '{rates_path}'.")
+        if vault_partitions is None:
+            uagg.save_aggregates(aggregates, aggregates_path, csv_config)
+            print(f"Aggregates saved to '{aggregates_path}'.")
+
+    return {
+        "vault": len(vault),
+        "archive": len(archive),
+        "printings": len(cards),
+        "price records": recorded,
+        "alerts": logged,
+        "value usd": round(totals["usd"], 2),
+        "value eur": round(totals["eur"], 2),
+    }
+
+
+def main():
+
+    # GET CONFIG PARAMETERS    
+    config_file = sys.argv[1]
+    inputs = ui.get_parameters(config_file)
+
+    # Optional vault partitions (locations) to update. Default is all
+    vault_partitions = sys.argv[2:] or None
+
+    BASE_DIR = Path(__file__).resolve().parent
+
+    # Exchange rates of the process, from the file named in the config
+    xr.configure(BASE_DIR / inputs.get("exchange_rates_file", "exchange_rates.json"))
+
+    run_update(inputs, BASE_DIR, vault_partitions)
 
     return 0
 
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
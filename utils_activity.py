@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+import utils_ids as uid
+import utils_input as ui
+import utils_storage as us
+import utils_df as ud
+
+
+# Activity columns that hold space separated pid lists
+DIRECTIONS = ("in", "out")
+
+# Placeholder for an empty pid list
+EMPTY_PLACEHOLDER = "-"
+
+# Direction codes of the link table. "in" sorts before "out" on the same day
+DIRECTION_CODES = {"in": 0, "out": 1}
+
+# Day number used for events without a date
+NO_DAY = np.iinfo(np.int64).min
+
+
+def split_pids(value):
+    # Pids of one 'in'/'out' cell. The placeholder and blanks give no pids
+    if not isinstance(value, str):
+        return []
+    return [pid for pid in value.split() if pid != EMPTY_PLACEHOLDER]
+
+
+class ActivityIndex:
+    """
+    Inverted index from pid to the activity rows (index labels) that list
+    the pid, kept separately for the 'in' and 'out' directions. Built once
+    per loaded activity log and updated as events are added or edited, so
+    looking up a card's events is an exact O(1) probe.
+    """
+
+    def __init__(self, activity=None):
+        self._rows = {direction: {} for direction in DIRECTIONS}
+        if activity is not None:
+            self.rebuild(activity)
+
+    def rebuild(self, activity):
+        # Splits every cell once and indexes all pids
+        self._rows = {direction: {} for direction in DIRECTIONS}
+
+        for direction in DIRECTIONS:
+            if direction not in activity.columns:
+                continue
+
+            exploded = activity[direction].astype(object).str.split().explode().dropna()
+            exploded = exploded[exploded != EMPTY_PLACEHOLDER]
+
+            rows = self._rows[direction]
+            for label, pid in zip(exploded.index, exploded.to_numpy()):
+                rows.setdefault(pid, set()).add(label)
+
+    def events(self, pid, direction):
+        # Row labels of the events that list 'pid' in 'direction', sorted
+        return sorted(self._rows[direction].get(pid, ()))
+
+    def add_event(self, label, event):
+        # Indexes a new activity row. 'event' is a dict or row with 'in'/'out'
+        for direction in DIRECTIONS:
+            for pid in split_pids(event.get(direction)):
+                self._rows[direction].setdefault(pid, set()).add(label)
+
+    def remove_event(self, label, event):
+        # Forgets an activity row, e.g. before it is edited or deleted
+        for direction in DIRECTIONS:
+            for pid in split_pids(event.get(direction)):
+                labels = self._rows[direction].get(pid)
+                if labels is None:
+                    continue
+                labels.discard(label)
+                if not labels:
+                    del self._rows[direction][pid]
+
+    def update_event(self, label, old_event, new_event):
+        self.remove_event(label, old_event)
+        self.add_event(label, new_event)
+
+    def remove_pid(self, pid, direction, labels=None):
+        # Forgets 'pid' in the given rows (all of them by default)
+        rows = self._rows[direction]
+        if pid not in rows:
+            return
+        if labels is None:
+            del rows[pid]
+            return
+        rows[pid].difference_update(labels)
+        if not rows[pid]:
+            del rows[pid]
+
+    def pids(self, direction):
+        return self._rows[direction].keys()
+
+
+# ========== EVENT-CARD LINK TABLE ==========
+
+class EventLinks:
+    """
+    One row per (event, pid, direction) of the activity log, stored as
+    integer numpy arrays sorted by pid, date and direction. Card histories
+    are binary searches, holdings and holding periods are vectorized.
+    """
+
+    def __init__(self, pids, events, directions, days, source_hash=None):
+        self.pids = np.asarray(pids, dtype=np.int64)
+        self.events = np.asarray(events, dtype=np.int64)
+        self.directions = np.asarray(directions, dtype=np.int8)
+        self.days = np.asarray(days, dtype=np.int64)
+
+        # Content hash of the activity file the links were built from
+        self.source_hash = source_hash
+
+    def __len__(self):
+        return len(self.pids)
+
+    def _group(self, pid):
+        code = uid.pid_to_int(pid) if isinstance(pid, str) else int(pid)
+        start = np.searchsorted(self.pids, code, side="left")
+        end = np.searchsorted(self.pids, code, side="right")
+        return start, end
+
+    def card_history(self, pid):
+        # Every event of one card, in date order
+        start, end = self._group(pid)
+        return links_to_df(self.pids[start:end], self.events[start:end],
+                           self.directions[start:end], self.days[start:end])
+
+    def cards_held_at(self, date):
+        """
+        Pids whose last link on or before 'date' is an inbound one.
+        Returns a sorted object array of pid strings.
+        """
+        day = to_day_numbers(pd.Series([pd.Timestamp(date)]))[0]
+        before = (self.days <= day) & (self.days != NO_DAY)
+
+        pids = self.pids[before]
+        directions = self.directions[before]
+        if len(pids) == 0:
+            return np.empty(0, dtype=object)
+
+        # Rows are sorted by pid and date, so the last row per pid is the latest
+        last = np.append(pids[1:] != pids[:-1], True)
+        held = pids[last][directions[last] == DIRECTION_CODES["in"]]
+        return uid.decode_prefixed(held, "p")
+
+    def holding_periods(self, until=None):
+        """
+        Pairs every inbound link with the next outbound link of the same card.
+        Cards still held are closed at 'until' (left open, NaN days, if None).
+        Returns a DataFrame with pid, in/out event, in/out date and days held.
+        """
+        is_in = self.directions == DIRECTION_CODES["in"]
+        next_same = np.append(self.pids[1:] == self.pids[:-1], False)
+        next_is_out = np.append(self.directions[1:] == DIRECTION_CODES["out"], False)
+
+        in_rows = np.flatnonzero(is_in & (self.days != NO_DAY))
+        closed = next_same[in_rows] & next_is_out[in_rows]
+        out_rows = np.where(closed, in_rows + 1, -1)
+
+        in_days = self.days[in_rows]
+        out_days = np.where(closed, self.days[np.maximum(out_rows, 0)], NO_DAY)
+
+        periods = pd.DataFrame({
+            "pid": uid.decode_prefixed(self.pids[in_rows], "p"),
+            "in event": uid.decode_prefixed(self.events[in_rows], "e"),
+            "out event": uid.decode_prefixed(np.where(closed, self.events[np.maximum(out_rows, 0)], uid.MISSING_CODE), "e"),
+            "in date": from_day_numbers(in_days),
+            "out date": from_day_numbers(out_days),
+        })
+
+        held_days = (out_days - in_days).astype(float)
+        held_days[out_days == NO_DAY] = np.nan
+        if until is not None:
+            until_day = to_day_numbers(pd.Series([pd.Timestamp(until)]))[0]
+            still_held = out_days == NO_DAY
+            held_days[still_held] = (until_day - in_days[still_held]).astype(float)
+
+        periods["days held"] = held_days
+        return periods
+
+    def average_holding_time(self, until=None):
+        # Mean days held over closed periods (and open ones, if 'until' is given)
+        days = self.holding_periods(until)["days held"]
+        return float(days.mean()) if days.notna().any() else np.nan
+
+
+def to_day_numbers(dates):
+    # Datetimes to int64 day numbers. Missing dates become NO_DAY
+    dates = pd.to_datetime(dates, errors="coerce")
+    days = dates.to_numpy(dtype="datetime64[D]").astype(np.int64)
+    days[pd.isna(dates).to_numpy()] = NO_DAY
+    return days
+
+
+def from_day_numbers(days):
+    # NO_DAY has the same bit pattern as NaT
+    days = np.asarray(days, dtype=np.int64)
+    return pd.Series(days.astype("datetime64[D]"), dtype="datetime64[ns]")
+
+
+def links_to_df(pids, events, directions, days):
+    names = np.array(list(DIRECTION_CODES), dtype=object)
+    return pd.DataFrame({
+        "pid": uid.decode_prefixed(pids, "p"),
+        "event": uid.decode_prefixed(events, "e"),
+        "direction": names[np.asarray(directions, dtype=np.int64)],
+        "date": from_day_numbers(days),
+    })
+
+
+def build_links(activity, source_hash=None):
+    # Derives the link table from the 'in'/'out' strings of the activity log
+    parts = []
+    event_codes = uid.encode_prefixed(activity["id"], "e") if "id" in activity.columns \
+        else np.full(len(activity), uid.MISSING_CODE)
+    event_days = to_day_numbers(activity["date"]) if "date" in activity.columns \
+        else np.full(len(activity), NO_DAY)
+
+    for direction, code in DIRECTION_CODES.items():
+        if direction not in activity.columns:
+            continue
+        rows, pids = uid.explode_id_lists(activity[direction], "p")
+        parts.append((pids, event_codes[rows], np.full(len(rows), code, dtype=np.int8), event_days[rows]))
+
+    if not parts:
+        return EventLinks([], [], [], [], source_hash)
+
+    pids, events, directions, days = (np.concatenate(arrays) for arrays in zip(*parts))
+
+    # Sort by pid, then date, then direction
+    order = np.lexsort((directions, days, pids))
+    return EventLinks(pids[order], events[order], directions[order], days[order], source_hash)
+
+
+def save_links(links, file_path):
+    # Compact binary form next to the activity csv
+    buffer = BytesIO()
+    np.savez_compressed(buffer, pids=links.pids, events=links.events,
+                        directions=links.directions, days=links.days,
+                        source_hash=np.array(links.source_hash or ""))
+    us.atomic_write(file_path, buffer.getvalue())
+
+
+def load_links(file_path, activity_path, activity=None):
+    """
+    Loads the link table, rebuilding (and saving) it if the activity file
+    changed since the links were built. 'activity' avoids re-reading the log.
+    """
+    with open(activity_path, "rb") as in_file:
+        activity_hash = us.content_hash(in_file.read())
+
+    if os.path.exists(file_path):
+        with np.load(file_path) as data:
+            if str(data["source_hash"]) == activity_hash:
+                return EventLinks(data["pids"], data["events"], data["directions"],
+                                  data["days"], activity_hash)
+
+    if activity is None:
+        raise ValueError(f"Links in '{file_path}' are out of date and no activity was given.")
+
+    links = build_links(activity, activity_hash)
+    save_links(links, file_path)
+    return links
+
+
+def main():
+    # Prints the history of cards and the average holding time
+    # Usage: python utils_activity.py config.json [pid ...]
+
+    config_file = sys.argv[1]
+    inputs = ui.get_parameters(config_file)
+
+    BASE_DIR = Path(__file__).resolve().parent
+    DATA_DIR = BASE_DIR / inputs["data_folder"]
+
+    csv_config = inputs["csv_config"]
+    activity_path = DATA_DIR / inputs["activity_file"]
+    links_path = DATA_DIR / inputs.get("activity_links_file", "activity_links.npz")
+
+    activity = ud.load_collection_to_df(activity_path, inputs["activity_column_types"], csv_config)
+    links = load_links(links_path, activity_path, activity)
+
+    for pid in sys.argv[2:]:
+        ud.display_dynamic_df(links.card_history(pid), title=f"History of {pid}")
+
+    today = pd.Timestamp.today().normalize()
+    print(f"{len(links.cards_held_at(today))} cards held today.")
+    print(f"Average holding time: {links.average_holding_time(until=today):.1f} days.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import os
+
+import pandas as pd
+import numpy as np
+
+import utils_storage as us
+
+
+# Columns the aggregates are grouped by
+AGGREGATE_KEYS = ["location", "set_name", "finish", "language"]
+
+# Aggregated values and the collection column they sum (None counts rows)
+AGGREGATE_VALUES = {"count": None, "usd": "price trend usd", "eur": "price trend eur"}
+
+# Collection columns whose edits change the aggregates
+TRACKED_COLUMNS = AGGREGATE_KEYS + [col for col in AGGREGATE_VALUES.values() if col]
+
+# Key of rows without a value in a key column
+MISSING_KEY = ""
+
+# Totals may drift by float rounding after many deltas
+TOLERANCE = 0.01
+
+
+def group_rows(rows):
+    # Count and price sums of 'rows' per aggregate key
+    keys = pd.DataFrame({
+        col: rows[col].astype(object).fillna(MISSING_KEY).to_numpy() if col in rows.columns else MISSING_KEY
+        for col in AGGREGATE_KEYS
+    }, index=rows.index)
+
+    # Collapsed rows (utils_stacks) stand for 'quantity' copies each
+    weight = rows["quantity"].to_numpy(dtype=np.int64) if "quantity" in rows.columns else 1
+
+    for name, col in AGGREGATE_VALUES.items():
+        if col is None:
+            keys[name] = weight
+        else:
+            keys[name] = weight * rows[col].to_numpy(dtype=float) if col in rows.columns else np.nan
+
+    return keys.groupby(AGGREGATE_KEYS, sort=False)[list(AGGREGATE_VALUES)].sum(min_count=0)
+
+
+class CollectionAggregates:
+    """
+    Card counts and USD/EUR totals of a collection, grouped by location,
+    set, finish and language. Built once with a full scan, then kept up to
+    date with the rows that arrive, leave or change, so summaries cost
+    O(groups) instead of O(rows).
+    """
+
+    def __init__(self, df=None):
+        self.table = group_rows(pd.DataFrame(columns=TRACKED_COLUMNS))
+        if df is not None:
+            self.rebuild(df)
+
+    def __len__(self):
+        return len(self.table)
+
+    def rebuild(self, df):
+        self.table = group_rows(df)
+
+    def _apply(self, delta, sign):
+        if delta.empty:
+            return
+        table = self.table.add(sign * delta, fill_value=0)
+        table["count"] = table["count"].round().astype(np.int64)
+
+        # Groups whose last card left
+        self.table = table[table["count"] > 0]
+
+    def add(self, rows):
+        self._apply(group_rows(rows), 1)
+
+    def remove(self, rows):
+        self._apply(group_rows(rows), -1)
+
+    def replace(self, old_rows, new_rows):
+        # Rows that changed: 'old_rows' before, 'new_rows' after the edit
+        self.remove(old_rows)
+        self.add(new_rows)
+
+    def summary(self, by=None):
+        # Totals grouped by some of the key columns (all groups by default)
+        if by is None:
+            return self.table.reset_index()
+        if isinstance(by, str):
+            by = [by]
+        return self.table.groupby(level=by, sort=True).sum().reset_index()
+
+    def totals(self):
+        # Count and price totals of the whole collection
+        sums = self.table.sum()
+        return {name: float(sums[name]) if name != "count" else int(sums[name]) for name in AGGREGATE_VALUES}
+
+    def matches(self, df):
+        # Cheap consistency check against a loaded collection
+        totals = self.totals()
+        if totals["count"] != len(df):
+            return False
+        for name, col in AGGREGATE_VALUES.items():
+            if col is None:
+                continue
+            actual = float(df[col].sum()) if col in df.columns else 0.0
+            if abs(totals[name] - actual) > TOLERANCE * max(1.0, len(self.table)):
+                return False
+        return True
+
+
+def save_aggregates(aggregates, file_path, csv_config=None):
+    us.atomic_write(file_path, us.serialize_csv(aggregates.summary(), csv_config))
+
+
+def load_aggregates(file_path, df, csv_config=None):
+    """
+    Loads the aggregates of 'df' from 'file_path'. They're rebuilt with one
+    full scan if the file is missing or doesn't match the collection.
+    Returns (aggregates, rebuilt).
+    """
+    aggregates = CollectionAggregates()
+
+    if os.path.exists(file_path):
+        csv_config = csv_config or {}
+        table = pd.read_csv(file_path, sep=csv_config.get("sep", ","), decimal=csv_config.get("decimal", "."),
+                            encoding=csv_config.get("encoding", "utf-8"), keep_default_na=False,
+                            dtype={col: object for col in AGGREGATE_KEYS})
+        if set(AGGREGATE_KEYS + list(AGGREGATE_VALUES)) <= set(table.columns):
+            aggregates.table = table.set_index(AGGREGATE_KEYS)[list(AGGREGATE_VALUES)].astype(
+                {"count": np.int64, "usd": float, "eur": float})
+            if aggregates.matches(df):
+                return aggregates, False
+
+    aggregates.rebuild(df)
+    return aggregates, True
+
+
+if __name__ == '__main__':
+    print_string = "This module contains:\n \
+                    'group_rows'\n \
+                    'CollectionAggregates'\n \
+                    'save_aggregates'\n \
+                    'load_aggregates'"
+    print(print_string)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import pandas as pd
+import numpy as np
+
+
+# Per-printing metadata, identical for every physical copy of a Scryfall id
+CARD_META_COLUMNS = ["name", "set_name", "mana_cost", "edhrec_rank", "reserved"]
+
+# Current prices of every finish of a printing
+RAW_PRICE_COLUMNS = ["usd_reg", "usd_foil", "usd_etched", "eur_reg", "eur_foil", "eur_etched"]
+
+# The card table: one row per printing, keyed by Scryfall "id"
+CARD_COLUMNS = ["id"] + CARD_META_COLUMNS + ["current date"] + RAW_PRICE_COLUMNS
+
+# Columns of the wide vault/archive rows that are derived from the card table
+DERIVED_COLUMNS = CARD_META_COLUMNS + ["current date", "price trend usd", "price trend eur"]
+
+# Finish of a physical copy -> suffix of its raw price columns
+FINISH_SUFFIXES = {"non-foil": "reg", "foil": "foil", "etched": "etched"}
+
+
+def empty_card_table():
+    return pd.DataFrame({col: pd.Series(dtype=object) for col in CARD_COLUMNS})
+
+
+def split_collection(df):
+    """
+    Splits a wide vault/archive dataframe into a card table (one row per
+    printing) and slim per-copy rows. The raw per-finish prices of the card
+    table are seeded from the 'price trend' columns of the copies.
+    Returns (cards, copies).
+    """
+    if "id" not in df.columns:
+        return empty_card_table(), df.copy()
+
+    rows = df[df["id"].notna()]
+
+    # Metadata comes from the first copy of each printing
+    first = rows.drop_duplicates(subset=["id"])
+    cards = pd.DataFrame({"id": first["id"].to_numpy()})
+    for col in CARD_META_COLUMNS + ["current date"]:
+        if col in first.columns:
+            cards[col] = first[col].to_numpy()
+        else:
+            cards[col] = np.nan
+
+    # Seed the raw price of each finish a printing has been seen in
+    for col in RAW_PRICE_COLUMNS:
+        cards[col] = np.nan
+
+    if "finish" in rows.columns:
+        positions = pd.Index(cards["id"])
+        for finish, suffix in FINISH_SUFFIXES.items():
+            seen = rows[rows["finish"] == finish].drop_duplicates(subset=["id"])
+            if seen.empty:
+                continue
+            target = positions.get_indexer(seen["id"])
+            for currency in ["usd", "eur"]:
+                trend_col = f"price trend {currency}"
+                if trend_col in seen.columns:
+                    cards.loc[target, f"{currency}_{suffix}"] = seen[trend_col].to_numpy(dtype=float)
+
+    # Everything that isn't derived from the card table stays on the copies
+    copy_cols = [col for col in df.columns if col not in DERIVED_COLUMNS]
+    copies = df[copy_cols].copy()
+
+    return cards, copies
+
+
+def merge_card_tables(primary, secondary):
+    """
+    Combines two card tables. Rows of 'primary' win, printings that only
+    exist in 'secondary' are appended.
+    """
+    if primary is None or primary.empty:
+        return secondary.reset_index(drop=True)
+    if secondary is None or secondary.empty:
+        return primary.reset_index(drop=True)
+
+    missing = secondary[~secondary["id"].isin(primary["id"])]
+    if missing.empty:
+        return primary.reset_index(drop=True)
+
+    return pd.concat([primary, missing], ignore_index=True, sort=False)
+
+
+def select_trend_prices(finish, taken):
+    # Picks the price of the copy's finish from the raw card table columns
+    conditions = [(finish == "etched").to_numpy(dtype=bool), (finish == "foil").to_numpy(dtype=bool)]
+
+    trend = {}
+    for currency in ["usd", "eur"]:
+        choices = [taken[f"{currency}_etched"], taken[f"{currency}_foil"]]
+        trend[f"price trend {currency}"] = np.select(conditions, choices, default=taken[f"{currency}_reg"])
+
+    return trend
+
+
+def join_collection(cards, copies, columns=None):
+    """
+    Produces the wide vault/archive view of 'copies' by looking up each
+    copy's printing in 'cards'. Only 'columns' of DERIVED_COLUMNS are
+    joined (all of them by default). Returns a new dataframe aligned with
+    'copies'.
+    """
+    if columns is None:
+        columns = DERIVED_COLUMNS
+
+    view = copies.copy()
+
+    # One hash lookup per copy, then positional takes per column
+    positions = pd.Index(cards["id"]).get_indexer(copies["id"])
+    found = positions >= 0
+    safe_positions = np.where(found, positions, 0)
+
+    def take(col):
+        values = cards[col].take(safe_positions) if len(cards) else pd.Series(np.nan, index=range(len(copies)))
+        values = pd.Series(values.to_numpy(), index=copies.index, dtype=values.dtype)
+        return values.where(found)
+
+    for col in [c for c in columns if c in CARD_META_COLUMNS + ["current date"]]:
+        view[col] = take(col) if col in cards.columns else np.nan
+
+    if "price trend usd" in columns or "price trend eur" in columns:
+        taken = {col: take(col).to_numpy(dtype=float) for col in RAW_PRICE_COLUMNS}
+        finish = copies["finish"] if "finish" in copies.columns else pd.Series("non-foil", index=copies.index)
+        for col, values in select_trend_prices(finish, taken).items():
+            if col in columns:
+                view[col] = values
+
+    return view
+
+
+def refresh_collection(df, cards):
+    """
+    Writes the card table data back into the derived columns that 'df'
+    already has, in place. Copies whose printing is missing from the card
+    table keep their values.
+    """
+    columns = [col for col in DERIVED_COLUMNS if col in df.columns]
+    if not columns or "id" not in df.columns:
+        return df
+
+    view = join_collection(cards, df[["id", "finish"]] if "finish" in df.columns else df[["id"]], columns)
+    found = df["id"].isin(cards["id"]).to_numpy(dtype=bool)
+
+    for col in columns:
+        new_values = view[col]
+        if col.startswith("price trend"):
+            # Missing prices of a known printing keep the old trend
+            keep = found & new_values.notna().to_numpy(dtype=bool)
+        else:
+            keep = found
+        if keep.any():
+            df.loc[keep, col] = new_values[keep].to_numpy()
+
+    return df
+
+
+if __name__ == '__main__':
+    print_string = "This module contains functions:\n \
+                    'split_collection'\n \
+                    'merge_card_tables'\n \
+                    'join_collection'\n \
+                    'refresh_collection'"
+    print(print_string)
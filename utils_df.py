@@ -1,136 +1,167 @@
 #!/usr/bin/env python3
 
+import sys
 import time
 
 import pandas as pd
 import numpy as np
 
 import utils_input as ui
+import utils_cards as uc
+import utils_storage as us
+import utils_search as usearch
+import utils_aggregates as uagg
+import utils_stacks as ust
 
-from exchange_rates_module import get_eur_usd_rate
+import exchange_rates_module as xr
 import scryfall_module as scryfall
 
-def load_collection_to_df(file_path, header_type_dict, config=None):
-
-    # Read only the header row to get the headers
-    current_sep = config["sep"] if config else ","
-    headers = pd.read_csv(file_path, nrows=0, sep=current_sep).columns
-    
-    # Create a mapping of header and dtype, using pre-exiting header-dtype dictionary
-    header_dtypes = {k: v for k, v in header_type_dict.items() if k in headers}
-    
-    # define df dtypes, exclude datetimes
-    df_dtypes = {k: v for k, v in header_dtypes.items() if v != "datetime64[ns]"}
-    
-    # separate datetime headers here
-    df_date_cols = [k for k, v in header_dtypes.items() if v == "datetime64[ns]"]
-
-    # read df from csv file
-    if config:
-        df = pd.read_csv(
-            file_path,
-            sep=config["sep"], 
-            decimal=config["decimal"],
-            dtype=df_dtypes,
-            parse_dates=df_date_cols,
-            dayfirst=True,
-            date_format=config["date_format"],
-            encoding=config.get("encoding", "utf-8"))
+def load_collection_to_df(file_path, header_type_dict, config=None, partitions=None):
 
+    # Partitioned collections are folders. Only load the requested partitions
+    if us.is_partitioned(file_path):
+        df = us.load_partitioned(file_path, header_type_dict, config, partitions)
     else:
-        df = pd.read_csv(file_path,
-                            dtype=df_dtypes,
-                            parse_dates=df_date_cols)
-
-    # 3. Safety Pass: Force any missed date columns to datetime
-    for col in df_date_cols:
-        if col in df.columns and df[col].dtype == 'object':
-            df[col] = pd.to_datetime(
-                df[col],
-                format= config["date_format"] if config else None,
-                dayfirst=True,
-                errors='coerce'
-                )
-
-    # Handle finish.
-    if "finish" in df:
-        df["finish"] = df["finish"].fillna("non-foil")
-        valid_finishes = ['non-foil','foil', 'etched']
-        df.loc[~df['finish'].isin(valid_finishes), 'finish'] = 'non-foil'
-
-
-    # Delete bloat columns and columns that are not specified in the config file
-    cleanup_dataframe(df, header_type_dict)
+        df = us.load_cached(file_path, header_type_dict, config)
+
+    # Remember the loaded state so saves can tell what changed
+    us.track_changes(df, file_path)
 
     return df
 
+# Parsing lives in utils_storage, which loads collections without importing this module
+read_collection_csv = us.read_collection_csv
+cleanup_dataframe = us.cleanup_dataframe
+
+# Saves a collection to its csv file, or to its partition folder
+# Returns False if the save was skipped because nothing changed since loading
+def save_collection(df, file_path, csv_config, header_type_dict=None, partitions=None, force=False):
+
+    if not force and not us.has_changes(df, file_path):
+        print(f"No changes to '{file_path}'. Skipping save.")
+        return False
+
+    # 'partitions' are the partitions the collection was loaded from (None is all)
+    if us.is_partitioned(file_path):
+        us.save_partitioned(df, file_path, csv_config, loaded=partitions,
+                            header_type_dict=header_type_dict)
+    else:
+        us.store_bytes(file_path, us.serialize_csv(df, csv_config))
+
+    # The saved state is the new baseline
+    us.track_changes(df, file_path)
+
+    return True
+
 # Updates all the info in the cards using the scryfall id
-def update_collection(df):
+def update_collection(df, cards=None, aggregates=None, watchlist=None):
+
+    # The card table holds one row per printing, so each printing is
+    # fetched and updated once no matter how many copies share it
+    if cards is None:
+        cards, _ = uc.split_collection(df)
+        update_card_table(cards)
+
+    # Optional uagg.CollectionAggregates of 'df', updated with the changed rows only
+    tracked = [col for col in uagg.TRACKED_COLUMNS if col in df.columns]
+    before = df[tracked].copy() if aggregates is not None else None
+
+    # Write metadata and prices back into the physical copies, once per stack
+    ust.refresh_stacks(df, cards)
+
+    if aggregates is not None:
+        after = df[tracked]
+        changed = np.zeros(len(df), dtype=bool)
+        for col in tracked:
+            old, new = before[col], after[col]
+            changed |= ~((old == new).fillna(False) | (old.isna() & new.isna())).to_numpy(dtype=bool)
+        if changed.any():
+            aggregates.replace(before[changed], after[changed])
+
+    # Optional uw.Watchlist: its rules are checked against the refreshed copies and printings
+    if watchlist is not None:
+        watchlist.evaluate(df, "vault")
+        watchlist.evaluate(cards, "cards")
 
-    # Scryfall only allows 75 cards at a time
-    BATCH_SIZE = 75
+    return df
 
+# Updates the card table (one row per scryfall id) in place
+# rates: Optional utils_rates.RateTable. Today's rate is recorded in it
+# ids: Optional scryfall ids to refresh. Default is every printing of the table
+def update_card_table(cards, rates=None, ids=None):
 
     # Each card on scryfall has id (uuid) identifier
-    unique_id_df = df.drop_duplicates(subset=['id'])
+    unique_ids = cards['id'].dropna().unique() if ids is None else pd.unique(pd.Series(ids, dtype=object).dropna())
 
-    # Extra price columns
-    price_cols = ["usd_reg", "usd_foil", "usd_etched", "eur_reg", "eur_foil", "eur_etched"]
-    
-    # Add extra price columns
-    for col in price_cols:
-        if col not in df.columns:
-            df[col] = np.nan
+    # Get exchange rates
+    eur_to_usd,_ = xr.get_rate_provider().rates()
+    if rates is not None:
+        rates.record(eur_to_usd)
 
-    # Set look-up index
-    df.set_index('id', inplace=True)
+    update_chunk = fetch_card_updates(unique_ids, eur_to_usd)
+    if update_chunk is None:
+        return cards
 
-    # Get exchange rates
-    eur_to_usd,_ = get_eur_usd_rate()
+    return apply_card_updates(cards, update_chunk)
+
+def fetch_card_updates(unique_ids, eur_to_usd):
+    """
+    Scryfall data of 'unique_ids' with prices filled, one row per printing
+    indexed by id. None if nothing was fetched.
+    """
+    # Scryfall only allows 75 cards at a time
+    BATCH_SIZE = 75
 
-    
     # Timimg required so that we don't flood api with requests
     post_time = time.time()
 
+    fetched = []
+
     # Iterate through the unique list of cards by 75 card Batches
-    for i in range(0, len(unique_id_df), BATCH_SIZE):
+    for i in range(0, len(unique_ids), BATCH_SIZE):
 
         # Creates a batch of card ids (uuids)
-        batch_df = unique_id_df.iloc[i : i + BATCH_SIZE]
-        ids_for_api = batch_df['id'].dropna().tolist()
+        ids_for_api = list(unique_ids[i : i + BATCH_SIZE])
         payload = {"identifiers": [{"id": id} for id in ids_for_api]}
 
         # Sends batch to scryfall to get card data back
         cards_data, _, post_time = scryfall.get_card_batch(payload, post_time)
-    
-        # Iterate through each object (card) in the api return JSON
-        for card in cards_data:
-            fill_prices(card, eur_to_usd)
 
-        # Set "id" as the root for mapping df1 to update_chunk
-        update_chunk = pd.DataFrame(cards_data).set_index("id")
-        
+        fetched.extend(cards_data)
 
-        # Maps df1 to the downloaded data of update_chunk
-        df.update(update_chunk)
+        ui.progress_bar(i + len(ids_for_api), len(unique_ids))
 
-        # Mask all cards not connected to the batch
-        current_ids = batch_df['id'].tolist()
-        mask = df.index.isin(current_ids)
+    print("\n")
 
-        # update price trend columns
-        mass_price_select(df, mask)
+    if not fetched:
+        return None
 
-        ui.progress_bar(i + len(update_chunk),len(unique_id_df))
+    # Set "id" as the root for mapping the card table to update_chunk
+    update_chunk = pd.DataFrame(fetched).drop_duplicates(subset=["id"]).set_index("id")
 
-    print("\n")
-    
-    df.drop(columns=price_cols, inplace=True)
+    # Prices are filled for all printings at once, with today's rate
+    update_chunk["current date"] = pd.Timestamp.now().normalize()
+    fill_price_columns(update_chunk, eur_to_usd)
 
-    # reset root index
-    df.reset_index(inplace=True)
+    update_cols = [col for col in uc.CARD_COLUMNS if col in update_chunk.columns]
+    return update_chunk[update_cols]
 
-    return df
+def apply_card_updates(cards, update_chunk):
+    # Copies fetched printings ('update_chunk', indexed by id) to the card table
+    # Printings of 'update_chunk' that aren't in 'cards' are ignored
+
+    # Rows of the card table, one per fetched printing
+    target = pd.Index(cards['id']).get_indexer(update_chunk.index)
+    found = target >= 0
+
+    # Same semantics as df.update: missing values don't overwrite old ones
+    for col in update_chunk.columns:
+        values = update_chunk[col]
+        keep = found & values.notna().to_numpy(dtype=bool)
+        if keep.any():
+            cards.loc[cards.index[target[keep]], col] = values[keep].to_numpy()
+
+    return cards
 
 def fill_prices(card_json, eur_usd_xrate):
 
@@ -170,6 +201,42 @@ def fill_prices(card_json, eur_usd_xrate):
     return card_json
 
 
+# Vectorized fill_prices over a frame of scryfall cards (a "prices" column of dicts)
+# eur_usd_xrate: one rate, or one rate per row (e.g. the rate of each row's date)
+def fill_price_columns(df, eur_usd_xrate):
+
+    raw_prices = [p if isinstance(p, dict) else {} for p in df["prices"]] if "prices" in df.columns else [{}] * len(df)
+    raw_prices = pd.DataFrame(raw_prices, index=df.index)
+
+    # Same parsing as safe_float: decimal commas are accepted, the rest is NaN
+    source_keys = ["usd", "usd_foil", "usd_etched", "eur", "eur_foil", "eur_etched"]
+    p = {}
+    for key in source_keys:
+        if key in raw_prices.columns:
+            p[key] = pd.to_numeric(raw_prices[key].astype(object).where(raw_prices[key].notna())
+                                   .map(lambda val: str(val).replace(',', '.'), na_action="ignore"), errors="coerce")
+        else:
+            p[key] = pd.Series(np.nan, index=df.index)
+
+    eur_usd_xrate = np.asarray(eur_usd_xrate, dtype=float)
+    usd_eur_xrate = 1.0/eur_usd_xrate
+
+    # Regular version prices
+    p["usd"], p["eur"] = p["usd"].fillna(p["eur"]*eur_usd_xrate), p["eur"].fillna(p["usd"]*usd_eur_xrate)
+
+    # Foil prices
+    p["usd_foil"], p["eur_foil"] = p["usd_foil"].fillna(p["eur_foil"]*eur_usd_xrate), p["eur_foil"].fillna(p["usd_foil"]*usd_eur_xrate)
+
+    # Etched prices
+    p["eur_etched"] = (p["usd_etched"]*usd_eur_xrate).where(p["usd_etched"].notna(), p["eur_etched"])
+
+    keys = ["usd_reg", "usd_foil", "usd_etched", "eur_reg", "eur_foil", "eur_etched"]
+    for target, source in zip(keys, source_keys):
+        df[target] = p[source].astype(float).round(2)
+
+    return df
+
+
 # Converts a variable, "val", to a float
 def safe_float(val):
     if val is None: return None
@@ -212,10 +279,14 @@ def mass_price_select(df, mask=None):
 # Define a function to register new cards
 # New cards are rows that contain no PID but a query string in the "name" column
 # Returns None if there is an error
-def register_new_cards(main_df, dfs=[]):
+def register_new_cards(main_df, dfs=[], allocator=None, aggregates=None, rates=None, lookup=None):
 
     # df: the dataframe where the rows will be added
     # dfs: A list of other dataframes containing cards, with unique pids
+    # allocator: A shared ui.IdAllocator. Replaces scanning 'dfs' if given
+    # aggregates: Optional uagg.CollectionAggregates of main_df, kept up to date
+    # rates: Optional utils_rates.RateTable. Rows are priced with the rate of their in date
+    # lookup: Optional function of a row returning its Scryfall card json. Default: ask on the console
 
     # Find rows that represent new cards
     mask = main_df['pid'].isna() & main_df['name'].notna()
@@ -225,14 +296,23 @@ def register_new_cards(main_df, dfs=[]):
         return []
 
 
-    # Get all pids
-    pid_col_list = [df["pid"] for df in dfs]
-    pid_col_list.append(main_df["pid"]) # Ensure main_df's existing IDs are included!
-    reserved_pids = pd.concat(pid_col_list, ignore_index=True, sort=False)
+    # Scan all pids once
+    if allocator is None:
+        allocator = ui.IdAllocator()
+        for df in dfs:
+            allocator.scan(df["pid"], "p")
+        allocator.scan(main_df["pid"], "p") # Ensure main_df's existing IDs are included!
 
 
     # Get exchange rates
-    eur_to_usd,_ = get_eur_usd_rate()
+    eur_to_usd,_ = xr.get_rate_provider().rates()
+
+    # One rate per new row: the rate of its in date, today's if it has none
+    row_rates = pd.Series(eur_to_usd, index=main_df.index[mask])
+    if rates is not None:
+        rates.record(eur_to_usd)
+        if "in date" in main_df.columns:
+            row_rates[:] = rates.eur_to_usd(main_df.loc[mask, "in date"], default=eur_to_usd)
 
 
     # A list of scryfall data from the soon to be added cards
@@ -244,20 +324,19 @@ def register_new_cards(main_df, dfs=[]):
         print(f"Registering: {query}...")
         
         # Search SCRYFALL
-        card_json = scryfall.query_name(query)
+        card_json = lookup(row) if lookup is not None else scryfall.query_name(query)
 
         # Generate pid, put it into data, and add to list
         if card_json:
-            new_pid = ui.generate_next_pid(reserved_pids,"p")
+            new_pid = allocator.next("p")
 
             card_json["pid"] = new_pid
             card_json["index"] = index
 
-            fill_prices(card_json, eur_to_usd)
+            fill_prices(card_json, row_rates[index])
 
             cards_data.append(card_json)
 
-            reserved_pids = pd.concat([reserved_pids, pd.Series([new_pid])], ignore_index=True, sort=False)
             pid_list.append(new_pid)
 
         else:
@@ -267,6 +346,10 @@ def register_new_cards(main_df, dfs=[]):
     # 3. UPDATE THE MAIN DATAFRAME
     if cards_data:
 
+        # The rows as they were, for the aggregates
+        if aggregates is not None:
+            before = main_df.loc[mask, [col for col in uagg.TRACKED_COLUMNS if col in main_df.columns]].copy()
+
         # Set "index" as the root for mapping df1 to update_chunk
         update_chunk = pd.DataFrame(cards_data).set_index("index")
 
@@ -288,6 +371,18 @@ def register_new_cards(main_df, dfs=[]):
         # update price trend columns
         mass_price_select(main_df, mask)
 
+        # Trends at entry are the registered prices, unless they were given
+        for currency in ["usd", "eur"]:
+            in_col, trend_col = f"in trend {currency}", f"price trend {currency}"
+            if in_col in main_df.columns and trend_col in main_df.columns:
+                missing = mask & main_df[in_col].isna()
+                main_df.loc[missing, in_col] = main_df.loc[missing, trend_col]
+
+        # Registered rows got their set and prices
+        if aggregates is not None:
+            tracked = [col for col in uagg.TRACKED_COLUMNS if col in before.columns]
+            aggregates.replace(before, main_df.loc[mask, tracked])
+
         # Drop auxiliary columns
         main_df.drop(columns=price_cols, inplace=True)
 
@@ -296,25 +391,6 @@ def register_new_cards(main_df, dfs=[]):
         return pid_list
 
 
-# This function deletes columns that shouldn't be in the data, but somehow got there
-def cleanup_dataframe(df, header_source):
-
-    # If it's a dictionary, we want the keys. If it's a list, we use it as is.
-    if isinstance(header_source, dict):
-        allowed_columns = set(header_source.keys())
-    elif isinstance(header_source, list):
-        allowed_columns = set(header_source)
-    else:
-        print("Error: header_source must be a list or dict")
-        return
-    
-    # 2. Identify the "junk" columns
-    bloat_columns = [col for col in df.columns if col not in header_source]
-    
-    # errors='ignore' ensures it won't crash if the column is already gone
-    df.drop(columns=bloat_columns, axis=1, errors='ignore', inplace=True)
-    
-
 # Show a part of the dataframe "df"
 def peek_df(df, columns=None, pids=[], rows=None, last=False, char_limit=20):
     """
@@ -330,48 +406,70 @@ def peek_df(df, columns=None, pids=[], rows=None, last=False, char_limit=20):
     if columns:
         cols = [col for col in columns if col in df.columns]
     else:
-        cols = df.columns
+        cols = list(df.columns)
 
 
-    # Create a new dataframe with only specified PIDs
+    # 2. Select rows and columns together, before any formatting,
+    # so only the rows that will be shown are processed
     if len(pids) > 0:
-        view = df[df['pid'].isin(pids)].copy()
+        view = df.loc[df['pid'].isin(pids), cols]
 
     # Pick first or last columns
     elif rows is not None:
-        if last:
-            view = df.tail(rows).copy()
-        else:
-            view = df.head(rows).copy()
+        view = df[cols].tail(rows) if last else df[cols].head(rows)
 
     else:
-        view = df.copy()
+        view = df[cols]
 
-    # 3. NOW apply the column filter to the resulting view
-    # We do this after row filtering so it applies to every scenario
-    view = view[cols]
+    # Shallow copy: columns are replaced below, never written into
+    view = view.copy(deep=False)
 
-    # Format datetime columns to show only the date
     for col in view.columns:
-        if pd.api.types.is_datetime64_any_dtype(view[col]):
-            # dt.strftime converts it to a clean string format
-            view[col] = view[col].dt.strftime('%Y-%m-%d')
+        series = view[col]
+
+        # Format datetime columns to show only the date (once per column)
+        if pd.api.types.is_datetime64_any_dtype(series):
+            series = series.dt.strftime('%Y-%m-%d')
+
+        # 3. Truncate strings to the char_limit, only in text columns
+        # Numbers (and other non-strings) are kept as they are
+        elif not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+            continue
+
+        try:
+            lengths = series.str.len()
+        except AttributeError:
+            # Object column without any strings
+            continue
+        too_long = (lengths > char_limit).fillna(False).to_numpy(dtype=bool)
+        if too_long.any():
+            series = series.astype(object)
+            series[too_long] = series[too_long].str[:char_limit] + '..'
 
-    # 2. Truncate all strings to the char_limit
-    # We use 'astype(str)' to ensure we can slice, then slice [:char_limit]
-    # The 'if isinstance(x, str)' check keeps numbers as numbers
-    view = view.map(lambda x: (str(x)[:char_limit] + '..') if isinstance(x, str) and len(str(x)) > char_limit else x)
+        view[col] = series
 
     return view
 
-def str_search_col(df, search_term, col='name', verbose=False):
+def str_search_col(df, search_term, col='name', verbose=False, index=None, fuzzy=False, positions=None):
     """
     Searches the dataframe for card names containing the search_term.
     Displays results using the dynamic formatter.
+    'index' is an optional usearch.TrigramIndex covering the rows of df, and
+    'positions' an optional usearch.row_positions(df). Callers that search
+    more than once keep both. With 'fuzzy', close matches are ranked after
+    the exact ones; without an index, one is built for this call.
     """
     # 1. Perform the case-insensitive search
-    mask = df[col].str.contains(search_term, case=False, na=False)
-    results = df[mask]
+    # Matching is literal, so regex characters in card names are harmless
+    if fuzzy and (index is None or not index.indexes(col)):
+        index = usearch.TrigramIndex(columns=[col])
+        index.add(df)
+
+    if index is not None and index.indexes(col):
+        results = usearch.rank_rows(df, index.search(search_term, col, fuzzy=fuzzy), positions=positions)
+    else:
+        mask = df[col].str.contains(search_term, case=False, na=False, regex=False)
+        results = df[mask]
 
     if not verbose: return results
 
@@ -384,51 +482,118 @@ def str_search_col(df, search_term, col='name', verbose=False):
         #display_dynamic_df(results)
     return results
 
-def display_dynamic_df(df, title=None, description=None):
-    if df is None or df.empty:
-        print("\n[ Empty DataFrame ]\n")
-        return
+# Rows per page of display_dynamic_df. Longer tables are paged
+DISPLAY_PAGE_SIZE = 50
 
+def render_table(df, title=None, description=None):
+    """
+    Formats 'df' as the boxed text table of display_dynamic_df and returns
+    it as one string. Column widths come from the rows of 'df' only, so
+    callers render one page at a time.
+    """
     # Convert everything to string for display calculations
-    df_str = df.astype(str)
-    
+    # (missing datetimes stay missing under the string dtype)
+    df_str = df.astype(str).fillna("")
+    columns = [str(col) for col in df.columns]
+
     # Calculate column widths based on headers and data
-    col_widths = {col: max(len(col), df_str[col].map(len).max()) for col in df.columns}
-    
+    col_widths = [max(len(col), int(df_str.iloc[:, i].str.len().max()) if len(df_str) else 0)
+                  for i, col in enumerate(columns)]
+
     # Build the table components
-    header_row = " | ".join(f"{col:<{col_widths[col]}}" for col in df.columns)
-    separator = "-" * (sum(col_widths.values()) + (3 * (len(df.columns) - 1)) + 4)
+    header_row = " | ".join(f"{col:<{width}}" for col, width in zip(columns, col_widths))
+    separator = "-" * (sum(col_widths) + (3 * (len(columns) - 1)) + 4)
+
+    lines = []
 
     # --- 1. DISPLAY TITLE ---
     if title:
         # Center the title within the width of the table
-        print(f"{separator}")
-        #print(f"  {title.upper():^{len(separator)-4}}  ") # Capitalized
-        print(f"  {title:^{len(separator)-4}}  ") # Non-capitalizd
-    
+        lines.append(separator)
+        lines.append(f"  {title:^{len(separator)-4}}  ")
+
     # --- 2. DISPLAY TABLE ---
-    print(separator)
-    print(f" {header_row}  |")
-    print(separator)
+    lines.extend([separator, f" {header_row}  |", separator])
 
-    for _, row in df_str.iterrows():
-        row_str = " | ".join(f"{row[col]:<{col_widths[col]}}" for col in df.columns)
-        print(f" {row_str}  |")
+    # Pad whole columns at once and join them into rows
+    if len(df_str):
+        padded = [df_str.iloc[:, i].str.ljust(width) for i, width in enumerate(col_widths)]
+        rows = padded[0]
+        for column in padded[1:]:
+            rows = rows + " | " + column
+        lines.extend((" " + rows + "  |").tolist())
 
-    print(separator)
+    lines.append(separator)
 
     # --- 3. DISPLAY DESCRIPTION ---
     if description:
-        print(f" NOTE: {description}")
-        print(f"{separator}")
+        lines.append(f" NOTE: {description}")
+        lines.append(separator)
     else:
-        print("")
+        lines.append("")
+
+    return "\n".join(lines) + "\n"
+
+def display_dynamic_df(df, title=None, description=None, page_size=DISPLAY_PAGE_SIZE):
+    """
+    Prints 'df' as a table, one buffered write per page. Tables longer than
+    'page_size' rows are paged: 'n' next, 'p' previous, 'j <page>' jump,
+    Enter to continue. Rows keep their values (e.g. an 'index' column
+    numbered over the whole table) on every page. Piped or scheduled runs
+    aren't paged, so they never wait for input.
+    """
+    if df is None or df.empty:
+        print("\n[ Empty DataFrame ]\n")
+        return
+
+    interactive = sys.stdin.isatty() and sys.stdout.isatty()
+    if not page_size or not interactive or len(df) <= page_size:
+        sys.stdout.write(render_table(df, title, description))
+        sys.stdout.flush()
+        return
+
+    n_pages = -(-len(df) // page_size)
+    page = 0
+    while True:
+        start = page * page_size
+        page_title = f"Page {page + 1}/{n_pages}"
+        if title:
+            page_title = f"{title} ({page_title})"
+
+        sys.stdout.write(render_table(df.iloc[start:start + page_size], page_title, description))
+        sys.stdout.flush()
+
+        command = ui.get_typed_input("'n' next, 'p' previous, 'j <page>' jump, Enter to continue: ",
+                                     "str", default="", display_default=False).lower()
+        if not command: break
+
+        if command == "n":
+            page = min(page + 1, n_pages - 1)
+        elif command == "p":
+            page = max(page - 1, 0)
+        elif command.startswith("j"):
+            try:
+                page = min(max(int(command[1:].strip()) - 1, 0), n_pages - 1)
+            except ValueError:
+                print(f"Unknown page '{command[1:].strip()}'.")
+        else:
+            print(f"Unknown command '{command}'.")
 
-def transfer_cards(df_source, df_dest, id_list, id_col='pid'):
+def transfer_cards(df_source, df_dest, id_list, id_col='pid', source_aggregates=None, dest_aggregates=None):
     """
     Moves rows from source to destination.
     Only transfers columns that already exist in the destination.
+    Source and destination are DataFrames, or CardStores for O(k) transfers.
+    CardStores keep their own aggregates; for DataFrames the optional
+    uagg.CollectionAggregates of each side are updated with the moved rows.
     """
+    # CardStores move only the selected rows, nothing else is copied
+    if isinstance(df_source, CardStore) and isinstance(df_dest, CardStore):
+        rows_to_move = df_source.take(id_list)
+        if not rows_to_move.empty:
+            df_dest.put(rows_to_move)
+        return df_source, df_dest
+
     # 1. Identify the rows to move
     mask = df_source[id_col].isin(id_list)
     
@@ -443,12 +608,214 @@ def transfer_cards(df_source, df_dest, id_list, id_col='pid'):
     # 3. Combine with destination
     updated_dest = pd.concat([df_dest, rows_to_move], ignore_index=True, sort=False)
 
+    if source_aggregates is not None:
+        source_aggregates.remove(df_source.loc[mask])
+    if dest_aggregates is not None:
+        dest_aggregates.add(rows_to_move)
+
     # 4. Remove moved rows from source (using the original mask)
     updated_source = df_source[~mask].copy()
 
     return updated_source, updated_dest
 
 
+class CardStore:
+    """
+    A collection DataFrame with a pid index, tombstones for rows that left
+    and a buffer of rows that arrived. Taking, adding and editing k cards
+    costs O(k); the DataFrame is rebuilt once, when frame() is called.
+    """
+
+    def __init__(self, df, id_col='pid', search_index=None, aggregates=None):
+        self.id_col = id_col
+        self._reset(df)
+
+        # Optional usearch.TrigramIndex, kept in sync with transfers
+        self.search_index = search_index
+        if search_index is not None:
+            search_index.add(df)
+
+        # Optional uagg.CollectionAggregates of 'df', kept in sync with every change
+        self.aggregates = aggregates
+
+    def _reset(self, df):
+        # The base frame is used as is, never copied
+        self.base = df
+        self._alive = np.ones(len(df), dtype=bool)
+        self._positions = dict(zip(df[self.id_col].tolist(), range(len(df))))
+
+        # Arrived rows: chunks of DataFrames and pid -> (chunk, row)
+        self._added = []
+        self._added_positions = {}
+        self._frame = df
+
+    @property
+    def columns(self):
+        return self.base.columns
+
+    def __len__(self):
+        return int(self._alive.sum()) + len(self._added_positions)
+
+    def __contains__(self, pid):
+        return pid in self._positions or pid in self._added_positions
+
+    def _locate(self, pids):
+        # Splits pids into live base positions and buffered (chunk, row) pairs
+        base_positions, added = [], []
+        for pid in pids:
+            if pid in self._positions:
+                base_positions.append(self._positions[pid])
+            elif pid in self._added_positions:
+                added.append((pid, self._added_positions[pid]))
+
+        # Rows keep their collection order, like a boolean mask would
+        return sorted(set(base_positions)), sorted(set(added), key=lambda item: item[1])
+
+    def rows(self, pids):
+        # The rows of the given pids, without removing them
+        base_positions, added = self._locate(pids)
+        parts = []
+        if base_positions:
+            parts.append(self.base.iloc[base_positions])
+        for _, (chunk, row) in added:
+            parts.append(self._added[chunk].iloc[[row]])
+        if not parts:
+            return self.base.iloc[0:0].copy()
+        return pd.concat(parts, sort=False).copy()
+
+    def rows_ranked(self, pids):
+        # Like rows(), but in the order of 'pids'
+        base_positions, base_ranks = [], []
+        added_parts, added_ranks = [], []
+        for rank, pid in enumerate(pids):
+            if pid in self._positions:
+                base_positions.append(self._positions[pid])
+                base_ranks.append(rank)
+            elif pid in self._added_positions:
+                chunk, row = self._added_positions[pid]
+                added_parts.append(self._added[chunk].iloc[[row]])
+                added_ranks.append(rank)
+
+        if not added_parts:
+            return self.base.iloc[base_positions]
+
+        rows = pd.concat([self.base.iloc[base_positions], *added_parts], sort=False)
+        return rows.iloc[np.argsort(base_ranks + added_ranks, kind="stable")]
+
+    def take(self, pids):
+        # Removes the rows of the given pids and returns them
+        taken = self.rows(pids)
+        base_positions, added = self._locate(pids)
+
+        for position in base_positions:
+            self._alive[position] = False
+            del self._positions[self.base[self.id_col].iat[position]]
+
+        for pid, _ in added:
+            del self._added_positions[pid]
+
+        if self.search_index is not None:
+            self.search_index.remove(taken[self.id_col].tolist())
+        if self.aggregates is not None:
+            self.aggregates.remove(taken)
+
+        self._frame = None
+        return taken
+
+    def put(self, rows):
+        # Adds rows, keeping only the columns this collection has
+        cols = [col for col in rows.columns if col in self.base.columns]
+        chunk = rows[cols].reset_index(drop=True)
+
+        chunk_number = len(self._added)
+        self._added.append(chunk)
+        for row, pid in enumerate(chunk[self.id_col].tolist()):
+            self._added_positions[pid] = (chunk_number, row)
+
+        if self.search_index is not None:
+            self.search_index.add(chunk)
+        if self.aggregates is not None:
+            self.aggregates.add(chunk)
+
+        self._frame = None
+
+    def set_values(self, pids, col, value):
+        # Sets 'col' to 'value' for the given pids
+        base_positions, added = self._locate(pids)
+
+        tracked = self.aggregates is not None and col in uagg.TRACKED_COLUMNS
+        if tracked:
+            before = self.rows(pids)
+
+        if base_positions:
+            self.base.iloc[base_positions, self.base.columns.get_loc(col)] = value
+
+        for _, (chunk, row) in added:
+            if col in self._added[chunk].columns:
+                self._added[chunk].iloc[row, self._added[chunk].columns.get_loc(col)] = value
+
+        if tracked:
+            self.aggregates.replace(before, self.rows(pids))
+
+    def search(self, search_term, col='name', fuzzy=False):
+        # str_search_col over the live rows, without compacting
+
+        # Fuzzy searches need an index. It's built once and kept in sync from then on
+        if fuzzy and self.search_index is None:
+            self.search_index = usearch.TrigramIndex(columns=[col])
+            self.search_index.add(self.frame())
+
+        # Indexed columns: only the hits are looked up, in ranking order
+        if self.search_index is not None and self.search_index.indexes(col):
+            ranked = [pid for pid in self.search_index.search(search_term, col, fuzzy=fuzzy) if pid in self]
+            return self.rows_ranked(ranked)
+
+        hits = str_search_col(self.base, search_term, col, fuzzy=fuzzy)
+        if not self._alive.all():
+            positions = self.base.index.get_indexer(hits.index) if self.base.index.is_unique else None
+            if positions is not None:
+                hits = hits[self._alive[positions]]
+            else:
+                hits = hits[hits[self.id_col].isin(self._positions)]
+
+        parts = [hits]
+        for chunk in self._added:
+            chunk_hits = str_search_col(chunk, search_term, col, fuzzy=fuzzy)
+            parts.append(chunk_hits[chunk_hits[self.id_col].isin(self._added_positions)])
+
+        parts = [part for part in parts if not part.empty]
+        if len(parts) <= 1:
+            return parts[0] if parts else hits
+        return pd.concat(parts, ignore_index=True, sort=False)
+
+    def frame(self):
+        """
+        Returns the collection as a DataFrame, compacting tombstones and the
+        arrival buffer (once) if there were changes since the last call.
+        """
+        if self._frame is not None:
+            return self._frame
+
+        live = self.base[self._alive]
+
+        # Arrived rows that are still here, in arrival order
+        rows_by_chunk = {}
+        for chunk_number, row in self._added_positions.values():
+            rows_by_chunk.setdefault(chunk_number, []).append(row)
+
+        added_parts = [self._added[chunk_number].iloc[sorted(rows)]
+                       for chunk_number, rows in sorted(rows_by_chunk.items())]
+
+        # Same result as the DataFrame path of transfer_cards
+        if added_parts:
+            compacted = pd.concat([live, *added_parts], ignore_index=True, sort=False)
+        else:
+            compacted = live.copy()
+
+        self._reset(compacted)
+        return compacted
+
+
 if __name__ == '__main__':
     print_string = "This module contains functions:\n \
                     'load_collection_to_df'\n \
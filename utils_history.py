@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+import utils_ids as uid
+import utils_input as ui
+import utils_cards as uc
+import utils_storage as us
+import utils_df as ud
+
+
+# Prices recorded per printing and day
+HISTORY_PRICE_COLUMNS = uc.RAW_PRICE_COLUMNS
+
+# Column files of the store and their dtypes
+COLUMN_DTYPES = {"card": np.int32, "day": np.int32, **{col: np.float64 for col in HISTORY_PRICE_COLUMNS}}
+
+META_FILE = "meta.json"
+IDS_FILE = "ids.npy"
+
+
+def to_day(date):
+    # Date -> int day number (days since 1970-01-01)
+    return int(np.datetime64(pd.Timestamp(date).normalize(), "D").astype(np.int64))
+
+
+def from_days(days):
+    return pd.to_datetime(np.asarray(days, dtype=np.int64).astype("datetime64[D]"))
+
+
+class PriceHistory:
+    """
+    Append-only, columnar price history of the card table: one row per
+    printing and day its prices changed. Every column is a raw binary file
+    read through a memory map; printings are stored as interned int32
+    codes. 'meta.json' holds the committed row count, so a refresh that
+    was interrupted mid-append is ignored and overwritten by the next one.
+    """
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        os.makedirs(self.folder, exist_ok=True)
+
+        meta_path = self.folder / META_FILE
+        self.rows = 0
+        if meta_path.exists():
+            with open(meta_path, encoding="utf-8") as in_file:
+                self.rows = int(json.load(in_file)["rows"])
+
+        ids_path = self.folder / IDS_FILE
+        self.interner = uid.UuidInterner()
+        if ids_path.exists():
+            self.interner.intern(uid.bytes_to_uuids(np.load(ids_path)))
+        self._saved_ids = len(self.interner)
+
+        self._columns = {}
+
+    def __len__(self):
+        return self.rows
+
+    def _path(self, name):
+        return self.folder / f"{name}.bin"
+
+    def column(self, name):
+        # Memory map of one column, limited to the committed rows
+        if name not in self._columns:
+            if self.rows == 0:
+                self._columns[name] = np.empty(0, dtype=COLUMN_DTYPES[name])
+            else:
+                self._columns[name] = np.memmap(self._path(name), dtype=COLUMN_DTYPES[name], mode="r", shape=(self.rows,))
+        return self._columns[name]
+
+    def prices(self, rows=None):
+        # Price columns of the given row positions (all rows by default), as a 2-D array
+        columns = [self.column(col) for col in HISTORY_PRICE_COLUMNS]
+        if rows is None:
+            return np.column_stack(columns) if self.rows else np.empty((0, len(columns)))
+        return np.column_stack([col[rows] for col in columns]) if len(rows) else np.empty((0, len(columns)))
+
+    # ========== QUERIES ==========
+
+    def latest(self, date=None):
+        """
+        Row positions of the latest record of every printing on or before
+        'date' (all records by default), ordered by printing code.
+        """
+        codes, days = self.column("card"), self.column("day")
+        rows = np.arange(self.rows)
+        if date is not None:
+            rows = rows[days <= to_day(date)]
+        if len(rows) == 0:
+            return rows
+
+        # Sort by printing, then day, then append order. The last row per printing wins
+        order = rows[np.lexsort((rows, days[rows], codes[rows]))]
+        sorted_codes = codes[order]
+        last = np.append(sorted_codes[1:] != sorted_codes[:-1], True)
+        return order[last]
+
+    def snapshot(self, date=None):
+        # Prices of every printing as of 'date': id, date of the record, prices
+        rows = self.latest(date)
+        snapshot = pd.DataFrame(self.prices(rows), columns=HISTORY_PRICE_COLUMNS)
+        snapshot.insert(0, "date", from_days(self.column("day")[rows]))
+        snapshot.insert(0, "id", self.interner.uuids(self.column("card")[rows]))
+        return snapshot
+
+    def series(self, card_id):
+        # Every recorded change of one printing, one row per day
+        code = self.interner.code(card_id)
+        rows = np.flatnonzero(self.column("card") == code) if code != uid.MISSING_CODE else np.empty(0, dtype=np.int64)
+
+        series = pd.DataFrame(self.prices(rows), columns=HISTORY_PRICE_COLUMNS)
+        series.insert(0, "date", from_days(self.column("day")[rows]))
+
+        # A corrected refresh of the same day replaces the earlier record
+        series = series.iloc[np.argsort(series["date"].to_numpy(), kind="stable")]
+        return series.drop_duplicates(subset=["date"], keep="last").reset_index(drop=True)
+
+    def top_movers(self, start, end, column="usd_reg", n=20):
+        """
+        Printings with the largest relative price change of 'column' between
+        the 'start' and 'end' dates (as-of prices on both days).
+        """
+        price_col = HISTORY_PRICE_COLUMNS.index(column)
+        before = np.full(len(self.interner), np.nan)
+        after = np.full(len(self.interner), np.nan)
+
+        for target, date in [(before, start), (after, end)]:
+            rows = self.latest(date)
+            target[self.column("card")[rows]] = self.prices(rows)[:, price_col]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            change = after - before
+            change_pct = 100 * change / before
+
+        movers = pd.DataFrame({
+            "id": self.interner.uuids(np.arange(len(self.interner))),
+            f"{column} start": before,
+            f"{column} end": after,
+            "change": change,
+            "change %": change_pct,
+        })
+        movers = movers[np.isfinite(change_pct)]
+        order = np.argsort(-np.abs(movers["change %"].to_numpy()), kind="stable")[:n]
+        return movers.iloc[order].reset_index(drop=True)
+
+    def rolling_change(self, card_id, days=7, column="usd_reg"):
+        # Daily as-of prices of one printing and their change over 'days'
+        series = self.series(card_id)
+        if series.empty:
+            return pd.DataFrame(columns=["date", column, "change", "change %"])
+
+        daily = series.set_index("date")[column].asfreq("D").ffill()
+        return pd.DataFrame({
+            column: daily,
+            "change": daily.diff(days),
+            "change %": 100 * daily.pct_change(days, fill_method=None),
+        }).rename_axis("date").reset_index()
+
+    # ========== APPENDING ==========
+
+    def append(self, cards, date=None):
+        """
+        Records the prices of the card table 'cards' for 'date' (today by
+        default). Printings whose prices didn't change since their latest
+        record are skipped. Returns the number of rows written.
+        """
+        day = to_day(date if date is not None else pd.Timestamp.now())
+        cards = cards[cards["id"].notna()].drop_duplicates(subset=["id"], keep="last")
+
+        new_prices = np.column_stack([cards[col].to_numpy(dtype=float) if col in cards.columns
+                                      else np.full(len(cards), np.nan) for col in HISTORY_PRICE_COLUMNS])
+        codes = self.interner.intern(cards["id"])
+
+        # Latest stored prices, aligned with 'cards'
+        old_prices = np.full((len(self.interner), len(HISTORY_PRICE_COLUMNS)), np.nan)
+        recorded = np.zeros(len(self.interner), dtype=bool)
+        rows = self.latest()
+        old_prices[self.column("card")[rows]] = self.prices(rows)
+        recorded[self.column("card")[rows]] = True
+        old_prices, recorded = old_prices[codes], recorded[codes]
+
+        same = (old_prices == new_prices) | (np.isnan(old_prices) & np.isnan(new_prices))
+        changed = ~same.all(axis=1)
+        changed &= recorded | ~np.isnan(new_prices).all(axis=1)
+
+        if not changed.any():
+            self._save_ids()
+            return 0
+
+        new_columns = {"card": codes[changed], "day": np.full(changed.sum(), day)}
+        for i, col in enumerate(HISTORY_PRICE_COLUMNS):
+            new_columns[col] = new_prices[changed, i]
+
+        # Rows past the committed count are leftovers of an interrupted append
+        for name, values in new_columns.items():
+            path = self._path(name)
+            with open(path, "ab") as out_file:
+                out_file.truncate(self.rows * np.dtype(COLUMN_DTYPES[name]).itemsize)
+                out_file.write(np.ascontiguousarray(values, dtype=COLUMN_DTYPES[name]).tobytes())
+                out_file.flush()
+                os.fsync(out_file.fileno())
+
+        self._save_ids()
+        self.rows += int(changed.sum())
+        us.atomic_write(self.folder / META_FILE, json.dumps({"rows": self.rows}).encode("utf-8"))
+
+        self._columns = {}
+        return int(changed.sum())
+
+    def _save_ids(self):
+        # Codes never change, so the file only grows
+        if self._saved_ids == len(self.interner):
+            return
+
+        buffer = BytesIO()
+        np.save(buffer, uid.uuids_to_bytes(self.interner.uuids(np.arange(len(self.interner)))))
+        us.atomic_write(self.folder / IDS_FILE, buffer.getvalue())
+        self._saved_ids = len(self.interner)
+
+
+def main():
+    # Prints the price history of printings and the top movers of the last week
+    # Usage: python utils_history.py config.json [scryfall id ...]
+
+    config_file = sys.argv[1]
+    inputs = ui.get_parameters(config_file)
+
+    BASE_DIR = Path(__file__).resolve().parent
+    DATA_DIR = BASE_DIR / inputs["data_folder"]
+
+    history = PriceHistory(DATA_DIR / inputs.get("price_history_folder", "price_history"))
+
+    for card_id in sys.argv[2:]:
+        ud.display_dynamic_df(history.series(card_id), title=f"Price history of {card_id}")
+
+    today = pd.Timestamp.now().normalize()
+    movers = history.top_movers(today - pd.Timedelta(days=7), today)
+
+    # Names come from the card table, if there is one
+    cards_path = DATA_DIR / inputs.get("cards_file", "cards.csv")
+    if os.path.exists(cards_path) and not movers.empty:
+        cards = ud.load_collection_to_df(cards_path, inputs["card_column_types"], inputs["csv_config"])
+        names = cards.drop_duplicates(subset=["id"]).set_index("id")[["name", "set_name"]]
+        movers = movers.join(names, on="id")
+
+    print(f"{len(history)} price records of {len(history.interner)} printings.")
+    ud.display_dynamic_df(movers, title="Top movers of the last 7 days (usd)")
+
+
+if __name__ == '__main__':
+    main()
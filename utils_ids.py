@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+import uuid
+
+import pandas as pd
+import numpy as np
+
+
+# Standard padding of prefixed ids (e.g., 5 for p00001)
+ID_PADDING = 5
+
+# Code used for missing or unparsable ids
+MISSING_CODE = -1
+
+
+# Collections keep 'id' and 'pid' as strings. A frame is rebuilt by every
+# transfer, so integer codes would be encoded again per call, which costs
+# more than the string isin / get_indexer it replaces ('python benchmarks.py
+# ids'). Integer codes are for derived tables built once per load: the
+# activity links, price history, integrity checks and profit and loss.
+
+# ========== PREFIXED IDS (pids and event ids) ==========
+
+def encode_prefixed(series, prefix="p"):
+    """
+    Converts prefixed id strings ('p00012', 'e00003') to their integer part.
+    Ids with another prefix, missing ids, and ids whose rest isn't plain
+    digits ('p1e5', 'p-5') become MISSING_CODE.
+    Returns an int64 numpy array aligned with the series.
+    """
+    if not isinstance(series, pd.Series):
+        series = pd.Series(list(series), dtype=object)
+
+    if series.empty:
+        return np.empty(0, dtype=np.int64)
+
+    # Fast path: fixed-width unicode array, digits parsed column by column
+    codes = _encode_fixed_width(series.to_numpy(dtype=object), prefix)
+    if codes is not None:
+        return codes
+
+    # Only look at strings that start with the prefix
+    values = series.astype(object)
+    is_prefixed = values.str.startswith(prefix, na=False).to_numpy(dtype=bool)
+
+    codes = np.full(len(values), MISSING_CODE, dtype=np.int64)
+    if not is_prefixed.any():
+        return codes
+
+    # Surrounding whitespace is tolerated, signs, exponents and separators are not
+    digits = values[is_prefixed].str[len(prefix):].str.strip()
+    is_id = digits.str.fullmatch(r"[0-9]{1,18}").fillna(False).to_numpy(dtype=bool)
+    codes[np.flatnonzero(is_prefixed)[is_id]] = digits[is_id].astype(np.int64).to_numpy()
+
+    return codes
+
+
+def _encode_fixed_width(values, prefix):
+    """
+    encode_prefixed on a numpy character matrix. Returns None when the
+    values are too wide to be ids (e.g. a stray long string), so the caller
+    falls back to the string accessor path.
+    """
+    chars = np.asarray(values, dtype="U")
+    width = chars.dtype.itemsize // 4
+    if width <= len(prefix) or width > len(prefix) + 18:
+        return None
+
+    # One row of code points per value, zero padded on the right
+    matrix = chars.view(np.uint32).reshape(len(chars), width)
+    lengths = (matrix != 0).sum(axis=1)
+
+    # The string path strips surrounding whitespace, leave such values to it
+    if ((matrix > 0) & (matrix <= 32)).any():
+        return None
+
+    valid = lengths > len(prefix)
+    for i, char in enumerate(prefix):
+        valid &= matrix[:, i] == ord(char)
+
+    codes = np.zeros(len(chars), dtype=np.int64)
+    for j in range(len(prefix), width):
+        digits = matrix[:, j].astype(np.int64) - ord("0")
+        in_id = j < lengths
+        valid &= ~in_id | ((digits >= 0) & (digits <= 9))
+        codes = np.where(in_id, codes * 10 + digits, codes)
+
+    return np.where(valid, codes, MISSING_CODE)
+
+
+def decode_prefixed(codes, prefix="p", padding=ID_PADDING):
+    """
+    Converts integer codes back to prefixed id strings.
+    MISSING_CODE becomes None. Returns an object numpy array.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    out = np.empty(len(codes), dtype=object)
+
+    valid = codes != MISSING_CODE
+    out[valid] = [f"{prefix}{c:0{padding}d}" for c in codes[valid]]
+
+    return out
+
+
+def pid_to_int(pid, prefix="p"):
+    # Scalar version of encode_prefixed
+    if not isinstance(pid, str) or not pid.startswith(prefix):
+        return MISSING_CODE
+    digits = pid[len(prefix):].strip()
+    if not (digits.isascii() and digits.isdecimal()):
+        return MISSING_CODE
+    return int(digits)
+
+
+def int_to_pid(code, prefix="p", padding=ID_PADDING):
+    # Scalar version of decode_prefixed
+    if code == MISSING_CODE:
+        return None
+    return f"{prefix}{int(code):0{padding}d}"
+
+
+def explode_id_lists(series, prefix="p"):
+    """
+    Splits space separated id lists (the 'in'/'out' activity columns) once.
+    Returns two aligned int64 arrays: the row positions and the id codes.
+    Placeholders ('-'), blanks and malformed ids are dropped.
+    """
+    if len(series) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+
+    exploded = series.astype(object).str.split().explode()
+    exploded = exploded.dropna()
+
+    # Row positions instead of labels, so the arrays are index independent
+    positions = pd.Series(np.arange(len(series)), index=series.index)
+    rows = positions.loc[exploded.index].to_numpy(dtype=np.int64)
+    codes = encode_prefixed(exploded, prefix)
+
+    keep = codes != MISSING_CODE
+    return rows[keep], codes[keep]
+
+
+# ========== SCRYFALL UUIDS ==========
+
+def uuids_to_bytes(series):
+    """
+    Converts Scryfall UUID strings to 16-byte binary values.
+    Missing ids become 16 zero bytes. Returns a numpy 'S16' array.
+    """
+    out = np.zeros(len(series), dtype="S16")
+    for i, value in enumerate(series):
+        if isinstance(value, str):
+            out[i] = uuid.UUID(value).bytes
+    return out
+
+
+def bytes_to_uuids(values):
+    # Inverse of uuids_to_bytes. Zero bytes become None.
+    out = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        # numpy strips trailing null bytes from 'S16' elements
+        raw = bytes(value).ljust(16, b"\0")
+        out[i] = str(uuid.UUID(bytes=raw)) if raw != bytes(16) else None
+    return out
+
+
+class UuidInterner:
+    """
+    Maps Scryfall UUID strings to dense int32 surrogate keys.
+    Codes are handed out in order of first appearance and never change,
+    so joins and lookups can run on integers for the whole session.
+    """
+
+    def __init__(self, uuids=None):
+        self._codes = {}
+        self._uuids = []
+        if uuids is not None:
+            self.intern(uuids)
+
+    def __len__(self):
+        return len(self._uuids)
+
+    def __contains__(self, value):
+        return value in self._codes
+
+    def intern(self, series):
+        """
+        Returns int32 codes for all UUIDs in 'series', adding unseen ones.
+        Missing values get MISSING_CODE.
+        """
+        if not isinstance(series, pd.Series):
+            series = pd.Series(list(series), dtype=object)
+
+        # Register new UUIDs once per unique value
+        for value in pd.unique(series.dropna()):
+            if value not in self._codes:
+                self._codes[value] = len(self._uuids)
+                self._uuids.append(value)
+
+        return self.lookup(series)
+
+    def lookup(self, series):
+        """
+        Returns int32 codes for 'series' without adding anything.
+        Unknown and missing values get MISSING_CODE.
+        """
+        if not isinstance(series, pd.Series):
+            series = pd.Series(list(series), dtype=object)
+
+        codes = series.astype(object).map(self._codes)
+        return codes.fillna(MISSING_CODE).to_numpy(dtype=np.int32)
+
+    def code(self, value):
+        # Scalar lookup
+        return self._codes.get(value, MISSING_CODE)
+
+    def uuids(self, codes):
+        """
+        Converts int32 codes back to UUID strings. Returns an object numpy array.
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        table = np.array(self._uuids + [None], dtype=object)
+
+        # MISSING_CODE (-1) points at the trailing None
+        return table[codes]
+
+
+if __name__ == '__main__':
+    print_string = "This module contains functions:\n \
+                    'encode_prefixed'\n \
+                    'decode_prefixed'\n \
+                    'explode_id_lists'\n \
+                    'uuids_to_bytes'\n \
+                    'UuidInterner'"
+    print(print_string)
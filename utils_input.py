@@ -4,6 +4,8 @@ import sys
 
 import pandas as pd
 
+import utils_ids as uid
+
 def get_typed_input(prompt, target_type, default=None, display_default=True):
     """
     Asks for user input and converts it to a specific target_type.
@@ -132,26 +134,40 @@ def progress_bar(iteration, total, prefix='', suffix='', length=30, fill='█'):
     
 
 def generate_next_pid(pid_series, prefix):
-    # Standardize padding length (e.g., 5 for 00001)
-    padding = 5 
-    
-    if pid_series.empty:
-        return f"{prefix}{1:0{padding}d}"
-        
-    valid_pids = pid_series.dropna()
-    # Ensure we only look at IDs with the specific prefix provided
-    valid_pids = valid_pids[valid_pids.str.startswith(prefix, na=False)]
+    # One-off scan. Code that allocates repeatedly should share an IdAllocator
+    allocator = IdAllocator()
+    allocator.scan(pid_series, prefix)
+    return allocator.peek(prefix)
 
-    if valid_pids.empty:
-        return f"{prefix}{1:0{padding}d}"
 
-    # FIX: Use len(prefix) to slice correctly regardless of prefix length
-    # This peels off 'p', 'tc', or 'anything' accurately
-    numeric_parts = valid_pids.str[len(prefix):].str.extract(r'(\d+)')[0]
-    
-    next_number = pd.to_numeric(numeric_parts, errors='coerce').max() + 1
-    
-    if pd.isna(next_number):
-        return f"{prefix}{1:0{padding}d}"
+class IdAllocator:
+    """
+    Hands out prefixed ids ('p00001', 'e00001') in O(1).
+    Existing ids are scanned once, after that only the largest number
+    per prefix is kept.
+    """
 
-    return f"{prefix}{int(next_number):0{padding}d}"
+    def __init__(self, padding=uid.ID_PADDING):
+        self.padding = padding
+        self._max = {}
+
+    def scan(self, id_series, prefix):
+        # Registers existing ids. Can be called once per id source
+        codes = uid.encode_prefixed(id_series, prefix)
+        largest = int(codes.max()) if len(codes) else 0
+        self._max[prefix] = max(self._max.get(prefix, 0), largest)
+
+    def peek(self, prefix):
+        # The id next() will return, without allocating it
+        return f"{prefix}{self._max.get(prefix, 0) + 1:0{self.padding}d}"
+
+    def next(self, prefix):
+        new_id = self.peek(prefix)
+        self._max[prefix] = self._max.get(prefix, 0) + 1
+        return new_id
+
+    def reserve(self, prefix, count):
+        # Allocates a block of 'count' consecutive ids
+        start = self._max.get(prefix, 0) + 1
+        self._max[prefix] = start + count - 1
+        return [f"{prefix}{number:0{self.padding}d}" for number in range(start, start + count)]
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+import utils_ids as uid
+import utils_input as ui
+import utils_activity as ua
+import utils_storage as us
+import utils_df as ud
+
+
+# Columns of the violation report
+VIOLATION_COLUMNS = ["check", "collection", "pid", "event", "detail"]
+
+
+def link_summary(links, direction):
+    """
+    Per pid, the number of activity links in 'direction' and the event and
+    day of the latest one. Returns a DataFrame indexed by pid code.
+    """
+    mask = links.directions == ua.DIRECTION_CODES[direction]
+    pids, events, days = links.pids[mask], links.events[mask], links.days[mask]
+
+    # Links are sorted by pid and date, so groups are contiguous runs
+    starts = np.flatnonzero(np.append(True, pids[1:] != pids[:-1])) if len(pids) else np.empty(0, dtype=np.int64)
+    ends = np.append(starts[1:], len(pids)) if len(pids) else starts
+    last = ends - 1
+
+    return pd.DataFrame({
+        "count": ends - starts,
+        "event": events[last],
+        "day": days[last],
+    }, index=pids[starts])
+
+
+def violations(check, collection, pids, events=None, detail=None):
+    # Builds report rows from pid codes and optional event codes / details
+    pids = np.asarray(pids, dtype=np.int64)
+    if events is None:
+        events = np.full(len(pids), uid.MISSING_CODE)
+
+    return pd.DataFrame({
+        "check": check,
+        "collection": collection,
+        "pid": uid.decode_prefixed(pids, "p"),
+        "event": uid.decode_prefixed(np.asarray(events, dtype=np.int64), "e"),
+        "detail": detail if detail is not None else "",
+    })
+
+
+def day_strings(days):
+    # Day numbers as YYYY-MM-DD, "-" where there's no date
+    text = ua.from_day_numbers(days).dt.strftime("%Y-%m-%d")
+    return text.fillna(ua.EMPTY_PLACEHOLDER).to_numpy(dtype=object)
+
+
+def check_dates(check, collection, codes, dates, summary):
+    # Rows whose date column disagrees with the date of their (latest) event
+    linked = summary.reindex(codes)
+    has_event = linked["count"].notna().to_numpy()
+
+    card_days = ua.to_day_numbers(dates)
+    event_days = linked["day"].to_numpy(dtype=float)
+    event_days = np.where(has_event, event_days, ua.NO_DAY).astype(np.int64)
+
+    wrong = has_event & (card_days != event_days)
+    detail = "card " + day_strings(card_days[wrong]) + ", event " + day_strings(event_days[wrong])
+    events = linked["event"].to_numpy(dtype=float)[wrong].astype(np.int64)
+    return violations(check, collection, codes[wrong], events, detail)
+
+
+def check_integrity(vault, archive, activity, links=None):
+    """
+    Checks the references between vault, archive and the activity log:
+     - every vault pid is listed in exactly one 'in' event and no 'out' event
+     - every archive pid is listed in exactly one 'out' event
+     - 'in date' / 'out date' match the date of the card's event
+     - pids are unique across vault and archive, and every pid of the
+       activity log exists in one of them
+    The activity strings are exploded once (or 'links' reused). Returns a
+    DataFrame of violations, empty if everything agrees.
+    """
+    if links is None:
+        links = ua.build_links(activity)
+
+    ins = link_summary(links, "in")
+    outs = link_summary(links, "out")
+
+    parts = []
+
+    # ========== PIDS ==========
+    # Rows without a valid pid are reported once and left out of the other checks
+    valid, pid_codes = {}, {}
+    for name, df in [("vault", vault), ("archive", archive)]:
+        codes = uid.encode_prefixed(df["pid"], "p")
+        valid[name] = codes != uid.MISSING_CODE
+        pid_codes[name] = codes[valid[name]]
+
+        missing = int((~valid[name]).sum())
+        if missing:
+            parts.append(pd.DataFrame([{"check": "missing pid", "collection": name, "pid": None, "event": None,
+                                        "detail": f"{missing} rows without a valid pid"}]))
+
+        unique, counts = np.unique(codes[valid[name]], return_counts=True)
+        parts.append(violations("duplicate pid", name, unique[counts > 1],
+                                detail=pd.Series(counts[counts > 1]).astype(str).radd("rows: ").to_numpy(dtype=object)))
+
+    vault_codes, archive_codes = pid_codes["vault"], pid_codes["archive"]
+    if not valid["vault"].all():
+        vault = vault[valid["vault"]]
+    if not valid["archive"].all():
+        archive = archive[valid["archive"]]
+
+    both = np.intersect1d(vault_codes, archive_codes)
+    parts.append(violations("pid in vault and archive", "both", both))
+
+    # ========== VAULT ==========
+    in_counts = ins["count"].reindex(vault_codes).fillna(0).to_numpy(dtype=np.int64)
+    parts.append(violations("no in event", "vault", vault_codes[in_counts == 0]))
+    several = in_counts > 1
+    parts.append(violations("several in events", "vault", vault_codes[several],
+                            detail=pd.Series(in_counts[several]).astype(str).radd("in events: ").to_numpy(dtype=object)))
+
+    sold = outs.reindex(vault_codes)
+    has_out = sold["count"].notna().to_numpy()
+    parts.append(violations("out event for vault card", "vault", vault_codes[has_out],
+                            sold["event"].to_numpy(dtype=float)[has_out].astype(np.int64)))
+
+    if "in date" in vault.columns:
+        parts.append(check_dates("in date mismatch", "vault", vault_codes, vault["in date"], ins))
+
+    # ========== ARCHIVE ==========
+    out_counts = outs["count"].reindex(archive_codes).fillna(0).to_numpy(dtype=np.int64)
+    parts.append(violations("no out event", "archive", archive_codes[out_counts == 0]))
+    several = out_counts > 1
+    parts.append(violations("several out events", "archive", archive_codes[several],
+                            detail=pd.Series(out_counts[several]).astype(str).radd("out events: ").to_numpy(dtype=object)))
+
+    if "in date" in archive.columns:
+        parts.append(check_dates("in date mismatch", "archive", archive_codes, archive["in date"], ins))
+    if "out date" in archive.columns:
+        parts.append(check_dates("out date mismatch", "archive", archive_codes, archive["out date"], outs))
+
+    # ========== ACTIVITY ==========
+    known = np.concatenate([vault_codes, archive_codes])
+    unknown = ~np.isin(links.pids, known)
+    names = np.array(list(ua.DIRECTION_CODES), dtype=object)
+    parts.append(violations("unknown pid in event", "activity", links.pids[unknown], links.events[unknown],
+                            names[links.directions[unknown].astype(np.int64)]))
+
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return pd.DataFrame(columns=VIOLATION_COLUMNS)
+    return pd.concat(parts, ignore_index=True)[VIOLATION_COLUMNS]
+
+
+def main():
+    # Checks vault, archive and activity against each other
+    # Usage: python utils_integrity.py config.json [report.csv]
+
+    config_file = sys.argv[1]
+    inputs = ui.get_parameters(config_file)
+
+    BASE_DIR = Path(__file__).resolve().parent
+    DATA_DIR = BASE_DIR / inputs["data_folder"]
+
+    csv_config = inputs["csv_config"]
+    vault_columns = inputs["data_column_types"]
+    activity_path = DATA_DIR / inputs["activity_file"]
+
+    vault = ud.load_collection_to_df(DATA_DIR / inputs["vault_file"], vault_columns, csv_config)
+    archive = ud.load_collection_to_df(DATA_DIR / inputs["archive_file"], vault_columns, csv_config)
+
+    if os.path.exists(activity_path):
+        activity = ud.load_collection_to_df(activity_path, inputs["activity_column_types"], csv_config)
+    else:
+        activity = pd.DataFrame(columns=inputs["activity_column_types"].keys())
+
+    report = check_integrity(vault, archive, activity)
+
+    if report.empty:
+        print(f"No violations in {len(vault)} vault cards, {len(archive)} archived cards and {len(activity)} events.")
+        return
+
+    counts = report.groupby(["check", "collection"], sort=False).size().reset_index(name="count")
+    ud.display_dynamic_df(counts, title="Integrity Violations")
+    ud.display_dynamic_df(report, title="Violation Details")
+
+    if len(sys.argv) > 2:
+        report_path = Path(sys.argv[2])
+        us.atomic_write(report_path, us.serialize_csv(report, csv_config))
+        print(f"Report written to '{report_path}'.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+import utils_ids as uid
+import utils_input as ui
+import utils_activity as ua
+import utils_rates as ur
+import utils_df as ud
+
+
+# Group columns of the default report
+DEFAULT_GROUPS = ["location", "set_name", "in event"]
+
+# Summed columns of a grouped report
+SUM_COLUMNS = ["cards", "cost eur", "value eur", "gain eur", "trend gain usd", "trend gain eur"]
+
+# Summed columns added when a rate table is given
+USD_COLUMNS = ["cost usd", "value usd", "gain usd"]
+
+
+def column(df, col):
+    # A float column, NaN if the collection doesn't have it
+    if col in df.columns:
+        return df[col].to_numpy(dtype=float)
+    return np.full(len(df), np.nan)
+
+
+def date_column(df, col):
+    if col in df.columns:
+        return pd.to_datetime(df[col], errors="coerce").to_numpy(dtype="datetime64[D]")
+    return np.full(len(df), np.datetime64("NaT"), dtype="datetime64[D]")
+
+
+def annualize(returns, days):
+    # Holding-period returns to yearly rates. Needs at least one day held
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        annual = np.power(1 + returns, 365.0 / days) - 1
+    return np.where((days >= 1) & (returns > -1), annual, np.nan)
+
+
+def events_of(codes, links, direction):
+    """
+    The event of every pid code in 'direction' (the latest one if there
+    are several), found with a binary search of the link table.
+    """
+    mask = links.directions == ua.DIRECTION_CODES[direction]
+    link_pids, link_events = links.pids[mask], links.events[mask]
+    if len(link_pids) == 0:
+        return np.full(len(codes), None, dtype=object)
+
+    # Links are sorted by pid, then date: the last link of a pid is its latest
+    found = np.searchsorted(link_pids, codes, side="right") - 1
+    safe = np.maximum(found, 0)
+    valid = (found >= 0) & (link_pids[safe] == codes)
+    events = np.where(valid, link_events[safe], uid.MISSING_CODE)
+
+    # Many cards share an event, so only the distinct ids are formatted
+    positions, unique_events = pd.factorize(events)
+    return uid.decode_prefixed(unique_events, "e")[positions]
+
+
+def card_pnl(df, realized, today=None, links=None, rates=None):
+    """
+    Gains of every card of 'df', with column arithmetic only.
+    Realized (archive): sold for 'out price eur', bought for 'in price eur'.
+    Unrealized (vault): valued at 'price trend eur' today.
+    'trend gain' is the market move of the card between its trends.
+    With 'rates' (ur.RateTable) the cost is also given in USD at the rate
+    of the in date, the value at the rate of the out date (or today).
+    """
+    today = np.datetime64(pd.Timestamp(today or pd.Timestamp.now()).normalize(), "D")
+
+    cost = column(df, "in price eur")
+    value = column(df, "out price eur" if realized else "price trend eur")
+    end_usd = column(df, "out trend usd" if realized else "price trend usd")
+    end_eur = column(df, "out trend eur" if realized else "price trend eur")
+
+    in_dates = date_column(df, "in date")
+    out_dates = date_column(df, "out date") if realized else np.full(len(df), today)
+    days = (out_dates - in_dates).astype("timedelta64[D]").astype(float)
+    days[np.isnat(in_dates) | np.isnat(out_dates)] = np.nan
+
+    gain = value - cost
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns = np.where(cost > 0, gain / cost, np.nan)
+
+    pnl = pd.DataFrame({
+        "pid": df["pid"] if "pid" in df.columns else None,
+        "status": "realized" if realized else "unrealized",
+        "cards": 1,
+        "cost eur": cost,
+        "value eur": value,
+        "gain eur": gain,
+        "return %": 100 * returns,
+        "days held": days,
+        "annualized %": 100 * annualize(returns, days),
+        "trend gain usd": end_usd - column(df, "in trend usd"),
+        "trend gain eur": end_eur - column(df, "in trend eur"),
+    }, index=df.index)
+
+    if rates is not None:
+        pnl["cost usd"] = rates.convert(cost, in_dates, to="usd")
+        pnl["value usd"] = rates.convert(value, out_dates, to="usd")
+        pnl["gain usd"] = pnl["value usd"] - pnl["cost usd"]
+
+    # Label columns keep their dtype, so nothing is re-inferred
+    for col in ["location", "set_name", "name", "finish"]:
+        if col in df.columns:
+            pnl[col] = df[col]
+
+    if links is not None and "pid" in df.columns:
+        codes = uid.encode_prefixed(df["pid"], "p")
+        pnl["in event"] = events_of(codes, links, "in")
+        if realized:
+            pnl["out event"] = events_of(codes, links, "out")
+
+    return pnl
+
+
+def collection_pnl(vault, archive, today=None, links=None, rates=None):
+    # Unrealized gains of the vault and realized gains of the archive, per card
+    return pd.concat([card_pnl(vault, realized=False, today=today, links=links, rates=rates),
+                      card_pnl(archive, realized=True, today=today, links=links, rates=rates)],
+                     ignore_index=True, sort=False)
+
+
+def group_pnl(pnl, by):
+    """
+    Sums gains per group. Returns are recomputed from the summed cost and
+    value, the annualized rate from the cost-weighted days held.
+    """
+    if isinstance(by, str):
+        by = [by]
+
+    # Only cards with a known cost count towards cost, value and gain
+    priced = pnl["cost eur"].notna() & pnl["value eur"].notna()
+    usd_columns = [col for col in USD_COLUMNS if col in pnl.columns]
+    frame = pnl[by + SUM_COLUMNS + usd_columns].copy()
+    for col in ["cost eur", "value eur", "gain eur"] + usd_columns:
+        frame[col] = frame[col].where(priced)
+    frame["weighted days"] = (pnl["days held"] * pnl["cost eur"]).where(priced & pnl["days held"].notna())
+    frame["dated cost"] = pnl["cost eur"].where(priced & pnl["days held"].notna())
+
+    grouped = frame.groupby(by, dropna=False, sort=True).sum(min_count=1)
+
+    cost = grouped["cost eur"].to_numpy(dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns = np.where(cost > 0, grouped["gain eur"].to_numpy(dtype=float) / cost, np.nan)
+        days = grouped["weighted days"].to_numpy(dtype=float) / grouped["dated cost"].to_numpy(dtype=float)
+
+    grouped["return %"] = 100 * returns
+    grouped["days held"] = days
+    grouped["annualized %"] = 100 * annualize(returns, days)
+    grouped["cards"] = grouped["cards"].fillna(0).astype(np.int64)
+
+    return grouped.drop(columns=["weighted days", "dated cost"]).reset_index()
+
+
+def main():
+    # Prints realized and unrealized gains, grouped
+    # Usage: python utils_pnl.py config.json [group column ...]
+
+    config_file = sys.argv[1]
+    inputs = ui.get_parameters(config_file)
+
+    BASE_DIR = Path(__file__).resolve().parent
+    DATA_DIR = BASE_DIR / inputs["data_folder"]
+
+    csv_config = inputs["csv_config"]
+    vault_columns = inputs["data_column_types"]
+    activity_path = DATA_DIR / inputs["activity_file"]
+
+    vault = ud.load_collection_to_df(DATA_DIR / inputs["vault_file"], vault_columns, csv_config)
+    archive = ud.load_collection_to_df(DATA_DIR / inputs["archive_file"], vault_columns, csv_config)
+
+    links = None
+    if activity_path.exists():
+        activity = ud.load_collection_to_df(activity_path, inputs["activity_column_types"], csv_config)
+        links = ua.load_links(DATA_DIR / inputs.get("activity_links_file", "activity_links.npz"), activity_path, activity)
+
+    # USD costs need the rate of each in date
+    rates = None
+    rates_path = DATA_DIR / inputs.get("exchange_rate_table_file", "exchange_rate_table.csv")
+    if rates_path.exists():
+        rates = ur.load_rate_table(rates_path, csv_config)
+
+    pnl = collection_pnl(vault, archive, links=links, rates=rates)
+
+    ud.display_dynamic_df(group_pnl(pnl, "status").round(2), title="Profit and Loss")
+    for group in sys.argv[2:] or DEFAULT_GROUPS:
+        if group not in pnl.columns:
+            print(f"Unknown group column '{group}'. Skipping...")
+            continue
+        ud.display_dynamic_df(group_pnl(pnl, ["status", group]).round(2), title=f"Profit and Loss by {group}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+import utils_input as ui
+import utils_storage as us
+import utils_activity as ua
+
+
+# Columns of the rate table: one EUR -> USD rate per day
+RATE_COLUMNS = ["date", "eur_to_usd"]
+
+# Column names accepted by a bulk import, and whether they hold the inverse rate
+# "usd" is the ECB reference rate files, "obs_value" the ECB Data Portal exports
+IMPORT_RATE_COLUMNS = {"eur_to_usd": False, "usd": False, "usd_to_eur": True, "eur": True, "obs_value": False}
+
+# Date column names accepted by a bulk import
+IMPORT_DATE_COLUMNS = ["date", "time_period", "time period"]
+
+# Series key of EUR -> USD rates in ECB Data Portal series columns
+ECB_SERIES_KEY = "exr.d.usd.eur"
+
+
+class RateTable:
+    """
+    Daily EUR/USD rates, sorted by day. Conversions are as-of lookups: a
+    date gets the rate of the latest recorded day on or before it, dates
+    before the first record get the first rate and missing dates get the
+    latest one. Extended by one record per refresh, or in bulk from a CSV.
+    """
+
+    def __init__(self, days=None, rates=None):
+        self.days = np.asarray(days if days is not None else [], dtype=np.int64)
+        self.rates = np.asarray(rates if rates is not None else [], dtype=float)
+
+    def __len__(self):
+        return len(self.days)
+
+    # ========== EXTENDING ==========
+
+    def merge(self, days, rates):
+        """
+        Adds rates for the given day numbers. A day that already has a rate
+        is overwritten. Rates that aren't positive numbers are ignored.
+        """
+        days = np.asarray(days, dtype=np.int64)
+        rates = np.asarray(rates, dtype=float)
+        valid = (days != ua.NO_DAY) & np.isfinite(rates) & (rates > 0)
+
+        # New records come last, so a stable sort puts them after old ones of the same day
+        all_days = np.concatenate([self.days, days[valid]])
+        all_rates = np.concatenate([self.rates, rates[valid]])
+        order = np.argsort(all_days, kind="stable")
+        all_days, all_rates = all_days[order], all_rates[order]
+
+        last = np.append(all_days[1:] != all_days[:-1], True) if len(all_days) else np.empty(0, dtype=bool)
+        self.days, self.rates = all_days[last], all_rates[last]
+        return int(valid.sum())
+
+    def record(self, eur_to_usd, date=None):
+        # The rate of one day (today by default)
+        date = pd.Timestamp(date if date is not None else pd.Timestamp.now())
+        return self.merge(ua.to_day_numbers(pd.Series([date])), [eur_to_usd])
+
+    # ========== LOOKUPS ==========
+
+    def latest(self, default=np.nan):
+        return float(self.rates[-1]) if len(self.rates) else default
+
+    def eur_to_usd(self, dates, default=np.nan):
+        """
+        EUR -> USD rate of every date in 'dates', as an array. 'default' is
+        used for every date while the table is empty.
+        """
+        days = ua.to_day_numbers(pd.Series(dates))
+        if len(self.days) == 0:
+            return np.full(len(days), default, dtype=float)
+
+        found = np.searchsorted(self.days, days, side="right") - 1
+        rates = self.rates[np.maximum(found, 0)]
+        return np.where(days == ua.NO_DAY, self.rates[-1], rates)
+
+    def usd_to_eur(self, dates, default=np.nan):
+        return 1.0 / self.eur_to_usd(dates, 1.0 / default)
+
+    def convert(self, values, dates, to="usd", default=np.nan):
+        """
+        Converts a column of EUR (to="usd") or USD (to="eur") values with the
+        rate of each value's date. 'default' is an EUR -> USD rate.
+        """
+        values = np.asarray(values, dtype=float)
+        rates = self.eur_to_usd(dates, default)
+        return values * rates if to == "usd" else values / rates
+
+    def to_df(self):
+        return pd.DataFrame({"date": ua.from_day_numbers(self.days), "eur_to_usd": self.rates})
+
+
+def read_rates_csv(file_path, csv_config=None):
+    """
+    Reads dates and EUR -> USD rates from a CSV with one of the
+    IMPORT_DATE_COLUMNS and one of the IMPORT_RATE_COLUMNS (case-insensitive),
+    or an ECB Data Portal column of the USD/EUR series. Inverse rates are
+    flipped. Returns (day numbers, rates), or None if the columns are missing.
+    """
+    csv_config = csv_config or {}
+    table = pd.read_csv(file_path, sep=csv_config.get("sep", ","), decimal=csv_config.get("decimal", "."),
+                        encoding=csv_config.get("encoding", "utf-8"), skipinitialspace=True)
+    table.columns = [str(col).strip().lower() for col in table.columns]
+
+    date_col = next((col for col in IMPORT_DATE_COLUMNS if col in table.columns), None)
+    rate_col = next((col for col in IMPORT_RATE_COLUMNS if col in table.columns), None)
+    inverse = IMPORT_RATE_COLUMNS.get(rate_col, False)
+    if rate_col is None:
+        rate_col = next((col for col in table.columns if ECB_SERIES_KEY in col), None)
+    if date_col is None or rate_col is None:
+        return None
+
+    # Observations of several currencies: only the USD ones
+    if rate_col == "obs_value" and "currency" in table.columns:
+        table = table[table["currency"].astype(str).str.strip().str.upper() == "USD"]
+
+    rates = pd.to_numeric(table[rate_col], errors="coerce").to_numpy(dtype=float)
+    if inverse:
+        with np.errstate(divide="ignore"):
+            rates = 1.0 / rates
+
+    return ua.to_day_numbers(table[date_col]), rates
+
+
+def load_rate_table(file_path, csv_config=None):
+    # The rate table saved at 'file_path'. Empty if there is none yet
+    if not os.path.exists(file_path):
+        return RateTable()
+
+    rates = read_rates_csv(file_path, csv_config)
+    table = RateTable()
+    if rates is not None:
+        table.merge(*rates)
+    return table
+
+
+def save_rate_table(table, file_path, csv_config=None):
+    us.atomic_write(file_path, us.serialize_csv(table.to_df(), csv_config))
+
+
+def main():
+    # Shows the rate table, or bulk-loads rates into it from CSV files
+    # Usage: python utils_rates.py config.json [rates.csv ...]
+
+    config_file = sys.argv[1]
+    inputs = ui.get_parameters(config_file)
+
+    BASE_DIR = Path(__file__).resolve().parent
+    DATA_DIR = BASE_DIR / inputs["data_folder"]
+
+    csv_config = inputs["csv_config"]
+    table_path = DATA_DIR / inputs.get("exchange_rate_table_file", "exchange_rate_table.csv")
+    table = load_rate_table(table_path, csv_config)
+
+    imported = 0
+    for import_path in sys.argv[2:]:
+        # Import files are plain CSVs unless they use the project's format
+        rates = read_rates_csv(import_path) or read_rates_csv(import_path, csv_config)
+        if rates is None:
+            print(f"Error reading '{import_path}'. It needs a date and one of {list(IMPORT_RATE_COLUMNS)} columns. Skipping...")
+            continue
+        imported += table.merge(*rates)
+
+    if imported:
+        save_rate_table(table, table_path, csv_config)
+        print(f"Imported {imported} rates into '{table_path}'.")
+
+    if len(table) == 0:
+        print("The rate table is empty. Run update.py or import a CSV of rates.")
+        return 1
+
+    first, last = ua.from_day_numbers(table.days[[0, -1]])
+    print(f"{len(table)} daily rates from {first.strftime('%Y-%m-%d')} to {last.strftime('%Y-%m-%d')}. "
+          f"Latest: {table.latest():.4f} EUR/USD.")
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+import heapq
+import os
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+import utils_ids as uid
+import utils_input as ui
+import utils_cards as uc
+import utils_storage as us
+import utils_history as uh
+import utils_rates as ur
+import utils_aggregates as uagg
+import utils_watchlist as uw
+import utils_df as ud
+import exchange_rates_module as xr
+
+
+# Refresh tiers, most valuable first: printings worth at least 'min_usd'
+# (their most expensive finish) are refreshed every 'hours'
+DEFAULT_TIERS = [
+    {"min_usd": 50, "hours": 1},
+    {"min_usd": 1, "hours": 24},
+    {"min_usd": 0, "hours": 168},
+]
+
+# Printings whose price moved more than this over the window go one tier up
+VOLATILITY_THRESHOLD = 0.10
+VOLATILITY_DAYS = 7
+
+# USD columns of the card table a printing's value is taken from
+VALUE_COLUMNS = [col for col in uc.RAW_PRICE_COLUMNS if col.startswith("usd")]
+
+# Most printings fetched per round, and seconds between saves of the results
+ROUND_SIZE = 75 * 40
+SAVE_SECONDS = 300
+
+SCHEDULE_COLUMNS = ["id", "interval", "due"]
+
+
+def card_values(cards):
+    # Value of every printing of the card table: its most expensive USD price, 0 if unpriced
+    columns = [cards[col].to_numpy(dtype=float) for col in VALUE_COLUMNS if col in cards.columns]
+    if not columns:
+        return np.zeros(len(cards))
+    with np.errstate(invalid="ignore"):
+        values = np.fmax.reduce(columns)
+    return np.nan_to_num(values)
+
+
+def volatility(history, ids, days=VOLATILITY_DAYS, now=None):
+    """
+    Largest relative change of any USD price of each printing in 'ids' over
+    the last 'days', from the price history. 0 for printings without a
+    record before the window.
+    """
+    ids = pd.Series(ids, dtype=object)
+    if len(history) == 0:
+        return np.zeros(len(ids))
+
+    now = pd.Timestamp(now if now is not None else pd.Timestamp.now())
+    columns = [uh.HISTORY_PRICE_COLUMNS.index(col) for col in VALUE_COLUMNS]
+
+    # As-of prices at both ends of the window, by printing code
+    ends = []
+    for date in [now - pd.Timedelta(days=days), now]:
+        prices = np.full((len(history.interner), len(columns)), np.nan)
+        rows = history.latest(date)
+        prices[history.column("card")[rows]] = history.prices(rows)[:, columns]
+        ends.append(prices)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = np.abs(ends[1] / ends[0] - 1)
+    change = np.nan_to_num(change, nan=0.0, posinf=0.0)
+    change = change.max(axis=1)
+
+    codes = history.interner.lookup(ids).astype(np.int64)
+    known = codes != uid.MISSING_CODE
+    result = np.zeros(len(ids))
+    result[known] = change[codes[known]]
+    return result
+
+
+def refresh_intervals(values, changes, tiers=None, threshold=VOLATILITY_THRESHOLD):
+    """
+    Refresh interval in seconds of every printing from its value and its
+    recent price change: the interval of its value tier, or of the next
+    more frequent tier if the change is above 'threshold'.
+    """
+    tiers = sorted(tiers or DEFAULT_TIERS, key=lambda tier: tier["min_usd"], reverse=True)
+    minimums = np.array([tier["min_usd"] for tier in tiers], dtype=float)
+    seconds = np.array([3600.0 * tier["hours"] for tier in tiers])
+
+    # Tiers are sorted by descending minimum: count the minimums above the value
+    tier = np.searchsorted(-minimums, -np.asarray(values, dtype=float), side="left")
+    tier = np.clip(tier, 0, len(tiers) - 1)
+    tier = np.where(np.asarray(changes) > threshold, np.maximum(tier - 1, 0), tier)
+    return seconds[tier]
+
+
+class RefreshSchedule:
+    """
+    When each printing is due for its next price refresh. A heap of
+    (due time, id) gives the next printings in O(log n); 'due' holds the
+    current due time of every id, so heap entries that were rescheduled
+    or dropped are skipped when they surface.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.due = {}
+        self.intervals = {}
+
+    def __len__(self):
+        return len(self.due)
+
+    def set(self, ids, intervals, due_times):
+        for card_id, interval, due in zip(ids, intervals, due_times):
+            self.due[card_id] = float(due)
+            self.intervals[card_id] = float(interval)
+            heapq.heappush(self.heap, (float(due), card_id))
+
+    def sync(self, ids, intervals, last_refresh):
+        """
+        Schedules the printings of the card table that aren't scheduled yet,
+        one interval after their last refresh (epoch seconds, NaN if never),
+        and drops the ones that left the table.
+        """
+        ids = list(ids)
+        known = set(ids)
+        for card_id in [card_id for card_id in self.due if card_id not in known]:
+            del self.due[card_id]
+            del self.intervals[card_id]
+
+        new = np.array([card_id not in self.due for card_id in ids], dtype=bool)
+        if not new.any():
+            return 0
+        due_times = np.nan_to_num(np.asarray(last_refresh, dtype=float)[new] + np.asarray(intervals)[new], nan=0.0)
+        self.set(np.array(ids, dtype=object)[new], np.asarray(intervals)[new], due_times)
+        return int(new.sum())
+
+    def reschedule(self, ids, intervals, now=None):
+        # Next refresh of just refreshed printings
+        now = now if now is not None else time.time()
+        self.set(ids, intervals, now + np.asarray(intervals, dtype=float))
+
+    def next_due(self):
+        # Earliest due time, None if nothing is scheduled
+        while self.heap and self.due.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now=None, limit=ROUND_SIZE):
+        # Ids due at 'now', earliest first. They stay scheduled until rescheduled
+        now = now if now is not None else time.time()
+        ids = []
+        while len(ids) < limit:
+            due = self.next_due()
+            if due is None or due > now:
+                break
+            ids.append(heapq.heappop(self.heap)[1])
+        return ids
+
+    def to_df(self):
+        ids = list(self.due)
+        return pd.DataFrame({
+            "id": pd.Series(ids, dtype=object),
+            "interval": np.array([self.intervals[card_id] for card_id in ids], dtype=float),
+            "due": np.array([self.due[card_id] for card_id in ids], dtype=float),
+        }, columns=SCHEDULE_COLUMNS)
+
+
+def schedule_printings(schedule, cards, history, tiers=None):
+    """
+    Schedules the printings of the card table that aren't scheduled yet.
+    Their intervals come from their value and price history, the ones of
+    scheduled printings are left as they are. Returns how many were added.
+    """
+    new = ~cards["id"].isin(list(schedule.due)).to_numpy(dtype=bool)
+    intervals = np.zeros(len(cards))
+    if new.any():
+        added = cards[new]
+        intervals[new] = refresh_intervals(card_values(added), volatility(history, added["id"]), tiers)
+
+    # New printings are due one interval after their last refresh
+    if "current date" in cards.columns:
+        last_refresh = pd.to_datetime(cards["current date"], errors="coerce")
+    else:
+        last_refresh = pd.Series(pd.NaT, index=cards.index)
+    last_refresh = (last_refresh - pd.Timestamp(0)).dt.total_seconds()
+    return schedule.sync(cards["id"], intervals, last_refresh.to_numpy(dtype=float))
+
+
+def save_schedule(schedule, file_path, csv_config=None):
+    us.atomic_write(file_path, us.serialize_csv(schedule.to_df(), csv_config))
+
+
+def load_schedule(file_path, csv_config=None):
+    # The schedule saved at 'file_path'. Empty if there is none yet
+    schedule = RefreshSchedule()
+    if not os.path.exists(file_path):
+        return schedule
+
+    csv_config = csv_config or {}
+    table = pd.read_csv(file_path, sep=csv_config.get("sep", ","), decimal=csv_config.get("decimal", "."),
+                        encoding=csv_config.get("encoding", "utf-8"), dtype={"id": object})
+    if not set(SCHEDULE_COLUMNS) <= set(table.columns):
+        print(f"Unexpected columns in '{file_path}'. Starting a new schedule.")
+        return schedule
+
+    table = table.dropna(subset=["id"])
+    schedule.due = dict(zip(table["id"], table["due"].astype(float)))
+    schedule.intervals = dict(zip(table["id"], table["interval"].astype(float)))
+    schedule.heap = [(due, card_id) for card_id, due in schedule.due.items()]
+    heapq.heapify(schedule.heap)
+    return schedule
+
+
+def main():
+    # Refreshes prices continuously: valuable and volatile printings often, bulk rarely
+    # Usage: python utils_schedule.py config.json
+    # Stop with Ctrl+C. Results are saved every SAVE_SECONDS and on exit
+
+    config_file = sys.argv[1]
+    inputs = ui.get_parameters(config_file)
+
+    BASE_DIR = Path(__file__).resolve().parent
+    DATA_DIR = BASE_DIR / inputs["data_folder"]
+
+    # Exchange rates of the process, from the file named in the config
+    xr.configure(BASE_DIR / inputs.get("exchange_rates_file", "exchange_rates.json"))
+
+    # LOAD CARD DATABASES
+    vault_columns = inputs["data_column_types"]
+    csv_config = inputs["csv_config"]
+    vault_path = DATA_DIR / inputs["vault_file"]
+    archive_path = DATA_DIR / inputs["archive_file"]
+    vault = ud.load_collection_to_df(vault_path, vault_columns, csv_config)
+    archive = ud.load_collection_to_df(archive_path, vault_columns, csv_config)
+
+    cards_path = DATA_DIR / inputs.get("cards_file", "cards.csv")
+    cards_columns = inputs.get("card_column_types", vault_columns)
+    cards = uc.merge_card_tables(uc.split_collection(vault)[0], uc.split_collection(archive)[0])
+    if os.path.exists(cards_path):
+        cards = uc.merge_card_tables(ud.load_collection_to_df(cards_path, cards_columns, csv_config), cards)
+
+    aggregates_path = DATA_DIR / inputs.get("aggregates_file", "aggregates.csv")
+    history = uh.PriceHistory(DATA_DIR / inputs.get("price_history_folder", "price_history"))
+    rates_path = DATA_DIR / inputs.get("exchange_rate_table_file", "exchange_rate_table.csv")
+    rates = ur.load_rate_table(rates_path, csv_config)
+
+    watchlist_path = DATA_DIR / inputs.get("watchlist_file", "watchlist.csv")
+    watchlist_state_path = DATA_DIR / inputs.get("watchlist_state_file", "watchlist_state.csv")
+    alerts_path = DATA_DIR / inputs.get("alerts_file", "alerts.csv")
+    watchlist = uw.load_watchlist(watchlist_path, watchlist_state_path, csv_config)
+    if watchlist is not None:
+        cards = uc.merge_card_tables(cards, pd.DataFrame({"id": watchlist.watched_ids()}, columns=uc.CARD_COLUMNS))
+
+    tiers = inputs.get("refresh_tiers", DEFAULT_TIERS)
+    schedule_path = DATA_DIR / inputs.get("refresh_schedule_file", "refresh_schedule.csv")
+    schedule = load_schedule(schedule_path, csv_config)
+
+    cards = cards[cards["id"].notna()].reset_index(drop=True)
+    added = schedule_printings(schedule, cards, history, tiers)
+    print(f"Scheduled {len(schedule)} printings ({added} new).")
+
+    def save():
+        nonlocal cards
+
+        # Other commands may have changed the collections since they were loaded,
+        # so they are read again right before the new prices are written into them
+        vault = ud.load_collection_to_df(vault_path, vault_columns, csv_config)
+        archive = ud.load_collection_to_df(archive_path, vault_columns, csv_config)
+        aggregates, _ = uagg.load_aggregates(aggregates_path, vault, csv_config)
+
+        # Printings registered since then join the card table and the schedule
+        collection_cards = uc.merge_card_tables(uc.split_collection(vault)[0], uc.split_collection(archive)[0])
+        cards = uc.merge_card_tables(cards, collection_cards[collection_cards["id"].notna()])
+        added = schedule_printings(schedule, cards, history, tiers)
+        if added:
+            print(f"Scheduled {added} new printings.")
+
+        ud.update_collection(vault, cards, aggregates, watchlist)
+        ud.update_collection(archive, cards)
+        ud.save_collection(vault, vault_path, csv_config, vault_columns)
+        ud.save_collection(archive, archive_path, csv_config, vault_columns)
+        ud.save_collection(cards, cards_path, csv_config, cards_columns)
+        uagg.save_aggregates(aggregates, aggregates_path, csv_config)
+        ur.save_rate_table(rates, rates_path, csv_config)
+        save_schedule(schedule, schedule_path, csv_config)
+        if watchlist is not None:
+            logged = uw.log_alerts(watchlist.take_alerts(), alerts_path, csv_config)
+            uw.save_state(watchlist, watchlist_state_path, csv_config)
+            if logged:
+                print(f"{logged} new price alerts logged to '{alerts_path}'.")
+        next_due = schedule.next_due()
+        if next_due is not None:
+            print(f"Saved. Next refresh at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(next_due))}.")
+
+    last_save, pending = time.time(), False
+    try:
+        while True:
+            now = time.time()
+            due_ids = schedule.pop_due(now)
+
+            if due_ids:
+                print(f"Refreshing {len(due_ids)} printings...")
+                ud.update_card_table(cards, rates, ids=due_ids)
+
+                refreshed = cards[cards["id"].isin(due_ids)]
+                history.append(refreshed)
+                intervals = refresh_intervals(card_values(refreshed), volatility(history, refreshed["id"]), tiers)
+                schedule.reschedule(refreshed["id"], intervals, now)
+                pending = True
+
+            # Results are written back in bulk, not after every round
+            next_due = schedule.next_due()
+            idle = next_due is None or next_due > time.time()
+            if pending and (time.time() - last_save >= SAVE_SECONDS or idle):
+                save()
+                last_save, pending = time.time(), False
+
+            if idle:
+                wait = SAVE_SECONDS if next_due is None else next_due - time.time()
+                time.sleep(max(1.0, min(wait, SAVE_SECONDS)))
+
+    except KeyboardInterrupt:
+        print("\nStopping the scheduler...")
+        if pending:
+            save()
+
+    return 0
+
+
+if __name__ == '__main__':
+    main()
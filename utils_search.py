@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import pandas as pd
+
+
+# Fuzzy matches need at least this share of trigrams in common (Jaccard)
+DEFAULT_MIN_SIMILARITY = 0.3
+
+
+def trigrams(text):
+    # Set of the 3-character substrings of a lowercase text
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """
+    Trigram index over text columns ('name' and optionally 'set_name',
+    'comment') of one or more collections, keyed by pid. Identical texts
+    (all copies of a card) are indexed once. Substring queries intersect the
+    postings of the query's trigrams, rarest first, and fuzzy queries rank
+    texts by trigram similarity, so typos still find cards.
+    """
+
+    def __init__(self, columns=("name",), id_col="pid"):
+        self.columns = tuple(columns)
+        self.id_col = id_col
+
+        # Per column: pid -> lowercase text, text -> pids, trigram -> texts
+        self._pid_texts = {col: {} for col in self.columns}
+        self._text_pids = {col: {} for col in self.columns}
+        self._postings = {col: {} for col in self.columns}
+
+    def __contains__(self, pid):
+        return any(pid in pid_texts for pid_texts in self._pid_texts.values())
+
+    def indexes(self, col):
+        return col in self._postings
+
+    def add(self, df):
+        # Indexes (or re-indexes) the rows of 'df'
+        if self.id_col not in df.columns:
+            return
+
+        pids = df[self.id_col].tolist()
+        for col in self.columns:
+            if col not in df.columns:
+                continue
+
+            pid_texts, text_pids, postings = self._pid_texts[col], self._text_pids[col], self._postings[col]
+            for pid, text in zip(pids, df[col].tolist()):
+                if not isinstance(pid, str):
+                    continue
+                if pid in pid_texts:
+                    self._remove_one(col, pid)
+                if not isinstance(text, str):
+                    continue
+
+                text = text.lower()
+                pid_texts[pid] = text
+                if text not in text_pids:
+                    text_pids[text] = set()
+                    for gram in trigrams(text):
+                        postings.setdefault(gram, set()).add(text)
+                text_pids[text].add(pid)
+
+    def remove(self, pids):
+        for col in self.columns:
+            for pid in pids:
+                self._remove_one(col, pid)
+
+    def _remove_one(self, col, pid):
+        text = self._pid_texts[col].pop(pid, None)
+        if text is None:
+            return
+
+        pids = self._text_pids[col][text]
+        pids.discard(pid)
+        if pids:
+            return
+
+        # Last card with this text
+        del self._text_pids[col][text]
+        postings = self._postings[col]
+        for gram in trigrams(text):
+            texts = postings.get(gram)
+            if texts is not None:
+                texts.discard(text)
+                if not texts:
+                    del postings[gram]
+
+    def search(self, search_term, col="name", fuzzy=False, min_similarity=DEFAULT_MIN_SIMILARITY):
+        """
+        Returns the pids whose 'col' text contains 'search_term' (case
+        insensitive, literal). With 'fuzzy', cards that only resemble the
+        term are appended, best match first.
+        """
+        query = str(search_term).lower()
+        text_pids = self._text_pids[col]
+        postings = self._postings[col]
+        query_grams = trigrams(query)
+
+        # Too short for trigrams: plain scan of the distinct texts
+        if not query_grams:
+            exact = [text for text in text_pids if query in text]
+        else:
+            # Intersect postings, rarest trigram first
+            grams = sorted(query_grams, key=lambda gram: len(postings.get(gram, ())))
+            candidates = set(postings.get(grams[0], ()))
+            for gram in grams[1:]:
+                if not candidates: break
+                candidates &= postings.get(gram, set())
+            exact = [text for text in candidates if query in text]
+
+        exact.sort(key=lambda text: (len(text), text))
+        ranked = exact
+
+        if fuzzy and query_grams:
+            # Common trigrams add little, so candidates come from the rarer ones
+            limit = max(1000, len(text_pids) // 20)
+            pool = [gram for gram in query_grams if len(postings.get(gram, ())) <= limit] or list(query_grams)
+
+            candidates = set().union(*(postings.get(gram, ()) for gram in pool)) - set(exact)
+            scored = []
+            for text in candidates:
+                shared = len(query_grams & trigrams(text))
+                similarity = shared / (len(query_grams) + max(len(text) - 2, 1) - shared)
+                if similarity >= min_similarity:
+                    scored.append((-similarity, text))
+
+            scored.sort()
+            ranked = exact + [text for _, text in scored]
+
+        return [pid for text in ranked for pid in sorted(text_pids[text])]
+
+
+def row_positions(df, id_col="pid"):
+    # pid -> row position lookup of 'df'. Built once and kept while 'df' is unchanged
+    return pd.Index(df[id_col])
+
+
+def rank_rows(df, ranked_pids, id_col="pid", positions=None):
+    """
+    Rows of 'df' whose pid is in 'ranked_pids', in ranking order.
+    'positions' (row_positions(df), kept by the caller) makes this cost the
+    number of hits; without it every call builds the lookup from 'df'.
+    """
+    if not ranked_pids:
+        return df.iloc[0:0]
+
+    if positions is None:
+        positions = row_positions(df, id_col)
+
+    if not positions.is_unique:
+        ranking = pd.Index(ranked_pids)
+        rows = df[df[id_col].isin(ranking)]
+        order = ranking.get_indexer(rows[id_col]).argsort(kind="stable")
+        return rows.iloc[order]
+
+    found = positions.get_indexer(ranked_pids)
+    return df.iloc[found[found >= 0]]
+
+
+if __name__ == '__main__':
+    print_string = "This module contains:\n \
+                    'trigrams'\n \
+                    'TrigramIndex'\n \
+                    'row_positions'\n \
+                    'rank_rows'"
+    print(print_string)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+import utils_input as ui
+import utils_cards as uc
+import utils_activity as ua
+import utils_df as ud
+import utils_aggregates as uagg
+
+
+# Copies that agree on these columns are interchangeable: one stack
+STACK_KEYS = ["id", "finish", "language", "condition", "location"]
+
+# Copies that agree on these columns share the prices of their printing
+PRICE_KEYS = ["id", "finish"]
+
+# Collections with more stacks than this share of their rows are refreshed per copy
+STACK_RATIO = 0.5
+
+
+def stack_codes(df, keys=STACK_KEYS):
+    # Stack number of every row, numbered in order of first appearance
+    keys = [col for col in keys if col in df.columns]
+    if not keys or df.empty:
+        return np.zeros(len(df), dtype=np.int64)
+    return df.groupby(keys, dropna=False, sort=False).ngroup().to_numpy(dtype=np.int64)
+
+
+def first_rows(codes):
+    # Row position of the first copy of every stack, by stack number
+    n_stacks = int(codes.max()) + 1 if len(codes) else 0
+    first = np.full(n_stacks, len(codes), dtype=np.int64)
+    np.minimum.at(first, codes, np.arange(len(codes)))
+    return first
+
+
+def collapse(df, codes=None, columns=None):
+    """
+    One row per stack of 'df': the STACK_KEYS, the columns every copy of a
+    printing shares (name, prices, ...), "quantity" and "pids" (space
+    separated, like the activity lists). 'columns' are kept too where all
+    copies of the stack agree and left empty where they don't. Stacks are
+    in the order of their first copy, so ranked hits stay ranked.
+    """
+    if codes is None:
+        codes = stack_codes(df)
+    first = first_rows(codes)
+
+    shared = [col for col in STACK_KEYS + uc.DERIVED_COLUMNS if col in df.columns]
+    stacks = df.iloc[first][shared].reset_index(drop=True)
+
+    for col in [col for col in (columns or []) if col in df.columns and col not in shared]:
+        values = df[col]
+        first_values = values.iloc[first].reset_index(drop=True)
+        broadcast = first_values.iloc[codes].to_numpy()
+        same = (values.to_numpy() == broadcast) | (values.isna().to_numpy(dtype=bool) & pd.isna(broadcast))
+        uniform = np.bincount(codes, weights=~same, minlength=len(first)) == 0
+        stacks[col] = first_values.where(uniform)
+
+    stacks["quantity"] = np.bincount(codes, minlength=len(first))
+    for currency in ["usd", "eur"]:
+        if f"price trend {currency}" in stacks.columns:
+            stacks[f"value {currency}"] = stacks["quantity"] * stacks[f"price trend {currency}"]
+
+    if "pid" in df.columns:
+        # Pids sorted by stack, then one slice per stack
+        order = np.argsort(codes, kind="stable")
+        pids = df["pid"].iloc[order].fillna("").tolist()
+        bounds = np.r_[0, np.cumsum(stacks["quantity"].to_numpy())].tolist()
+        stacks["pids"] = [" ".join(pids[start:end]).strip() for start, end in zip(bounds[:-1], bounds[1:])]
+
+    return stacks
+
+
+def take_pids(stack, count=1, taken=()):
+    # The first 'count' pids of a stack row that aren't in 'taken'
+    return [pid for pid in ua.split_pids(stack["pids"]) if pid not in taken][:count]
+
+
+def refresh_stacks(df, cards, codes=None):
+    """
+    uc.refresh_collection through the printings: the card table is joined
+    once per id and finish (PRICE_KEYS) and the new values are copied to
+    every copy of it, in place. 'codes' are stack_codes over PRICE_KEYS.
+    Collections with few duplicates are refreshed per copy instead.
+    """
+    columns = [col for col in uc.DERIVED_COLUMNS if col in df.columns]
+    if not columns or "id" not in df.columns:
+        return df
+
+    if codes is None:
+        codes = stack_codes(df, PRICE_KEYS)
+    first = first_rows(codes)
+    if len(first) > STACK_RATIO * len(df):
+        return uc.refresh_collection(df, cards)
+
+    key_cols = [col for col in PRICE_KEYS if col in df.columns]
+    heads = df.iloc[first][key_cols].reset_index(drop=True)
+    view = uc.join_collection(cards, heads, columns)
+    found = heads["id"].isin(cards["id"]).to_numpy(dtype=bool)
+
+    for col in columns:
+        new_values = view[col]
+        if col.startswith("price trend"):
+            # Missing prices of a known printing keep the old trend
+            keep = found & new_values.notna().to_numpy(dtype=bool)
+        else:
+            keep = found
+        copy_keep = keep[codes]
+        if copy_keep.any():
+            df.loc[copy_keep, col] = new_values.to_numpy()[codes[copy_keep]]
+
+    return df
+
+
+def main():
+    # Shows the vault as stacks, largest first, with their value
+    # Usage: python utils_stacks.py config.json [search term]
+
+    config_file = sys.argv[1]
+    inputs = ui.get_parameters(config_file)
+    search_term = " ".join(sys.argv[2:])
+
+    BASE_DIR = Path(__file__).resolve().parent
+    DATA_DIR = BASE_DIR / inputs["data_folder"]
+
+    vault = ud.load_collection_to_df(DATA_DIR / inputs["vault_file"], inputs["data_column_types"], inputs["csv_config"])
+    if search_term:
+        vault = ud.str_search_col(vault, search_term)
+
+    stacks = collapse(vault)
+    totals = uagg.CollectionAggregates(stacks).totals()
+    print(f"{totals['count']} cards in {len(stacks)} stacks, {totals['usd']:.2f} USD, {totals['eur']:.2f} EUR.")
+
+    columns = ["quantity", "location", "name", "set_name", "finish", "language", "condition", "value usd", "value eur", "pids"]
+    stacks = stacks.sort_values("quantity", ascending=False, kind="stable")
+    ud.display_dynamic_df(ud.peek_df(stacks, columns=columns), title="Stacks")
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import json
+import hashlib
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+import pandas as pd
+
+import utils_ids as uid
+import utils_input as ui
+
+
+# Every partitioned collection is a folder with a catalog of its partitions
+CATALOG_FILE = "catalog.json"
+
+# Keys of rows whose partition column is empty
+UNASSIGNED_KEY = "unassigned"
+UNDATED_KEY = "undated"
+
+
+# ========== PARTITION KEYS ==========
+
+def partition_keys(df, partition_by):
+    """
+    Returns the partition key of every row as a Series of strings.
+    'partition_by' is a column name, or '<date column> year' (e.g. 'out date year')
+    to partition by the year of a date column.
+    """
+    if partition_by.endswith(" year"):
+        date_col = partition_by[:-len(" year")]
+        if date_col not in df.columns:
+            return pd.Series(UNDATED_KEY, index=df.index, dtype=object)
+        years = pd.to_datetime(df[date_col], errors="coerce").dt.year
+        keys = years.astype("Int64").astype(str).astype(object)
+        return keys.where(years.notna(), UNDATED_KEY)
+
+    if partition_by not in df.columns:
+        return pd.Series(UNASSIGNED_KEY, index=df.index, dtype=object)
+
+    keys = df[partition_by].astype(object)
+    blank = keys.isna() | (keys.astype(str).str.strip() == "")
+    return keys.where(~blank, UNASSIGNED_KEY).astype(str)
+
+
+def partition_file_name(key):
+    # File-system safe name for a partition key
+    slug = re.sub(r"[^0-9A-Za-z._-]+", "_", str(key).strip()).strip("_")
+    return f"{slug or UNASSIGNED_KEY}.csv"
+
+
+def unique_file_name(key, entries):
+    # Different keys can share a slug ('box 1' and 'box_1')
+    used = {entry["file"] for entry in entries.values()}
+    file_name = partition_file_name(key)
+    stem, i = file_name[:-len(".csv")], 2
+    while file_name in used:
+        file_name = f"{stem}_{i}.csv"
+        i += 1
+    return file_name
+
+
+# ========== CATALOG ==========
+
+def is_partitioned(path):
+    return Path(path).is_dir()
+
+
+def load_catalog(dir_path):
+    catalog_path = Path(dir_path) / CATALOG_FILE
+    if not catalog_path.exists():
+        return {"partition_by": None, "partitions": {}}
+    with open(catalog_path, "r") as catalog_file:
+        return json.load(catalog_file)
+
+
+def save_catalog(dir_path, catalog):
+    catalog_path = Path(dir_path) / CATALOG_FILE
+    data = json.dumps(catalog, indent=4, sort_keys=True).encode("utf-8")
+    atomic_write(catalog_path, data)
+
+
+def list_partitions(dir_path):
+    # Partition keys with their row counts, without reading any data
+    catalog = load_catalog(dir_path)
+    return {key: entry.get("rows", 0) for key, entry in catalog["partitions"].items()}
+
+
+def catalog_pid_frame(dir_path, prefix="p"):
+    """
+    Returns a one column ('pid') dataframe with the largest pid of every
+    partition. Lets pid generation account for partitions that weren't loaded.
+    """
+    if not is_partitioned(dir_path):
+        return pd.DataFrame({"pid": pd.Series(dtype=object)})
+
+    catalog = load_catalog(dir_path)
+    max_pids = [entry.get("max_pid") for entry in catalog["partitions"].values()]
+    return pd.DataFrame({"pid": pd.Series([p for p in max_pids if p], dtype=object)})
+
+
+# ========== PARSING ==========
+
+# Parses a collection csv. "source" is a file path or the raw file bytes
+def read_collection_csv(source, header_type_dict, config=None):
+
+    # Bytes are read twice (header and body), so each read gets its own buffer
+    def handle():
+        return BytesIO(source) if isinstance(source, bytes) else source
+
+    # Read only the header row to get the headers
+    current_sep = config["sep"] if config else ","
+    current_encoding = config.get("encoding", "utf-8") if config else "utf-8"
+    headers = pd.read_csv(handle(), nrows=0, sep=current_sep, encoding=current_encoding).columns
+    
+    # Create a mapping of header and dtype, using pre-exiting header-dtype dictionary
+    header_dtypes = {k: v for k, v in header_type_dict.items() if k in headers}
+    
+    # define df dtypes, exclude datetimes
+    df_dtypes = {k: v for k, v in header_dtypes.items() if v != "datetime64[ns]"}
+    
+    # separate datetime headers here
+    df_date_cols = [k for k, v in header_dtypes.items() if v == "datetime64[ns]"]
+
+    # read df from csv file
+    if config:
+        df = pd.read_csv(
+            handle(),
+            sep=config["sep"], 
+            decimal=config["decimal"],
+            dtype=df_dtypes,
+            parse_dates=df_date_cols,
+            dayfirst=True,
+            date_format=config["date_format"],
+            encoding=config.get("encoding", "utf-8"))
+
+    else:
+        df = pd.read_csv(handle(),
+                            dtype=df_dtypes,
+                            parse_dates=df_date_cols)
+
+    # 3. Safety Pass: Force any missed date columns to datetime
+    for col in df_date_cols:
+        if col in df.columns and df[col].dtype == 'object':
+            df[col] = pd.to_datetime(
+                df[col],
+                format= config["date_format"] if config else None,
+                dayfirst=True,
+                errors='coerce'
+                )
+
+    # Handle finish.
+    if "finish" in df:
+        df["finish"] = df["finish"].fillna("non-foil")
+        valid_finishes = ['non-foil','foil', 'etched']
+        df.loc[~df['finish'].isin(valid_finishes), 'finish'] = 'non-foil'
+
+
+    # Delete bloat columns and columns that are not specified in the config file
+    cleanup_dataframe(df, header_type_dict)
+
+    return df
+
+
+# This function deletes columns that shouldn't be in the data, but somehow got there
+def cleanup_dataframe(df, header_source):
+
+    # If it's a dictionary, we want the keys. If it's a list, we use it as is.
+    if isinstance(header_source, dict):
+        allowed_columns = set(header_source.keys())
+    elif isinstance(header_source, list):
+        allowed_columns = set(header_source)
+    else:
+        print("Error: header_source must be a list or dict")
+        return
+    
+    # 2. Identify the "junk" columns
+    bloat_columns = [col for col in df.columns if col not in header_source]
+    
+    # errors='ignore' ensures it won't crash if the column is already gone
+    df.drop(columns=bloat_columns, errors='ignore', inplace=True)
+
+
+# ========== SERIALIZATION ==========
+
+def serialize_csv(df, csv_config=None):
+    # The exact bytes 'df.to_csv' would write, so hashes match the files on disk
+    csv_config = dict(csv_config or {})
+    encoding = csv_config.pop("encoding", "utf-8")
+    text = df.to_csv(index=False, **csv_config)
+    return text.encode(encoding)
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def atomic_write(path, data):
+    """
+    Writes 'data' to a temporary file next to 'path' and renames it over
+    'path'. An interrupted save leaves the old file intact.
+    """
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# ========== CONTENT HASHES AND PARSE CACHE ==========
+
+# Metadata and parsed copies of the data files live in a '.cache' folder
+CACHE_FOLDER = ".cache"
+
+
+def cache_paths(file_path):
+    file_path = Path(file_path)
+    cache_dir = file_path.parent / CACHE_FOLDER
+    return cache_dir / f"{file_path.name}.json", cache_dir / f"{file_path.name}.pkl"
+
+
+def load_file_meta(file_path):
+    meta_path, _ = cache_paths(file_path)
+    if not meta_path.exists():
+        return {}
+    try:
+        with open(meta_path, "r") as meta_file:
+            return json.load(meta_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_file_meta(file_path, meta):
+    meta_path, _ = cache_paths(file_path)
+    meta_path.parent.mkdir(exist_ok=True)
+    atomic_write(meta_path, json.dumps(meta, indent=4).encode("utf-8"))
+
+
+def schema_hash(header_type_dict, config):
+    # Cached parses are only valid for the same column types and csv settings
+    schema = json.dumps([header_type_dict, config], sort_keys=True, default=str)
+    return content_hash(schema.encode("utf-8"))
+
+
+def store_bytes(file_path, data):
+    """
+    Atomically writes a data file and records its content hash, so the next
+    load can tell whether the file was edited outside the registry.
+    """
+    atomic_write(file_path, data)
+
+    # The old parse no longer matches the file
+    _, cache_path = cache_paths(file_path)
+    if cache_path.exists():
+        os.remove(cache_path)
+
+    save_file_meta(file_path, {"hash": content_hash(data)})
+
+
+def load_cached(file_path, header_type_dict, config=None):
+    """
+    Loads a collection csv, reusing the cached parse if the file's content
+    hash is unchanged. Warns if the file was edited since the registry last
+    wrote or read it.
+    """
+    with open(file_path, "rb") as in_file:
+        data = in_file.read()
+
+    digest = content_hash(data)
+    schema = schema_hash(header_type_dict, config)
+    meta = load_file_meta(file_path)
+    _, cache_path = cache_paths(file_path)
+
+    if meta.get("hash") == digest and meta.get("schema") == schema and cache_path.exists():
+        try:
+            return pd.read_pickle(cache_path)
+        except Exception:
+            pass
+
+    if meta.get("hash") not in (None, digest):
+        print(f"'{file_path}' was modified outside the registry since it was last saved.")
+
+    df = read_collection_csv(data, header_type_dict, config)
+
+    # Cache the parse for the next load of the untouched file
+    try:
+        cache_path.parent.mkdir(exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+        os.close(fd)
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, cache_path)
+        save_file_meta(file_path, {"hash": digest, "schema": schema})
+    except OSError as e:
+        print(f"Could not cache '{file_path}': {e}")
+
+    return df
+
+
+# ========== CHANGE TRACKING ==========
+
+# Baselines of loaded collections, keyed by their resolved path
+_baselines = {}
+
+
+def _row_keys(df):
+    # Rows are matched by pid (or event id) when those are unique, else by position
+    for col in ["pid", "id"]:
+        if col in df.columns:
+            keys = df[col].astype(object)
+            if keys.notna().all() and keys.is_unique:
+                return pd.Index(keys)
+    return pd.Index([f"#{i}" for i in range(len(df))])
+
+
+def _column_digests(df):
+    digests = {}
+    for col in df.columns:
+        hashed = pd.util.hash_pandas_object(df[col], index=False).to_numpy()
+        digests[col] = content_hash(hashed.tobytes())
+    return digests
+
+
+def _snapshot(df):
+    keys = _row_keys(df)
+    rows = pd.util.hash_pandas_object(df, index=False).to_numpy() if len(df.columns) else \
+        pd.Series(0, index=range(len(df)), dtype="uint64").to_numpy()
+    return {
+        "rows": pd.Series(rows, index=keys),
+        "columns": _column_digests(df),
+    }
+
+
+def track_changes(df, file_path):
+    # Records the current state of 'df' as the baseline for 'file_path'
+    _baselines[str(Path(file_path).resolve())] = _snapshot(df)
+
+
+def collection_changes(df, file_path):
+    """
+    Compares 'df' with its baseline from the last load or save.
+    Returns a dict with the added, removed and modified row keys and the
+    changed columns, or None if the collection was never loaded.
+    """
+    baseline = _baselines.get(str(Path(file_path).resolve()))
+    if baseline is None:
+        return None
+
+    current = _snapshot(df)
+    old_rows, new_rows = baseline["rows"], current["rows"]
+
+    added = new_rows.index.difference(old_rows.index)
+    removed = old_rows.index.difference(new_rows.index)
+    common = new_rows.index.intersection(old_rows.index)
+    modified = common[new_rows.loc[common].to_numpy() != old_rows.loc[common].to_numpy()]
+
+    old_cols, new_cols = baseline["columns"], current["columns"]
+    columns = [col for col in new_cols if old_cols.get(col) != new_cols[col]]
+    columns += [col for col in old_cols if col not in new_cols]
+
+    return {
+        "added": list(added),
+        "removed": list(removed),
+        "modified": list(modified),
+        "columns": columns,
+        # Same rows in a new order still changes the file
+        "reordered": not new_rows.index.equals(old_rows.index),
+    }
+
+
+def has_changes(df, file_path):
+    # Collections without a baseline are treated as changed
+    changes = collection_changes(df, file_path)
+    if changes is None:
+        return True
+    return bool(changes["added"] or changes["removed"] or changes["modified"]
+                or changes["columns"] or changes["reordered"])
+
+
+# ========== LOAD / SAVE ==========
+
+# What each partitioned collection of this process was loaded from, keyed by
+# its resolved path: the loaded partition keys, and per partition that wasn't
+# loaded the pids saves have appended to it
+_partition_state = {}
+
+
+def _partition_state_of(dir_path):
+    return _partition_state.setdefault(str(Path(dir_path).resolve()), {"loaded": set(), "appended": {}})
+
+
+def load_partitioned(dir_path, header_type_dict, config=None, partitions=None):
+    """
+    Loads the requested partitions (all of them by default) of a partitioned
+    collection into one dataframe. The loaded keys are remembered for the
+    path, so the collection can be saved back safely.
+    """
+    dir_path = Path(dir_path)
+    catalog = load_catalog(dir_path)
+    available = catalog["partitions"]
+
+    if partitions is None:
+        keys = list(available)
+    else:
+        keys = [str(key) for key in partitions]
+        unknown = [key for key in keys if key not in available]
+        if unknown:
+            print(f"Partitions not found in '{dir_path}': {', '.join(unknown)}")
+        keys = [key for key in keys if key in available]
+
+    parts = []
+    for key in keys:
+        file_path = dir_path / available[key]["file"]
+        parts.append(load_cached(file_path, header_type_dict, config))
+
+    if parts:
+        df = pd.concat(parts, ignore_index=True, sort=False)
+    else:
+        df = pd.DataFrame(columns=header_type_dict.keys()).astype(header_type_dict)
+        cleanup_dataframe(df, header_type_dict)
+
+    _partition_state[str(dir_path.resolve())] = {"loaded": set(keys), "appended": {}}
+    return df
+
+
+def save_partitioned(df, dir_path, csv_config=None, partition_by=None, loaded=None,
+                     header_type_dict=None, verbose=True):
+    """
+    Saves 'df' as a partitioned collection, rewriting only the partitions
+    whose content changed.
+
+    'loaded' is the list of partitions 'df' was loaded from. None uses the
+    ones load_partitioned recorded for this path (none if it wasn't loaded
+    in this process). Only loaded partitions that are now empty are
+    deleted. Rows that belong to a partition that wasn't loaded are added
+    to its rows on disk, which needs 'header_type_dict'; rows appended by
+    an earlier save of the same path are replaced, not added again.
+    Returns the list of rewritten partition keys.
+    """
+    dir_path = Path(dir_path)
+    dir_path.mkdir(parents=True, exist_ok=True)
+
+    catalog = load_catalog(dir_path)
+    partition_by = partition_by or catalog.get("partition_by") or "location"
+    catalog["partition_by"] = partition_by
+    entries = catalog["partitions"]
+
+    state = _partition_state_of(dir_path)
+    loaded = state["loaded"] if loaded is None else set(map(str, loaded))
+    appended = state["appended"]
+
+    keys = partition_keys(df, partition_by)
+    written = []
+
+    # Partitions with rows, and unloaded ones this frame appended to before
+    parts = {str(key): part for key, part in df.groupby(keys, sort=True)}
+    for key in appended:
+        if key not in parts and key not in loaded:
+            parts[key] = df.iloc[0:0]
+
+    for key in sorted(parts):
+        part = parts[key]
+        created = key not in entries
+
+        # Rows added to a partition that only exists on disk
+        if key in entries and key not in loaded:
+            if header_type_dict is None:
+                print(f"Can't add rows to partition '{key}' of '{dir_path}' without its column types. Skipping...")
+                continue
+            on_disk = load_cached(dir_path / entries[key]["file"], header_type_dict, csv_config)
+            if "pid" in part.columns and "pid" in on_disk.columns:
+                ours = appended.get(key, set()) | set(part["pid"].dropna())
+                on_disk = on_disk[~on_disk["pid"].isin(ours)]
+                appended[key] = set(part["pid"].dropna())
+            part = pd.concat([on_disk, part], ignore_index=True, sort=False)
+
+        if part.empty and created:
+            continue
+
+        data = serialize_csv(part, csv_config)
+        digest = content_hash(data)
+
+        entry = entries.get(key) or {"file": unique_file_name(key, entries)}
+        file_path = dir_path / entry["file"]
+
+        if entry.get("hash") == digest and file_path.exists():
+            continue
+
+        store_bytes(file_path, data)
+        written.append(key)
+
+        pid_codes = uid.encode_prefixed(part["pid"], "p") if "pid" in part.columns else []
+        max_code = int(pid_codes.max()) if len(pid_codes) else uid.MISSING_CODE
+
+        entry.update({"rows": len(part), "hash": digest, "max_pid": uid.int_to_pid(max_code)})
+        entries[key] = entry
+
+        # Partitions created by this save hold nothing but rows of 'df'
+        if created:
+            loaded.add(key)
+
+    # Loaded partitions whose rows all left
+    present = set(keys.unique())
+    for key in sorted(loaded - present):
+        if key not in entries:
+            continue
+        file_path = dir_path / entries[key]["file"]
+        for path in (file_path, *cache_paths(file_path)):
+            if path.exists():
+                os.remove(path)
+        del entries[key]
+        written.append(key)
+
+    save_catalog(dir_path, catalog)
+    state["loaded"] = loaded & set(entries)
+
+    if verbose and written:
+        print(f"Rewrote {len(written)} of {len(entries)} partitions in '{dir_path}'.")
+
+    return written
+
+
+def partition_collection(file_path, dir_path, header_type_dict, csv_config, partition_by):
+    # Converts a single csv file into a partitioned collection folder
+    df = load_cached(file_path, header_type_dict, csv_config)
+    save_partitioned(df, dir_path, csv_config, partition_by=partition_by)
+    return df
+
+
+def main():
+    # Converts the vault and archive of a config into partitioned folders
+    # Usage: python utils_storage.py config.json
+
+    config_file = sys.argv[1]
+    inputs = ui.get_parameters(config_file)
+
+    BASE_DIR = Path(__file__).resolve().parent
+    DATA_DIR = BASE_DIR / inputs["data_folder"]
+
+    columns = inputs["data_column_types"]
+    csv_config = inputs["csv_config"]
+
+    layouts = [
+        ("vault_file", inputs.get("vault_partition_by", "location")),
+        ("archive_file", inputs.get("archive_partition_by", "out date year")),
+    ]
+
+    for file_key, partition_by in layouts:
+        file_name = inputs[file_key]
+        file_path = DATA_DIR / file_name
+        if not file_path.is_file():
+            print(f"'{file_path}' is not a csv file. Skipping...")
+            continue
+
+        dir_path = file_path.with_suffix("")
+        partition_collection(file_path, dir_path, columns, csv_config, partition_by)
+        print(f"'{file_name}' partitioned by '{partition_by}' into '{dir_path}'.")
+        print(f"Set \"{file_key}\" to \"{dir_path.name}\" in '{config_file}' to use it.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+import utils_ids as uid
+import utils_input as ui
+import utils_cards as uc
+import utils_activity as ua
+import utils_history as uh
+import utils_df as ud
+
+
+# Finish -> position of its price among the raw columns of a currency
+FINISH_ORDER = list(uc.FINISH_SUFFIXES)
+
+CURRENCIES = ["usd", "eur"]
+
+
+def holding_periods(vault, archive, links=None):
+    """
+    One row per physical card: printing id, finish and the days it entered
+    and left the collection. The dates come from 'in date'/'out date', or
+    from the activity log if 'links' (ua.EventLinks) is given. Unknown
+    entry days count as held from the start, unknown exits as still held.
+    """
+    cols = ["pid", "id", "finish"]
+    cards = pd.concat([df[[col for col in cols + ["in date", "out date"] if col in df.columns]]
+                       for df in [vault, archive]], ignore_index=True, sort=False)
+
+    if links is not None:
+        periods = links.holding_periods()
+        periods = periods.merge(cards[[col for col in cols if col in cards.columns]].drop_duplicates(subset=["pid"]),
+                                on="pid", how="inner")
+        in_days = ua.to_day_numbers(periods["in date"])
+        out_days = ua.to_day_numbers(periods["out date"])
+    else:
+        periods = cards
+        in_days = ua.to_day_numbers(periods["in date"]) if "in date" in periods.columns else np.full(len(periods), ua.NO_DAY)
+        out_days = ua.to_day_numbers(periods["out date"]) if "out date" in periods.columns else np.full(len(periods), ua.NO_DAY)
+
+    finish = periods["finish"] if "finish" in periods.columns else pd.Series("non-foil", index=periods.index)
+    finish_codes = pd.Categorical(finish, categories=FINISH_ORDER).codes.astype(np.int64)
+
+    return pd.DataFrame({
+        "id": periods["id"].to_numpy(dtype=object),
+        "finish": np.where(finish_codes < 0, 0, finish_codes),
+        "in day": in_days,
+        "out day": out_days,
+    })
+
+
+def step_values(keys, days, values, query_keys, query_days):
+    """
+    As-of join on sorted arrays: for every (query key, query day) the value
+    of the last (key, day) record with the same key on or before that day.
+    'keys', 'days' must be sorted together. NaN where there is none.
+    """
+    if len(keys) == 0:
+        return np.full(len(query_keys), np.nan)
+
+    # Composite (key, day) numbers keep both orders in one searchsorted
+    offset = min(days.min(), query_days.min()) if len(query_days) else days.min()
+    span = int(max(days.max(), query_days.max() if len(query_days) else days.max()) - offset + 1)
+    composite = keys * span + (days - offset)
+    query = query_keys * span + (query_days - offset)
+
+    found = np.searchsorted(composite, query, side="right") - 1
+    safe = np.maximum(found, 0)
+    valid = (found >= 0) & (keys[safe] == query_keys)
+    return np.where(valid, values[safe], np.nan)
+
+
+class Valuation:
+    """
+    Values a collection on any day: the cards held that day (from their
+    holding periods) times each printing's latest price on or before it
+    (from the price history). Daily series come from one pass over the
+    change points of holdings and prices, not one join per day.
+    """
+
+    def __init__(self, periods, history):
+        self.history = history
+        self.periods = periods
+
+        # A price key is (printing code, finish)
+        codes = history.interner.lookup(periods["id"]).astype(np.int64)
+        self.known = codes != uid.MISSING_CODE
+        self.card_keys = codes * len(FINISH_ORDER) + periods["finish"].to_numpy(dtype=np.int64)
+
+        # Price records per currency, sorted by key and day; later records of a day win
+        card_codes = history.column("card").astype(np.int64)
+        days = history.column("day").astype(np.int64)
+        rows = np.arange(len(history))
+        self.prices = {}
+        for currency in CURRENCIES:
+            keys = np.concatenate([card_codes * len(FINISH_ORDER) + f for f in range(len(FINISH_ORDER))])
+            key_days = np.tile(days, len(FINISH_ORDER))
+            values = np.concatenate([history.column(f"{currency}_{uc.FINISH_SUFFIXES[finish]}") for finish in FINISH_ORDER])
+            order = np.lexsort((np.tile(rows, len(FINISH_ORDER)), key_days, keys))
+            self.prices[currency] = (keys[order], key_days[order], np.asarray(values)[order])
+
+    def holdings_at(self, date):
+        """
+        The cards held on 'date' with their as-of prices. Returns a
+        DataFrame aligned with a subset of the periods.
+        """
+        day = uh.to_day(date)
+        in_days, out_days = self.periods["in day"].to_numpy(), self.periods["out day"].to_numpy()
+        held = (in_days <= day) & ((out_days == ua.NO_DAY) | (out_days > day))
+
+        holdings = self.periods[held].copy()
+        query_days = np.full(int(held.sum()), day, dtype=np.int64)
+        for currency in CURRENCIES:
+            keys, days, values = self.prices[currency]
+            holdings[f"price {currency}"] = step_values(keys, days, values, self.card_keys[held], query_days)
+        return holdings
+
+    def value_at(self, date):
+        # Card count and total value on one day
+        holdings = self.holdings_at(date)
+        return {"card count": len(holdings), **{f"price {currency}": float(holdings[f"price {currency}"].sum())
+                                                 for currency in CURRENCIES}}
+
+    def daily(self, start, end):
+        """
+        Card count and total value for every day from 'start' to 'end'.
+        Returns a DataFrame with date, card count, price usd and price eur.
+        """
+        start_day, end_day = uh.to_day(start), uh.to_day(end)
+        n_days = end_day - start_day + 1
+
+        in_days = self.periods["in day"].to_numpy()
+        out_days = self.periods["out day"].to_numpy()
+
+        # Unknown entries count from the start, unknown exits never happen
+        in_days = np.where(in_days == ua.NO_DAY, start_day, in_days)
+        out_days = np.where(out_days == ua.NO_DAY, end_day + 1, out_days)
+        alive = in_days < out_days
+
+        # ========== CARD COUNT ==========
+        count_delta = np.zeros(n_days + 1)
+        np.add.at(count_delta, np.clip(in_days[alive], start_day, end_day + 1) - start_day, 1)
+        np.add.at(count_delta, np.clip(out_days[alive], start_day, end_day + 1) - start_day, -1)
+        series = pd.DataFrame({
+            "date": pd.date_range(pd.Timestamp(start).normalize(), periods=n_days, freq="D"),
+            "card count": np.cumsum(count_delta)[:n_days].astype(np.int64),
+        })
+
+        # ========== VALUE ==========
+        # Holdings per key change by +1/-1 on entry/exit days
+        known = alive & self.known
+        event_keys = np.concatenate([self.card_keys[known], self.card_keys[known]])
+        event_days = np.concatenate([np.maximum(in_days[known], start_day), out_days[known]])
+        event_deltas = np.concatenate([np.ones(known.sum()), -np.ones(known.sum())])
+
+        order = np.lexsort((event_days, event_keys))
+        event_keys, event_days, event_deltas = event_keys[order], event_days[order], event_deltas[order]
+
+        # Copies held per key after each event (running count within a key)
+        running = np.cumsum(event_deltas)
+        starts = np.flatnonzero(np.append(True, event_keys[1:] != event_keys[:-1])) if len(running) else np.empty(0, dtype=np.int64)
+        offsets = (running - event_deltas)[starts]
+        held_counts = running - np.repeat(offsets, np.diff(np.append(starts, len(running))))
+
+        for currency in CURRENCIES:
+            price_keys, price_days, price_values = self.prices[currency]
+
+            # Change points: holding events and price records of held keys
+            relevant = np.isin(price_keys, event_keys)
+            point_keys = np.concatenate([event_keys, price_keys[relevant]])
+            point_days = np.concatenate([event_days, np.maximum(price_days[relevant], start_day)])
+            # Unique (key, day) pairs, sorted, as one integer each
+            span = int(max(point_days.max(), end_day) - start_day + 1) if len(point_days) else 1
+            points = np.sort(point_keys * span + (point_days - start_day))
+            points = points[np.append(True, points[1:] != points[:-1])]
+            point_keys, point_days = points // span, points % span + start_day
+
+            # Holdings and price in force from each change point on
+            counts = np.nan_to_num(step_values(event_keys, event_days, held_counts, point_keys, point_days))
+            prices = np.nan_to_num(step_values(price_keys, price_days, price_values, point_keys, point_days))
+            values = counts * prices
+
+            # Value changes at each point, relative to the previous point of the key
+            first = np.append(True, point_keys[1:] != point_keys[:-1])
+            deltas = values - np.where(first, 0, np.roll(values, 1))
+
+            in_range = point_days <= end_day
+            daily_delta = np.bincount(point_days[in_range] - start_day, weights=deltas[in_range], minlength=n_days)
+            series[f"price {currency}"] = np.round(np.cumsum(daily_delta)[:n_days], 2)
+
+        return series
+
+
+def to_timeline(series, timeline=None, rebuild=False):
+    """
+    Turns a daily valuation into timeline rows. With 'rebuild' the timeline
+    is replaced, otherwise only days missing from 'timeline' are added
+    (backfill). Price changes are recomputed over the result in one pass.
+    """
+    rows = series.copy()
+    rows["comment"] = np.nan
+
+    if timeline is not None and not timeline.empty and not rebuild:
+        existing = pd.to_datetime(timeline["date"]).dt.normalize()
+        rows = pd.concat([timeline, rows[~rows["date"].isin(existing)]], ignore_index=True, sort=False)
+
+    rows = rows.sort_values("date", kind="stable").reset_index(drop=True)
+    for currency in CURRENCIES:
+        previous = rows[f"price {currency}"].shift(1)
+        change = (100 * (rows[f"price {currency}"] / previous.where(previous > 0) - 1)).round(2)
+        rows[f"price change % {currency}"] = change.fillna(0.0)
+
+    columns = ["date", "card count", "price usd", "price eur", "price change % usd", "price change % eur", "comment"]
+    return rows[[col for col in columns if col in rows.columns] + [col for col in rows.columns if col not in columns]]
+
+
+def main():
+    # Values the collection on a day, or backfills / rebuilds the timeline
+    # Usage: python utils_valuation.py config.json [date]
+    #        python utils_valuation.py config.json backfill|rebuild [start date]
+
+    config_file = sys.argv[1]
+    inputs = ui.get_parameters(config_file)
+
+    BASE_DIR = Path(__file__).resolve().parent
+    DATA_DIR = BASE_DIR / inputs["data_folder"]
+
+    csv_config = inputs["csv_config"]
+    vault_columns = inputs["data_column_types"]
+
+    vault = ud.load_collection_to_df(DATA_DIR / inputs["vault_file"], vault_columns, csv_config)
+    archive = ud.load_collection_to_df(DATA_DIR / inputs["archive_file"], vault_columns, csv_config)
+    history = uh.PriceHistory(DATA_DIR / inputs.get("price_history_folder", "price_history"))
+
+    if len(history) == 0:
+        print("The price history is empty. Run update.py first.")
+        return 1
+
+    valuation = Valuation(holding_periods(vault, archive), history)
+    mode = sys.argv[2] if len(sys.argv) > 2 else None
+    today = pd.Timestamp.now().normalize()
+
+    if mode in ["backfill", "rebuild"]:
+        first_day = uh.from_days([history.column("day").min()])[0]
+        start = pd.Timestamp(sys.argv[3]) if len(sys.argv) > 3 else first_day
+        series = valuation.daily(start, today)
+
+        timeline_path = DATA_DIR / inputs["timeline_file"]
+        timeline_columns = inputs["timeline_column_types"]
+        timeline = ud.load_collection_to_df(timeline_path, timeline_columns, csv_config) if os.path.exists(timeline_path) else None
+
+        timeline = to_timeline(series, timeline, rebuild=(mode == "rebuild"))
+        if ud.save_collection(timeline, timeline_path, csv_config):
+            print(f"Timeline saved to '{timeline_path}' ({len(timeline)} days).")
+        return 0
+
+    date = pd.Timestamp(mode).normalize() if mode else today
+    holdings = valuation.holdings_at(date)
+    value = valuation.value_at(date)
+    print(f"{date.strftime('%Y-%m-%d')}: {value['card count']} cards, "
+          f"{value['price usd']:.2f} usd, {value['price eur']:.2f} eur.")
+
+    # Most valuable holdings of the day
+    holdings = holdings.sort_values("price usd", ascending=False).head(20)
+    holdings["finish"] = np.array(FINISH_ORDER, dtype=object)[holdings["finish"].to_numpy()]
+    ud.display_dynamic_df(holdings[["id", "finish", "price usd", "price eur"]], title="Most valuable cards")
+    return 0
+
+
+if __name__ == '__main__':
+    main()
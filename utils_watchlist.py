@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+import utils_input as ui
+import utils_storage as us
+import utils_df as ud
+
+
+# Columns of the rules file. One rule per row:
+#   rule       unique name of the rule
+#   target     "vault" (physical copies) or "cards" (printings of the card table)
+#   key        column the rule is matched on ("pid", "id", "name", "set_name", ...) or "*" for every row
+#   value      value of the key column (ignored for "*")
+#   metric     a price column or one of DERIVED_METRICS
+#   op         one of OPERATORS
+#   threshold  number the metric is compared with
+#   comment    free text, copied to the alerts
+RULE_COLUMNS = ["rule", "target", "key", "value", "metric", "op", "threshold", "comment"]
+
+TARGETS = {"vault": "pid", "cards": "id"}
+
+ALL_KEY = "*"
+
+OPERATORS = {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal}
+
+
+def percent_change(df, end_col, start_col):
+    if end_col not in df.columns or start_col not in df.columns:
+        return None
+    start = df[start_col].to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(start > 0, 100 * (df[end_col].to_numpy(dtype=float) / start - 1), np.nan)
+
+
+def difference(df, end_col, start_col):
+    if end_col not in df.columns or start_col not in df.columns:
+        return None
+    return df[end_col].to_numpy(dtype=float) - df[start_col].to_numpy(dtype=float)
+
+
+# Metrics computed from several columns
+DERIVED_METRICS = {
+    "gain % eur": lambda df: percent_change(df, "price trend eur", "in trend eur"),
+    "gain % usd": lambda df: percent_change(df, "price trend usd", "in trend usd"),
+    "profit eur": lambda df: difference(df, "price trend eur", "in price eur"),
+}
+
+# Columns of the alerts log
+ALERT_COLUMNS = ["date", "rule", "target", "subject", "name", "metric", "op", "threshold", "value", "comment"]
+
+
+def metric_values(df, metric):
+    # Float array of 'metric' over the rows of 'df'. None if it can't be computed
+    if metric in DERIVED_METRICS:
+        return DERIVED_METRICS[metric](df)
+    if metric in df.columns:
+        return pd.to_numeric(df[metric], errors="coerce").to_numpy(dtype=float)
+    return None
+
+
+class Watchlist:
+    """
+    Price alert rules, compiled once into groups of the same target, key,
+    metric and operator. Evaluating a group is one metric column, one join
+    of the rule values on the key column and one vectorized comparison, so
+    tens of thousands of rules cost a few column operations per refresh.
+    An alert is raised when a rule starts to hold for a card; it's raised
+    again only after the rule stopped holding in between.
+    """
+
+    def __init__(self, rules):
+        rules = rules.copy()
+        for col in RULE_COLUMNS:
+            if col not in rules.columns:
+                rules[col] = np.nan
+
+        rules["threshold"] = pd.to_numeric(rules["threshold"], errors="coerce")
+        rules["key"] = rules["key"].fillna(ALL_KEY).astype(str).str.strip()
+        valid = (rules["rule"].notna() & rules["target"].isin(list(TARGETS)) & rules["op"].isin(list(OPERATORS))
+                 & rules["threshold"].notna() & rules["metric"].notna())
+        valid &= (rules["key"] == ALL_KEY) | rules["value"].notna()
+
+        self.invalid = rules[~valid]
+        self.rules = rules[valid].drop_duplicates(subset=["rule"], keep="last").reset_index(drop=True)
+        self.rules["value"] = self.rules["value"].astype(object)
+
+        # Row positions of the rules of every (target, key, metric, op)
+        self.groups = {target: [] for target in TARGETS}
+        for (target, key, metric, op), group in self.rules.groupby(["target", "key", "metric", "op"], sort=False):
+            self.groups[target].append((key, metric, op, group.index.to_numpy()))
+
+        # (rule, subject) pairs that held at the last evaluation
+        self.active = pd.DataFrame({"rule": pd.Series(dtype=object), "subject": pd.Series(dtype=object)})
+
+        # Alerts raised since the last take_alerts()
+        self.alerts = []
+
+    def __len__(self):
+        return len(self.rules)
+
+    def watched_ids(self):
+        # Printings named by 'cards' rules, so they can be added to the card table
+        by_id = (self.rules["target"] == "cards") & (self.rules["key"] == "id")
+        return self.rules.loc[by_id, "value"].dropna().unique()
+
+    def matches(self, df, target):
+        """
+        Every (rule position, row position) where a rule of 'target' holds
+        on 'df', and the metric value there.
+        """
+        rule_parts, row_parts, value_parts = [], [], []
+        metrics = {}
+        thresholds = self.rules["threshold"].to_numpy(dtype=float)
+
+        for key, metric, op, rule_positions in self.groups[target]:
+            if metric not in metrics:
+                metrics[metric] = metric_values(df, metric)
+            values = metrics[metric]
+            if values is None:
+                continue
+            compare = OPERATORS[op]
+
+            if key == ALL_KEY:
+                # Rules without a key see every row: one comparison per rule
+                for position in rule_positions:
+                    rows = np.flatnonzero(compare(values, thresholds[position]))
+                    rule_parts.append(np.full(len(rows), position))
+                    row_parts.append(rows)
+                    value_parts.append(values[rows])
+                continue
+
+            if key not in df.columns:
+                continue
+
+            # Rows of the key values the rules name, paired with their rules
+            rule_values = self.rules.loc[rule_positions, "value"].astype(str)
+            wanted = df[key].isin(rule_values.unique()).to_numpy(dtype=bool)
+            rows = pd.DataFrame({"value": df[key][wanted].astype(str).to_numpy(), "row": np.flatnonzero(wanted)})
+            pairs = rows.merge(pd.DataFrame({"value": rule_values.to_numpy(), "position": rule_positions}), on="value")
+
+            pair_rows, pair_rules = pairs["row"].to_numpy(), pairs["position"].to_numpy()
+            holds = compare(values[pair_rows], thresholds[pair_rules])
+            rule_parts.append(pair_rules[holds])
+            row_parts.append(pair_rows[holds])
+            value_parts.append(values[pair_rows[holds]])
+
+        if not rule_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+
+        return (np.concatenate(rule_parts).astype(np.int64), np.concatenate(row_parts).astype(np.int64),
+                np.concatenate(value_parts))
+
+    def evaluate(self, df, target, date=None):
+        """
+        Evaluates the rules of 'target' on 'df' and keeps the alerts of the
+        rules that started to hold. Returns the number of new alerts.
+        """
+        if not self.groups[target]:
+            return 0
+
+        subject_col = TARGETS[target]
+        rule_positions, row_positions, values = self.matches(df, target)
+        subjects = df[subject_col].iloc[row_positions].to_numpy(dtype=object) if subject_col in df.columns else np.full(len(row_positions), None)
+
+        holding = pd.DataFrame({
+            "rule": self.rules["rule"].to_numpy(dtype=object)[rule_positions],
+            "subject": subjects,
+            "position": rule_positions,
+            "row": row_positions,
+            "value": values,
+        })
+
+        # New alerts: pairs that didn't hold at the last evaluation
+        known = holding.merge(self.active, on=["rule", "subject"], how="left", indicator=True)["_merge"] == "both"
+        new = holding[~known.to_numpy()]
+
+        # Pairs of subjects outside 'df' (e.g. unloaded partitions) keep their state
+        target_rules = self.rules.loc[self.rules["target"] == target, "rule"]
+        active_subjects = self.active["subject"].unique()
+        present = df[subject_col][df[subject_col].isin(active_subjects)].unique() if subject_col in df.columns else []
+        outside = ~(self.active["rule"].isin(target_rules) & self.active["subject"].isin(present))
+        self.active = pd.concat([self.active[outside], holding[["rule", "subject"]]], ignore_index=True)
+
+        if not new.empty:
+            rules = self.rules.iloc[new["position"].to_numpy()]
+            self.alerts.append(pd.DataFrame({
+                "date": pd.Timestamp(date if date is not None else pd.Timestamp.now()).floor("s"),
+                "rule": new["rule"].to_numpy(),
+                "target": target,
+                "subject": new["subject"].to_numpy(),
+                "name": df["name"].iloc[new["row"].to_numpy()].to_numpy(dtype=object) if "name" in df.columns else None,
+                "metric": rules["metric"].to_numpy(),
+                "op": rules["op"].to_numpy(),
+                "threshold": rules["threshold"].to_numpy(),
+                "value": np.round(new["value"].to_numpy(), 2),
+                "comment": rules["comment"].to_numpy(),
+            }, columns=ALERT_COLUMNS))
+        return len(new)
+
+    def take_alerts(self):
+        # The alerts raised since the last call, as one DataFrame
+        alerts = pd.concat(self.alerts, ignore_index=True) if self.alerts else pd.DataFrame(columns=ALERT_COLUMNS)
+        self.alerts = []
+        return alerts
+
+
+def read_csv(file_path, csv_config=None, **kwargs):
+    csv_config = csv_config or {}
+    return pd.read_csv(file_path, sep=csv_config.get("sep", ","), decimal=csv_config.get("decimal", "."),
+                       encoding=csv_config.get("encoding", "utf-8"), **kwargs)
+
+
+def load_watchlist(file_path, state_path=None, csv_config=None):
+    """
+    The watchlist of the rules file 'file_path', None if there is none.
+    'state_path' holds the rules that held at the last evaluation.
+    """
+    if not os.path.exists(file_path):
+        return None
+
+    watchlist = Watchlist(read_csv(file_path, csv_config, dtype={"value": object, "rule": object}))
+    for _, rule in watchlist.invalid.iterrows():
+        print(f"Invalid watchlist rule '{rule['rule']}'. Skipping...")
+
+    if state_path is not None and os.path.exists(state_path):
+        state = read_csv(state_path, csv_config, dtype=object)
+        if {"rule", "subject"} <= set(state.columns):
+            watchlist.active = state[["rule", "subject"]]
+    return watchlist
+
+
+def save_state(watchlist, state_path, csv_config=None):
+    us.atomic_write(state_path, us.serialize_csv(watchlist.active, csv_config))
+
+
+def log_alerts(alerts, file_path, csv_config=None):
+    # Appends alerts to the log. The header is written with the first ones
+    if alerts.empty:
+        return 0
+    csv_config = dict(csv_config or {})
+    exists = os.path.exists(file_path)
+
+    # A byte order mark only belongs at the start of the file
+    if exists and csv_config.get("encoding") == "utf-8-sig":
+        csv_config["encoding"] = "utf-8"
+    alerts.to_csv(file_path, mode="a", header=not exists, index=False, **csv_config)
+    return len(alerts)
+
+
+def main():
+    # Evaluates the watchlist on the saved collection without refreshing prices
+    # Usage: python utils_watchlist.py config.json
+
+    config_file = sys.argv[1]
+    inputs = ui.get_parameters(config_file)
+
+    BASE_DIR = Path(__file__).resolve().parent
+    DATA_DIR = BASE_DIR / inputs["data_folder"]
+
+    csv_config = inputs["csv_config"]
+    watchlist_path = DATA_DIR / inputs.get("watchlist_file", "watchlist.csv")
+    watchlist = load_watchlist(watchlist_path, csv_config=csv_config)
+    if watchlist is None:
+        print(f"No watchlist at '{watchlist_path}'.")
+        return 1
+
+    vault = ud.load_collection_to_df(DATA_DIR / inputs["vault_file"], inputs["data_column_types"], csv_config)
+    watchlist.evaluate(vault, "vault")
+
+    cards_path = DATA_DIR / inputs.get("cards_file", "cards.csv")
+    if os.path.exists(cards_path):
+        cards = ud.load_collection_to_df(cards_path, inputs["card_column_types"], csv_config)
+        watchlist.evaluate(cards, "cards")
+
+    alerts = watchlist.take_alerts()
+    print(f"{len(watchlist)} rules, {len(alerts)} holding.")
+    ud.display_dynamic_df(alerts, title="Watchlist")
+    return 0
+
+
+if __name__ == '__main__':
+    main()